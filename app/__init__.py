@@ -21,16 +21,145 @@ def create_app(config_name='default'):
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
         UPLOAD_FOLDER='uploads',
         MAX_CONTENT_LENGTH=int(os.environ.get('UPLOAD_MAX_MB', 20)) * 1024 * 1024,
-        WTF_CSRF_TIME_LIMIT=None
+        WTF_CSRF_TIME_LIMIT=None,
+        # Approximate totals on keyset-paginated lists are capped here; 0 disables counting
+        PAGINATION_COUNT_LIMIT=int(os.environ.get('PAGINATION_COUNT_LIMIT', 1000)),
+        # Upper bound on ranked full-text matches considered by /search
+        SEARCH_MAX_MATCHES=int(os.environ.get('SEARCH_MAX_MATCHES', 1000)),
+        # Process-level cache of each user's project ids. Changes reach the other processes
+        # over SOCKETIO_MESSAGE_QUEUE; several processes without a queue need a TTL of ~1 (0 never expires)
+        MEMBERSHIP_CACHE_SIZE=int(os.environ.get('MEMBERSHIP_CACHE_SIZE', 1024)),
+        MEMBERSHIP_CACHE_TTL=int(os.environ.get('MEMBERSHIP_CACHE_TTL', 60)),
+        # Username -> user id map used to resolve @mentions; cleared on user writes
+        MENTION_CACHE_TTL=int(os.environ.get('MENTION_CACHE_TTL', 300)),
+        # Conditional GETs (ETag) on task, project, board, dashboard and
+        # recent-notification pages; the version defaults to the templates' latest mtime
+        HTTP_CACHE_ENABLED=os.environ.get('HTTP_CACHE_ENABLED', 'True').lower() == 'true',
+        HTTP_CACHE_VERSION=os.environ.get('HTTP_CACHE_VERSION'),
+        # Rendered board cards served to boards by /tasks/<id>/card, kept per card version
+        BOARD_CARD_CACHE_SIZE=int(os.environ.get('BOARD_CARD_CACHE_SIZE', 1024)),
+        # Dashboard/system stats are cached per scope for this many seconds; 0 disables
+        STATS_CACHE_TTL=int(os.environ.get('STATS_CACHE_TTL', 30)),
+        # Rows fetched per round-trip by the streaming task export
+        EXPORT_BATCH_SIZE=int(os.environ.get('EXPORT_BATCH_SIZE', 500)),
+        # Background jobs (email, socket fan-out, activity archive and notification retention)
+        JOB_WORKERS=int(os.environ.get('JOB_WORKERS', 2)),  # 0 = only `flask jobs work` runs jobs
+        JOB_POLL_INTERVAL=float(os.environ.get('JOB_POLL_INTERVAL', 5)),  # seconds
+        JOB_MAX_ATTEMPTS=int(os.environ.get('JOB_MAX_ATTEMPTS', 5)),
+        JOB_RETRY_BASE=float(os.environ.get('JOB_RETRY_BASE', 10)),  # seconds, doubled per attempt
+        JOB_RETRY_MAX=float(os.environ.get('JOB_RETRY_MAX', 3600)),
+        JOB_LOCK_TIMEOUT=int(os.environ.get('JOB_LOCK_TIMEOUT', 600)),  # running jobs older than this are retried
+        # Write-behind activity log: batched inserts every N seconds or N rows
+        ACTIVITY_LOG_SYNC=os.environ.get('ACTIVITY_LOG_SYNC', 'False').lower() == 'true',
+        ACTIVITY_LOG_BATCH_SIZE=int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', 500)),
+        ACTIVITY_LOG_FLUSH_INTERVAL=float(os.environ.get('ACTIVITY_LOG_FLUSH_INTERVAL', 0.5)),  # seconds
+        ACTIVITY_LOG_QUEUE_SIZE=int(os.environ.get('ACTIVITY_LOG_QUEUE_SIZE', 10000)),
+        # Failed batch inserts are retried with backoff (flush interval doubled, up to
+        # ACTIVITY_LOG_RETRY_MAX seconds) and dropped after this many attempts
+        ACTIVITY_LOG_MAX_ATTEMPTS=int(os.environ.get('ACTIVITY_LOG_MAX_ATTEMPTS', 8)),
+        ACTIVITY_LOG_RETRY_MAX=float(os.environ.get('ACTIVITY_LOG_RETRY_MAX', 30)),
+        # Outgoing mail (skipped when SMTP_SERVER is unset); sent by job workers over pooled connections
+        SMTP_SERVER=os.environ.get('SMTP_SERVER'),
+        SMTP_PORT=int(os.environ.get('SMTP_PORT', 587)),
+        SMTP_USERNAME=os.environ.get('SMTP_USERNAME'),
+        SMTP_PASSWORD=os.environ.get('SMTP_PASSWORD'),
+        SMTP_USE_TLS=os.environ.get('SMTP_USE_TLS', 'True').lower() == 'true',
+        MAIL_SENDER=os.environ.get('MAIL_SENDER'),  # defaults to SMTP_USERNAME
+        MAIL_POOL_SIZE=int(os.environ.get('MAIL_POOL_SIZE', 2)),
+        MAIL_BATCH_SIZE=int(os.environ.get('MAIL_BATCH_SIZE', 50)),  # messages per connection checkout
+        MAIL_RATE_LIMIT=float(os.environ.get('MAIL_RATE_LIMIT', 10)),  # messages per second; 0 = unlimited
+        MAIL_KEEPALIVE=int(os.environ.get('MAIL_KEEPALIVE', 30)),  # idle seconds before a NOOP check
+        MAIL_MAX_IDLE=int(os.environ.get('MAIL_MAX_IDLE', 300)),  # idle connections older than this are closed
+        MAIL_TIMEOUT=int(os.environ.get('MAIL_TIMEOUT', 30)),
+        # Activity rows older than N days move to compressed monthly segment files; 0 disables
+        ACTIVITY_ARCHIVE_AFTER_DAYS=int(os.environ.get('ACTIVITY_ARCHIVE_AFTER_DAYS', 180)),
+        ACTIVITY_ARCHIVE_DIR=os.environ.get('ACTIVITY_ARCHIVE_DIR', 'archive/activity'),
+        ACTIVITY_ARCHIVE_BATCH_SIZE=int(os.environ.get('ACTIVITY_ARCHIVE_BATCH_SIZE', 10000)),
+        ACTIVITY_ARCHIVE_BLOCK_SIZE=int(os.environ.get('ACTIVITY_ARCHIVE_BLOCK_SIZE', 500)),  # rows per gzip member
+        ACTIVITY_ARCHIVE_INTERVAL=int(os.environ.get('ACTIVITY_ARCHIVE_INTERVAL', 3600)),  # seconds; 0 = CLI only
+        # Notification retention: old read notifications and the oldest beyond the
+        # per-user cap move to notification_archive; 0 disables a rule
+        NOTIFICATION_ARCHIVE_AFTER_DAYS=int(os.environ.get('NOTIFICATION_ARCHIVE_AFTER_DAYS', 90)),
+        NOTIFICATION_INBOX_CAP=int(os.environ.get('NOTIFICATION_INBOX_CAP', 500)),
+        NOTIFICATION_RETENTION_BATCH_SIZE=int(os.environ.get('NOTIFICATION_RETENTION_BATCH_SIZE', 500)),
+        # Repeated notifications about the same task within this many seconds update one row; 0 disables
+        NOTIFICATION_COALESCE_WINDOW=int(os.environ.get('NOTIFICATION_COALESCE_WINDOW', 300)),
+        NOTIFICATION_RETENTION_INTERVAL=int(os.environ.get('NOTIFICATION_RETENTION_INTERVAL', 3600)),  # seconds; 0 = CLI only
+        # Socket.IO server: threading, eventlet or gevent (the latter two need `python app.py`
+        # or a matching gunicorn worker); socket handlers run DB work on a pool of this many threads
+        SOCKETIO_ASYNC_MODE=os.environ.get('SOCKETIO_ASYNC_MODE', 'threading'),
+        SOCKETIO_DB_POOL_SIZE=int(os.environ.get('SOCKETIO_DB_POOL_SIZE', 8)),
+        # Message queue shared by several server processes: redis://..., amqp://... or a local
+        # sqlite:///path queue; unset = a single process. `flask jobs work` emits through it
+        SOCKETIO_MESSAGE_QUEUE=os.environ.get('SOCKETIO_MESSAGE_QUEUE'),
+        SOCKETIO_CHANNEL=os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio'),
+        SOCKETIO_QUEUE_POLL_INTERVAL=float(os.environ.get('SOCKETIO_QUEUE_POLL_INTERVAL', 0.02)),  # sqlite, seconds
+        SOCKETIO_QUEUE_RETENTION=int(os.environ.get('SOCKETIO_QUEUE_RETENTION', 60)),  # sqlite, seconds
+        # Share of socket connect/join events written to the structured log (denials are always logged)
+        SOCKET_LOG_SAMPLE_RATE=float(os.environ.get('SOCKET_LOG_SAMPLE_RATE', 0.1)),
+        # Project events to a room within this many seconds of its last frame are coalesced per
+        # task and sent as one `batch` frame of at most N events; 0 sends every event at once
+        SOCKET_BATCH_WINDOW=float(os.environ.get('SOCKET_BATCH_WINDOW', 0.05)),
+        SOCKET_BATCH_MAX_SIZE=int(os.environ.get('SOCKET_BATCH_MAX_SIZE', 50)),
+        # Recent socket events kept per project for `resync` after a reconnect; older gaps get a board snapshot
+        PROJECT_EVENT_LOG_SIZE=int(os.environ.get('PROJECT_EVENT_LOG_SIZE', 200)),
+        # SQLite engine profile, applied to every pooled connection
+        SQLITE_PRAGMAS_ENABLED=os.environ.get('SQLITE_PRAGMAS_ENABLED', 'True').lower() == 'true',
+        SQLITE_JOURNAL_MODE=os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        SQLITE_SYNCHRONOUS=os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        SQLITE_BUSY_TIMEOUT=int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms
+        SQLITE_CACHE_SIZE=int(os.environ.get('SQLITE_CACHE_SIZE', -65536)),  # negative = KiB
+        SQLITE_MMAP_SIZE=int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        SQLITE_TEMP_STORE=os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+        SQLITE_STARTUP_CHECK=os.environ.get('SQLITE_STARTUP_CHECK', 'True').lower() == 'true',
+        DB_POOL_SIZE=int(os.environ.get('DB_POOL_SIZE', 10)),
+        DB_MAX_OVERFLOW=int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        DB_POOL_TIMEOUT=int(os.environ.get('DB_POOL_TIMEOUT', 30))
     )
     
+    from .database import engine_options, init_database
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    
     # Initialize extensions
     from .extensions import db, login_manager, csrf, socketio
     
     db.init_app(app)
+    init_database(app, db)
+    
+    from .membership import configure_membership_cache
+    configure_membership_cache(app)
+    
+    from .mentions import configure_mention_directory
+    configure_mention_directory(app)
+    
+    from .http_cache import configure_http_cache
+    configure_http_cache(app)
+    
+    from .board import configure_card_cache
+    configure_card_cache(app)
+    
+    from .stats import configure_stats_cache
+    configure_stats_cache(app)
+    
+    from .activity import configure_activity_writer
+    configure_activity_writer(app)
+    
+    from .activity_archive import configure_activity_archive
+    configure_activity_archive(app)
+    
+    from .mail import configure_mail
+    configure_mail(app)
     login_manager.init_app(app)
     csrf.init_app(app)
-    socketio.init_app(app, async_mode='threading')
+    
+    from .offload import check_async_mode, configure_offload
+    from .message_queue import queue_manager
+    socketio.init_app(app, async_mode=check_async_mode(app.config['SOCKETIO_ASYNC_MODE']),
+                      client_manager=queue_manager(app.config))
+    configure_offload(app)
+    
+    from .socket_metrics import configure_socket_metrics
+    configure_socket_metrics(app)
     
     # Login manager configuration
     login_manager.login_view = 'auth.login'
@@ -64,6 +193,23 @@ def create_app(config_name='default'):
     # Register socket events
     from . import sockets
     
+    # Keep the full-text search index in sync with task/project/comment writes
+    from . import search
+    
+    # Keep comment/attachment/task/member counter columns in sync
+    from . import counters
+    
+    # Periodic archiving of old notifications
+    from . import retention
+    
+    # Background job workers start with the first request
+    from .jobs import init_jobs
+    init_jobs(app)
+
+    # Register CLI commands
+    from .commands import register_commands
+    register_commands(app)
+
     # Database tables will be created separately
     
     return app
\ No newline at end of file
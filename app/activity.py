@@ -0,0 +1,265 @@
+"""
+Write-behind activity log.
+
+`log_activity` entries are held on the session until it commits, then handed
+to a process-wide writer that inserts them in `executemany` batches every
+ACTIVITY_LOG_FLUSH_INTERVAL seconds or ACTIVITY_LOG_BATCH_SIZE rows, instead
+of a commit (and fsync) per entry. Pending entries are flushed at exit and on
+SIGTERM. A batch that fails to insert (a locked or full database) is kept
+and retried with backoff before anything newer is written; its rows are
+only dropped after ACTIVITY_LOG_MAX_ATTEMPTS failed inserts. With ACTIVITY_LOG_SYNC the entry is written in the caller's own
+transaction, which keeps tests deterministic.
+"""
+
+import atexit
+import json
+import queue
+import signal
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .extensions import db
+from .jobs import retry_delay
+
+
+class ActivityWriter:
+    """Bounded queue of activity rows drained by a background flusher thread"""
+
+    def __init__(self, max_queue=10000, batch_size=500, flush_interval=0.5, max_attempts=8, retry_max=30):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_max = retry_max
+        # The batch whose insert failed: {'rows', 'attempts', 'retry_at'}
+        self._retry = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._app = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        # Re-entrant so a SIGTERM arriving mid-flush cannot deadlock shutdown
+        self._flush_lock = threading.RLock()
+        self._start_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'flushes': 0,
+            'inline_flushes': 0,
+            'errors': 0,
+            'retries': 0,
+            'dropped': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    def configure(self, app):
+        self._app = app
+        self.batch_size = app.config.get('ACTIVITY_LOG_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('ACTIVITY_LOG_FLUSH_INTERVAL', 0.5)
+        self.max_attempts = app.config.get('ACTIVITY_LOG_MAX_ATTEMPTS', 8)
+        self.retry_max = app.config.get('ACTIVITY_LOG_RETRY_MAX', 30)
+        max_queue = app.config.get('ACTIVITY_LOG_QUEUE_SIZE', 10000)
+        if max_queue != self._queue.maxsize:
+            self._queue = queue.Queue(maxsize=max_queue)
+
+    def submit(self, rows):
+        """Queue rows for insertion; a full queue is flushed by the caller"""
+        self._ensure_started()
+        for row in rows:
+            # Back-pressure instead of dropping entries: other threads may
+            # refill the queue right after our flush, and a failed batch
+            # blocks it until its retry succeeds, so keep waiting
+            while True:
+                try:
+                    self._queue.put(row, timeout=self.flush_interval)
+                    break
+                except queue.Full:
+                    self._stats['inline_flushes'] += 1
+                    self.flush()
+            self._stats['enqueued'] += 1
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def _drain(self):
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _insert(self, rows):
+        """Insert one batch; False (with the batch kept for a retry) if it failed"""
+        from .models import ActivityLog
+
+        started = time.perf_counter()
+        try:
+            with self._app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(ActivityLog.__table__.insert(), rows)
+        except Exception:
+            self._stats['errors'] += 1
+            attempts = self._retry['attempts'] + 1 if self._retry else 1
+            if attempts >= self.max_attempts:
+                self._retry = None
+                self._stats['dropped'] += len(rows)
+                self._app.logger.exception(
+                    f'Dropped {len(rows)} activity log entries after {attempts} failed attempts'
+                )
+            else:
+                self._retry = {
+                    'rows': rows,
+                    'attempts': attempts,
+                    'retry_at': time.monotonic() + retry_delay(attempts, self.flush_interval, self.retry_max),
+                }
+                self._app.logger.warning(
+                    f'Failed to write {len(rows)} activity log entries (attempt {attempts}), will retry',
+                    exc_info=True
+                )
+            return False
+
+        elapsed = (time.perf_counter() - started) * 1000
+        self._retry = None
+        self._stats['written'] += len(rows)
+        self._stats['flushes'] += 1
+        self._stats['last_flush_ms'] = elapsed
+        self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed)
+        self._stats['total_flush_ms'] += elapsed
+        return True
+
+    def flush(self, force=False):
+        """Write everything queued so far; returns the number of rows written.
+
+        A failed batch is retried first, once its backoff has passed (at once
+        with `force`, used at shutdown); nothing more is written until it
+        succeeds.
+        """
+        written = 0
+        with self._flush_lock:
+            if self._retry is not None:
+                if not force and time.monotonic() < self._retry['retry_at']:
+                    return 0
+                rows = self._retry['rows']
+                self._stats['retries'] += 1
+                if not self._insert(rows):
+                    return 0
+                written += len(rows)
+            while True:
+                rows = self._drain()
+                if not rows:
+                    break
+                if not self._insert(rows):
+                    break
+                written += len(rows)
+        return written
+
+    def metrics(self):
+        stats = dict(self._stats)
+        total = stats.pop('total_flush_ms')
+        stats['avg_flush_ms'] = total / stats['flushes'] if stats['flushes'] else 0.0
+        stats['queue_depth'] = self._queue.qsize()
+        stats['retry_pending'] = len(self._retry['rows']) if self._retry else 0
+        stats['queue_capacity'] = self._queue.maxsize
+        stats['running'] = bool(self._thread and self._thread.is_alive())
+        return stats
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._app is None:
+                self._app = current_app._get_current_object()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='activity-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def shutdown(self):
+        """Stop the flusher thread and write whatever is still queued"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        if self._app is not None:
+            self.flush(force=True)
+
+
+writer = ActivityWriter()
+
+
+def _install_shutdown_hooks():
+    atexit.register(writer.shutdown)
+
+    # Flush on SIGTERM too, then defer to the previous handler
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def _on_sigterm(signum, frame):
+            writer.shutdown()
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, _on_sigterm)
+    except ValueError:
+        # Not in the main thread (e.g. some embedded servers); atexit still applies
+        pass
+
+
+_hooks_installed = False
+
+
+def configure_activity_writer(app):
+    global _hooks_installed
+    writer.configure(app)
+    if not app.config.get('ACTIVITY_LOG_SYNC') and not _hooks_installed:
+        _install_shutdown_hooks()
+        _hooks_installed = True
+
+
+def log_activity(actor_user_id, entity_type, entity_id, action, description, meta=None):
+    """Record an activity; it is written once the caller's transaction commits"""
+    from .models import ActivityLog
+
+    row = {
+        'actor_user_id': actor_user_id,
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'action': action,
+        'description': description,
+        'meta_json': json.dumps(meta) if meta else None,
+        'created_at': datetime.utcnow(),
+    }
+
+    if current_app.config.get('ACTIVITY_LOG_SYNC'):
+        db.session.add(ActivityLog(**row))
+    else:
+        db.session.info.setdefault('pending_activity', []).append(row)
+    return row
+
+
+@event.listens_for(Session, 'after_commit')
+def _submit_pending_activity(session):
+    rows = session.info.pop('pending_activity', None)
+    if rows:
+        writer.submit(rows)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_activity(session):
+    session.info.pop('pending_activity', None)
@@ -0,0 +1,422 @@
+"""
+Cold storage for the activity log.
+
+Activity rows older than ACTIVITY_ARCHIVE_AFTER_DAYS are rolled out of the
+`activity_log` table into immutable, gzip-compressed NDJSON segments, one or
+more per month (`activity-YYYY-MM-NNN.ndjson.gz`). A segment is a series of
+independent gzip members of ACTIVITY_ARCHIVE_BLOCK_SIZE rows each, so it is
+still a plain .gz file for zcat, while the sidecar `.idx.json` records the
+byte range, id range and time range of every block and which blocks hold
+each (entity_type, entity_id). Readers map the segment with mmap and inflate
+only the blocks a query can touch.
+
+`activity_page` reads the hot table and the segments together (optionally
+for one entity), so callers don't need to know where a row lives. If a roll is
+interrupted between writing a segment and deleting its rows, the rows exist
+in both tiers until the next roll; readers return them once.
+"""
+
+import gzip
+import json
+import mmap
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .extensions import db
+from .jobs import periodic_job
+from .pagination import keyset_rows, merge_paginate
+
+SEGMENT_PATTERN = re.compile(r'^activity-(\d{4}-\d{2})-(\d{3})\.idx\.json$')
+
+ROW_FIELDS = ('id', 'actor_user_id', 'entity_type', 'entity_id', 'action', 'description', 'meta_json', 'created_at')
+
+
+class ArchivedActivity:
+    """Read-only activity row loaded from a segment (same attributes as ActivityLog)"""
+
+    __slots__ = ROW_FIELDS
+
+    def __init__(self, record):
+        for field in ROW_FIELDS:
+            setattr(self, field, record.get(field))
+        self.created_at = datetime.fromisoformat(self.created_at)
+
+    @property
+    def actor(self):
+        from .models import User
+        return db.session.get(User, self.actor_user_id)
+
+    def get_meta(self):
+        if self.meta_json:
+            try:
+                return json.loads(self.meta_json)
+            except ValueError:
+                return {}
+        return {}
+
+    def __repr__(self):
+        return f'<ArchivedActivity {self.action} {self.entity_type}>'
+
+
+def _sort_key(row):
+    return (row.created_at, row.id)
+
+
+def _entity_key(entity_type, entity_id):
+    return f'{entity_type}:{entity_id}'
+
+
+class Segment:
+    """One immutable segment file and its sidecar index"""
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.data_path = index_path[:-len('.idx.json')] + '.ndjson.gz'
+        with open(index_path, encoding='utf-8') as f:
+            self.index = json.load(f)
+        for block in self.index['blocks']:
+            block['min_key'] = (datetime.fromisoformat(block['first_created_at']), block['first_id'])
+            block['max_key'] = (datetime.fromisoformat(block['last_created_at']), block['last_id'])
+        self._map = None
+        self._lock = threading.Lock()
+
+    @property
+    def month(self):
+        return self.index['month']
+
+    def blocks(self, entity=None):
+        """(segment, block_number, block) for every block that may hold `entity`"""
+        if entity is None:
+            numbers = range(len(self.index['blocks']))
+        else:
+            numbers = self.index['entities'].get(_entity_key(*entity), [])
+        return [(self, number, self.index['blocks'][number]) for number in numbers]
+
+    def _read(self, offset, length):
+        with self._lock:
+            if self._map is None:
+                with open(self.data_path, 'rb') as f:
+                    try:
+                        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    except (OSError, ValueError):
+                        # No mmap on this platform/filesystem: plain reads
+                        self._map = False
+            if self._map is not False:
+                return self._map[offset:offset + length]
+        with open(self.data_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def read_block(self, number):
+        block = self.index['blocks'][number]
+        data = gzip.decompress(self._read(block['offset'], block['length']))
+        return [ArchivedActivity(json.loads(line)) for line in data.splitlines() if line]
+
+    def close(self):
+        with self._lock:
+            if self._map:
+                self._map.close()
+            self._map = None
+
+
+class SegmentStore:
+    """Directory of segments; indexes are cached until the directory changes"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._segments = {}
+        self._listed_at = None
+        self._lock = threading.Lock()
+
+    def configure(self, app):
+        path = app.config.get('ACTIVITY_ARCHIVE_DIR', 'archive/activity')
+        if path != self.path:
+            self.close()
+            self.path = path
+
+    def segments(self):
+        with self._lock:
+            if self.path is None or not os.path.isdir(self.path):
+                return []
+            listed_at = os.stat(self.path).st_mtime_ns
+            if listed_at != self._listed_at:
+                names = [name for name in os.listdir(self.path) if SEGMENT_PATTERN.match(name)]
+                segments = {}
+                for name in sorted(names):
+                    segments[name] = self._segments.pop(name, None) or Segment(os.path.join(self.path, name))
+                for stale in self._segments.values():
+                    stale.close()
+                self._segments = segments
+                self._listed_at = listed_at
+            return list(self._segments.values())
+
+    def scan(self, values, forward, limit, entity=None):
+        """Up to `limit` archived rows strictly past `values`, in scan order.
+
+        Blocks are visited in key order and inflated only while they can
+        still contribute to the first `limit` rows. A row archived twice (a
+        roll retried after writing its segment) is returned once, so copies
+        don't take the place of other rows within `limit`.
+        """
+        bound = tuple(values) if values is not None else None
+        candidates = []
+        for segment in self.segments():
+            for item in segment.blocks(entity):
+                block = item[2]
+                if bound is not None and (block['min_key'] >= bound if forward else block['max_key'] <= bound):
+                    continue
+                candidates.append(item)
+        candidates.sort(key=lambda item: item[2]['max_key' if forward else 'min_key'], reverse=forward)
+
+        rows = []
+        seen = set()
+        for segment, number, block in candidates:
+            if len(rows) >= limit:
+                edge = block['max_key'] if forward else block['min_key']
+                worst = _sort_key(rows[limit - 1])
+                if (edge < worst) if forward else (edge > worst):
+                    break
+            for row in segment.read_block(number):
+                if entity is not None and (row.entity_type, row.entity_id) != entity:
+                    continue
+                key = _sort_key(row)
+                if bound is not None and ((key >= bound) if forward else (key <= bound)):
+                    continue
+                if key in seen:
+                    continue
+                seen.add(key)
+                rows.append(row)
+            rows.sort(key=_sort_key, reverse=forward)
+            del rows[limit:]
+        return rows
+
+    def next_part(self, month):
+        parts = [
+            int(match.group(2))
+            for match in (SEGMENT_PATTERN.match(name) for name in os.listdir(self.path))
+            if match and match.group(1) == month
+        ]
+        return max(parts, default=0) + 1
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments = {}
+            self._listed_at = None
+
+
+store = SegmentStore()
+
+
+def configure_activity_archive(app):
+    store.configure(app)
+
+
+def _write_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+_EXCLUSIVE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+
+
+def _create_segment(month):
+    """Claim the next free part of `month` by creating its data file exclusively.
+
+    Returns (base path, open binary file). Concurrent rolls (the periodic job
+    and `flask activity archive`) each get their own part instead of
+    overwriting the same one; a data file without an index is not a segment
+    yet, so readers skip it while it is written.
+    """
+    part = store.next_part(month)
+    while True:
+        base = os.path.join(store.path, f'activity-{month}-{part:03d}')
+        try:
+            fd = os.open(base + '.ndjson.gz', _EXCLUSIVE_FLAGS, 0o644)
+        except FileExistsError:
+            # Claimed by another roll, or left by one that crashed before writing its index
+            part += 1
+            continue
+        return base, os.fdopen(fd, 'wb')
+
+
+def write_segment(month, records, block_size=500):
+    """Write `records` (dicts ordered by created_at, id) as a new segment of `month`"""
+    os.makedirs(store.path, exist_ok=True)
+
+    data = bytearray()
+    blocks = []
+    entities = {}
+    for start in range(0, len(records), block_size):
+        chunk = records[start:start + block_size]
+        number = len(blocks)
+        payload = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in chunk)
+        member = gzip.compress(payload.encode('utf-8'), mtime=0)
+        # Rows are sorted by (created_at, id), so the first and last row bound the block
+        blocks.append({
+            'offset': len(data),
+            'length': len(member),
+            'rows': len(chunk),
+            'first_id': chunk[0]['id'],
+            'first_created_at': chunk[0]['created_at'],
+            'last_id': chunk[-1]['id'],
+            'last_created_at': chunk[-1]['created_at'],
+        })
+        data += member
+        for record in chunk:
+            numbers = entities.setdefault(_entity_key(record['entity_type'], record['entity_id']), [])
+            if not numbers or numbers[-1] != number:
+                numbers.append(number)
+
+    index = {
+        'version': 1,
+        'month': month,
+        'rows': len(records),
+        'bytes': len(data),
+        'min_created_at': records[0]['created_at'],
+        'max_created_at': records[-1]['created_at'],
+        'blocks': blocks,
+        'entities': entities,
+    }
+
+    # Data first: a segment only becomes visible once its index exists
+    base, f = _create_segment(month)
+    with f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    _write_atomic(base + '.idx.json', json.dumps(index, separators=(',', ':')).encode('utf-8'))
+    return base + '.ndjson.gz', index
+
+
+def _record(row):
+    return {
+        'id': row.id,
+        'actor_user_id': row.actor_user_id,
+        'entity_type': row.entity_type,
+        'entity_id': row.entity_id,
+        'action': row.action,
+        'description': row.description,
+        'meta_json': row.meta_json,
+        'created_at': row.created_at.isoformat(timespec='microseconds'),
+    }
+
+
+def roll_batch(report, config=None):
+    """Move one batch of old rows to segments in the current transaction.
+
+    Returns True if the batch was full, i.e. more rows are likely waiting.
+    """
+    from .models import ActivityLog
+
+    config = config or current_app.config
+    older_than_days = config.get('ACTIVITY_ARCHIVE_AFTER_DAYS', 180)
+    batch_size = config.get('ACTIVITY_ARCHIVE_BATCH_SIZE', 10000)
+    block_size = config.get('ACTIVITY_ARCHIVE_BLOCK_SIZE', 500)
+    if older_than_days <= 0:
+        return False
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    rows = db.session.query(ActivityLog).filter(
+        ActivityLog.created_at < cutoff
+    ).order_by(ActivityLog.created_at, ActivityLog.id).limit(batch_size).all()
+    if not rows:
+        return False
+
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(row.created_at.strftime('%Y-%m'), []).append(_record(row))
+    for month, records in by_month.items():
+        path, index = write_segment(month, records, block_size)
+        report['segments'].append(os.path.basename(path))
+        report['bytes_written'] += index['bytes']
+
+    ids = [row.id for row in rows]
+    for start in range(0, len(ids), 500):
+        db.session.query(ActivityLog).filter(
+            ActivityLog.id.in_(ids[start:start + 500])
+        ).delete(synchronize_session=False)
+    report['rows'] += len(rows)
+    return len(rows) == batch_size
+
+
+def new_report():
+    return {'rows': 0, 'segments': [], 'bytes_written': 0, 'seconds': 0.0}
+
+
+def format_report(report):
+    return (
+        f"Archived {report['rows']} activity rows into {len(report['segments'])} segments "
+        f"({report['bytes_written'] / 1024:.1f} KiB) in {report['seconds']:.2f}s"
+    )
+
+
+def archive_activity_log(max_batches=None):
+    """Roll every eligible row into segments, committing after each batch"""
+    report = new_report()
+    started = time.perf_counter()
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            more = roll_batch(report)
+            db.session.commit()
+            batches += 1
+            if not more:
+                break
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        report['seconds'] = time.perf_counter() - started
+    return report
+
+
+@periodic_job('activity.archive', 'ACTIVITY_ARCHIVE_INTERVAL')
+def _archive_job():
+    report = new_report()
+    started = time.perf_counter()
+    more = roll_batch(report)
+    report['seconds'] = time.perf_counter() - started
+    if report['rows']:
+        current_app.logger.info(format_report(report))
+    return more
+
+
+def _hot_fetcher(entity=None):
+    from .models import ActivityLog
+
+    query = ActivityLog.query
+    if entity is not None:
+        query = query.filter_by(entity_type=entity[0], entity_id=entity[1])
+    columns = [ActivityLog.created_at, ActivityLog.id]
+
+    def fetch(values, forward, limit):
+        return keyset_rows(query, columns, values, forward, limit)
+    return fetch
+
+
+def _cold_fetcher(entity=None):
+    def fetch(values, forward, limit):
+        return store.scan(values, forward, limit, entity)
+    return fetch
+
+
+def activity_page(cursor=None, per_page=50, entity_type=None, entity_id=None):
+    """Newest-first KeysetPage over the hot table and the archived segments"""
+    entity = (entity_type, entity_id) if entity_type and entity_id is not None else None
+    return merge_paginate(
+        [_hot_fetcher(entity), _cold_fetcher(entity)],
+        lambda row: [row.created_at, row.id],
+        cursor=cursor,
+        per_page=per_page,
+    )
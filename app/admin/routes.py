@@ -1,9 +1,16 @@
 from flask import render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from . import bp
-from ..models import User, Project, Task, Tag, ActivityLog
+from ..models import User, Project, Task, Tag, Job
 from ..forms import UserForm, TagForm, BrandingForm
 from ..utils import admin_required, is_ajax_request, ajax_response, log_activity, save_uploaded_file
+from ..pagination import keyset_paginate
+from ..stats import system_stats as get_system_stats
+from ..jobs import job_counts, retry_job as requeue_job
+from ..activity import writer as activity_writer
+from ..activity_archive import activity_page
+from ..socket_metrics import socket_metrics
+from ..offload import pool as socket_db_pool
 from ..extensions import db
 from sqlalchemy import func, desc
 
@@ -52,7 +59,7 @@ def create_user():
             user.force_password_change = True
         
         db.session.add(user)
-        db.session.commit()
+        db.session.flush()  # To get the user ID
         
         log_activity(
             actor_user_id=current_user.id,
@@ -62,6 +69,8 @@ def create_user():
             description=f'کاربر جدید {user.full_name} ایجاد شد'
         )
         
+        db.session.commit()
+        
         flash(f'کاربر {user.full_name} با موفقیت ایجاد شد.', 'success')
         
         if is_ajax_request():
@@ -89,8 +98,6 @@ def edit_user(user_id):
         if form.password.data:
             user.set_password(form.password.data)
         
-        db.session.commit()
-        
         log_activity(
             actor_user_id=current_user.id,
             entity_type='User',
@@ -99,6 +106,8 @@ def edit_user(user_id):
             description=f'کاربر {user.full_name} ویرایش شد'
         )
         
+        db.session.commit()
+        
         flash(f'کاربر {user.full_name} با موفقیت ویرایش شد.', 'success')
         
         if is_ajax_request():
@@ -125,7 +134,6 @@ def delete_user(user_id):
     
     user_name = user.full_name
     db.session.delete(user)
-    db.session.commit()
     
     log_activity(
         actor_user_id=current_user.id,
@@ -135,6 +143,8 @@ def delete_user(user_id):
         description=f'کاربر {user_name} حذف شد'
     )
     
+    db.session.commit()
+    
     flash(f'کاربر {user_name} با موفقیت حذف شد.', 'success')
     
     if is_ajax_request():
@@ -162,7 +172,7 @@ def create_tag():
         )
         
         db.session.add(tag)
-        db.session.commit()
+        db.session.flush()  # To get the tag ID
         
         log_activity(
             actor_user_id=current_user.id,
@@ -172,6 +182,8 @@ def create_tag():
             description=f'برچسب جدید "{tag.name}" ایجاد شد'
         )
         
+        db.session.commit()
+        
         flash(f'برچسب "{tag.name}" با موفقیت ایجاد شد.', 'success')
         
         if is_ajax_request():
@@ -192,8 +204,6 @@ def edit_tag(tag_id):
         tag.name = form.name.data
         tag.color = form.color.data
         
-        db.session.commit()
-        
         log_activity(
             actor_user_id=current_user.id,
             entity_type='Tag',
@@ -202,6 +212,8 @@ def edit_tag(tag_id):
             description=f'برچسب "{tag.name}" ویرایش شد'
         )
         
+        db.session.commit()
+        
         flash(f'برچسب "{tag.name}" با موفقیت ویرایش شد.', 'success')
         
         if is_ajax_request():
@@ -219,7 +231,6 @@ def delete_tag(tag_id):
     
     tag_name = tag.name
     db.session.delete(tag)
-    db.session.commit()
     
     log_activity(
         actor_user_id=current_user.id,
@@ -229,6 +240,8 @@ def delete_tag(tag_id):
         description=f'برچسب "{tag_name}" حذف شد'
     )
     
+    db.session.commit()
+    
     flash(f'برچسب "{tag_name}" با موفقیت حذف شد.', 'success')
     
     if is_ajax_request():
@@ -240,43 +253,75 @@ def delete_tag(tag_id):
 @login_required
 @admin_required
 def activity_log():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
+    entity_type = request.args.get('entity_type')
+    entity_id = request.args.get('entity_id', type=int)
     
-    activities = ActivityLog.query.order_by(desc(ActivityLog.created_at)).paginate(
-        page=page, per_page=50, error_out=False
-    )
+    # Recent rows come from the table, older ones from the archived segments
+    activities = activity_page(cursor=cursor, per_page=50, entity_type=entity_type, entity_id=entity_id)
     
     return render_template('admin/activity_log.html', activities=activities)
 
+@bp.route('/activity-log/writer')
+@login_required
+@admin_required
+def activity_writer_metrics():
+    # Queue depth and flush latency of the write-behind activity log
+    return jsonify(activity_writer.metrics())
+
+@bp.route('/sockets')
+@login_required
+@admin_required
+def sockets_metrics():
+    # Subscribers per room, fan-out per emitted event and the socket DB pool
+    return jsonify(dict(socket_metrics(), db_pool=socket_db_pool.metrics()))
+
+@bp.route('/jobs')
+@login_required
+@admin_required
+def jobs():
+    cursor = request.args.get('cursor')
+    status = request.args.get('status')
+    
+    query = Job.query
+    if status:
+        query = query.filter_by(status=status)
+    
+    jobs = keyset_paginate(query, [Job.run_at, Job.id], cursor=cursor, per_page=50)
+    
+    return render_template('admin/jobs.html', jobs=jobs, counts=job_counts(), status=status)
+
+@bp.route('/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+@admin_required
+def retry_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    
+    if job.status != 'failed':
+        flash('فقط کارهای پس‌زمینه ناموفق قابل تکرار هستند.', 'error')
+        return redirect(url_for('admin.jobs'))
+    
+    requeue_job(job)
+    db.session.commit()
+    
+    flash(f'کار پس‌زمینه #{job.id} دوباره در صف قرار گرفت.', 'success')
+    
+    if is_ajax_request():
+        return ajax_response(redirect_url=url_for('admin.jobs'))
+    
+    return redirect(url_for('admin.jobs'))
+
 @bp.route('/system-stats')
 @login_required
 @admin_required
 def system_stats():
-    # Get system statistics
-    stats = {
-        'total_users': User.query.count(),
-        'active_users': User.query.filter_by(is_active=True).count(),
-        'total_projects': Project.query.count(),
-        'active_projects': Project.query.filter_by(is_active=True).count(),
-        'total_tasks': Task.query.count(),
-        'completed_tasks': Task.query.filter_by(status='Done').count(),
-        'total_tags': Tag.query.count()
-    }
-    
-    # Get task distribution by status
-    task_status_stats = db.session.query(
-        Task.status, func.count(Task.id)
-    ).group_by(Task.status).all()
-    
-    # Get task distribution by priority
-    task_priority_stats = db.session.query(
-        Task.priority, func.count(Task.id)
-    ).group_by(Task.priority).all()
+    # Counters and task distributions by status and priority
+    system = get_system_stats()
     
     return render_template('admin/system_stats.html', 
-                         stats=stats,
-                         task_status_stats=task_status_stats,
-                         task_priority_stats=task_priority_stats)
+                         stats=system['stats'],
+                         task_status_stats=list(system['status_counts'].items()),
+                         task_priority_stats=list(system['priority_counts'].items()))
 
 @bp.route('/branding', methods=['GET', 'POST'])
 @login_required
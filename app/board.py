@@ -0,0 +1,128 @@
+"""
+Kanban board loading.
+
+All tasks of a project are fetched in one query (assignee and tags via
+selectinload, so the card count no longer drives the query count) and then
+bucketed by status in Python.
+
+Boards patch single cards from socket events by fetching
+`/tasks/<id>/card`. The card markup is the same for every viewer, so
+rendered cards are kept in a bounded cache keyed by `Task.card_version()`
+and every viewer after the first gets the stored fragment.
+"""
+
+import threading
+from collections import OrderedDict
+
+from flask import render_template, url_for
+from sqlalchemy.orm import selectinload
+
+from .models import Task, StatusConfig
+
+
+def load_board(project):
+    """Return (status_configs, tasks_by_status) for the board of `project`"""
+    status_configs = StatusConfig.query.filter_by(project_id=project.id).order_by(StatusConfig.order_index).all()
+
+    tasks_by_status = {
+        status_config.name: {'config': status_config, 'tasks': []}
+        for status_config in status_configs
+    }
+
+    tasks = Task.query.filter(Task.project_id == project.id).options(
+        selectinload(Task.assignee),
+        selectinload(Task.tags),
+    ).order_by(Task.created_at.desc(), Task.id.desc()).all()
+
+    for task in tasks:
+        column = tasks_by_status.get(task.status)
+        if column is not None:
+            column['tasks'].append(task)
+
+    return status_configs, tasks_by_status
+
+
+class CardCache:
+    """Thread-safe task id -> (card version, html) cache, least recently used evicted first"""
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, task_id, version):
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(task_id)
+            return entry[1]
+
+    def set(self, task_id, version, html):
+        if not self.size:
+            return
+        with self._lock:
+            self._entries[task_id] = (version, html)
+            self._entries.move_to_end(task_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+_cards = CardCache()
+
+
+def configure_card_cache(app):
+    _cards.size = app.config.get('BOARD_CARD_CACHE_SIZE', 1024)
+
+
+def render_card(task):
+    """The board card of `task`, rendered once per card version"""
+    version = task.card_version()
+    html = _cards.get(task.id, version)
+    if html is None:
+        html = render_template('tasks/card_partial.html', task=task)
+        _cards.set(task.id, version, html)
+    return html
+
+
+def serialize_card(task):
+    """JSON representation of a board card"""
+    return {
+        'id': task.id,
+        'title': task.title,
+        'description': task.description,
+        'status': task.status,
+        'priority': task.priority,
+        'priority_display': task.get_priority_display(),
+        'assignee': {
+            'id': task.assignee.id,
+            'full_name': task.assignee.full_name,
+        } if task.assignee else None,
+        'due_date': task.due_date.isoformat() if task.due_date else None,
+        'is_overdue': task.is_overdue(),
+        'estimated_hours': task.estimated_hours,
+        'tags': [{'id': tag.id, 'name': tag.name, 'color': tag.color} for tag in task.tags],
+        'comment_count': task.comment_count,
+        'attachment_count': task.attachment_count,
+        'updated_at': task.updated_at.isoformat(),
+        'version': task.card_version(),
+        'url': url_for('tasks.detail', task_id=task.id),
+        'card_url': url_for('tasks.card', task_id=task.id),
+    }
+
+
+def serialize_board(project, status_configs, tasks_by_status):
+    """JSON representation of the whole board, columns in display order"""
+    return {
+        'project': {'id': project.id, 'name': project.name},
+        'columns': [
+            {
+                'name': status_config.name,
+                'display_name': status_config.display_name,
+                'color': status_config.color,
+                'wip_limit': status_config.wip_limit,
+                'tasks': [serialize_card(task) for task in tasks_by_status[status_config.name]['tasks']],
+            }
+            for status_config in status_configs
+        ],
+    }
@@ -0,0 +1,280 @@
+"""
+Flask CLI commands (`flask --app app <command>`)
+"""
+
+import os
+
+import click
+from flask.cli import with_appcontext
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+
+from .extensions import db
+
+
+def add_missing_columns():
+    """ALTER TABLE ... ADD COLUMN for model columns the database lacks"""
+    inspector = inspect(db.engine)
+    added = []
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+                    added.append(f'{table.name}.{column.name}')
+    return added
+
+
+@click.command('ensure-schema')
+@with_appcontext
+def ensure_schema_command():
+    """Create missing tables, columns and indexes on an existing database."""
+    db.create_all()
+
+    added = add_missing_columns()
+    for name in added:
+        click.echo(f'Added column {name}')
+    if any(name.endswith('_count') for name in added):
+        from .counters import repair_counters
+        repair_counters()
+        click.echo('Counter columns recomputed.')
+    if 'notification_archive.notification_id' in added:
+        from .retention import backfill_archive_notification_ids
+        click.echo(f'Backfilled notification_id of {backfill_archive_notification_ids()} archived notifications.')
+
+    created = 0
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+            created += 1
+
+    click.echo(f'Schema is up to date ({created} indexes checked).')
+
+
+@click.command('check-query-plans')
+@click.option('--verbose', '-v', is_flag=True, help='Print the full plan of every query.')
+@click.argument('names', nargs=-1)
+@with_appcontext
+def check_query_plans_command(verbose, names):
+    """Run EXPLAIN QUERY PLAN on the hot queries and fail on full table scans."""
+    from .query_plans import check_query_plans
+
+    failed = []
+    for name, plan, full_scans in check_query_plans(names):
+        status = 'SCAN ' + ', '.join(full_scans) if full_scans else 'ok'
+        click.echo(f'{name}: {status}')
+        if verbose or full_scans:
+            for detail in plan:
+                click.echo(f'    {detail}')
+        if full_scans:
+            failed.append(name)
+
+    if failed:
+        raise click.ClickException(f'{len(failed)} hot queries regressed to a full table scan: {", ".join(failed)}')
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Rebuild the full-text search index from tasks, projects and comments."""
+    from .search import rebuild_search_index
+
+    count = rebuild_search_index()
+    click.echo(f'Indexed {count} documents.')
+
+
+@click.command('repair-counters')
+@with_appcontext
+def repair_counters_command():
+    """Recompute comment/attachment/task/member/unread counter columns."""
+    from .counters import repair_counters
+
+    repair_counters()
+    click.echo('Counters repaired.')
+
+
+@click.group('jobs')
+def jobs_cli():
+    """Inspect and run background jobs."""
+
+
+@jobs_cli.command('list')
+@click.option('--status', type=click.Choice(['pending', 'running', 'done', 'failed']))
+@click.option('--limit', default=20, show_default=True)
+@with_appcontext
+def jobs_list_command(status, limit):
+    """Show the most recent jobs."""
+    from .models import Job
+
+    query = Job.query
+    if status:
+        query = query.filter_by(status=status)
+    for job in query.order_by(Job.id.desc()).limit(limit):
+        click.echo(f'{job.id}\t{job.status}\t{job.name}\tattempts={job.attempts}/{job.max_attempts}\trun_at={job.run_at:%Y-%m-%d %H:%M:%S}')
+        if job.last_error and job.status != 'done':
+            click.echo('    ' + job.last_error.strip().splitlines()[-1])
+
+
+@jobs_cli.command('stats')
+@with_appcontext
+def jobs_stats_command():
+    """Number of jobs per status."""
+    from .jobs import job_counts
+
+    for status, count in sorted(job_counts().items()):
+        click.echo(f'{status}: {count}')
+
+
+@jobs_cli.command('work')
+@click.option('--once', is_flag=True, help='Run the jobs that are due and exit.')
+@with_appcontext
+def jobs_work_command(once):
+    """Run jobs in the foreground (for deployments with JOB_WORKERS=0)."""
+    import time
+    from flask import current_app
+    from .jobs import run_pending, release_stale_jobs, schedule_periodic_jobs
+    from .message_queue import start_emitter
+
+    # This process has no sockets; its emits reach the web processes through the queue
+    if not start_emitter(current_app):
+        click.echo('SOCKETIO_MESSAGE_QUEUE is not set: socket events of these jobs will not be delivered.', err=True)
+
+    release_stale_jobs(current_app.config['JOB_LOCK_TIMEOUT'])
+    schedule_periodic_jobs()
+    while True:
+        processed = run_pending()
+        if processed:
+            click.echo(f'Processed {processed} jobs.')
+        if once:
+            break
+        time.sleep(current_app.config['JOB_POLL_INTERVAL'])
+
+
+@jobs_cli.command('retry')
+@click.argument('job_ids', nargs=-1, type=int)
+@click.option('--all-failed', is_flag=True, help='Retry every failed job.')
+@with_appcontext
+def jobs_retry_command(job_ids, all_failed):
+    """Put failed jobs back in the queue."""
+    from .models import Job
+    from .jobs import retry_job
+
+    query = Job.query.filter_by(status='failed')
+    if not all_failed:
+        if not job_ids:
+            raise click.UsageError('Pass job ids or --all-failed.')
+        query = query.filter(Job.id.in_(job_ids))
+    jobs = query.all()
+    for job in jobs:
+        retry_job(job)
+    db.session.commit()
+    click.echo(f'Requeued {len(jobs)} jobs.')
+
+
+@jobs_cli.command('purge')
+@click.option('--older-than', default=7, show_default=True, help='Age in days.')
+@with_appcontext
+def jobs_purge_command(older_than):
+    """Delete completed jobs."""
+    from .jobs import purge_jobs
+
+    click.echo(f'Deleted {purge_jobs(older_than)} jobs.')
+
+
+@click.group('notifications')
+def notifications_cli():
+    """Notification maintenance."""
+
+
+@notifications_cli.command('retention')
+@click.option('--max-batches', type=int, help='Stop after this many batches.')
+@with_appcontext
+def notifications_retention_command(max_batches):
+    """Move old read and over-cap notifications to the archive."""
+    from .retention import run_retention, format_report
+
+    click.echo(format_report(run_retention(max_batches)))
+
+
+@click.group('activity')
+def activity_cli():
+    """Activity log storage."""
+
+
+@activity_cli.command('archive')
+@click.option('--max-batches', type=int, help='Stop after this many batches.')
+@with_appcontext
+def activity_archive_command(max_batches):
+    """Move old activity rows into compressed segment files."""
+    from .activity_archive import archive_activity_log, format_report
+
+    click.echo(format_report(archive_activity_log(max_batches)))
+
+
+@activity_cli.command('segments')
+@with_appcontext
+def activity_segments_command():
+    """List archived activity segments."""
+    from .activity_archive import store
+
+    for segment in store.segments():
+        index = segment.index
+        click.echo(
+            f"{os.path.basename(segment.data_path)}\t{index['rows']} rows\t{index['bytes'] / 1024:.1f} KiB\t"
+            f"{index['min_created_at'][:19]} .. {index['max_created_at'][:19]}\t{len(index['entities'])} entities"
+        )
+
+
+@click.group('mail')
+def mail_cli():
+    """Outgoing mail tools."""
+
+
+@mail_cli.command('sink')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8025, show_default=True)
+@click.option('--quiet', is_flag=True, help='Only print a line per message.')
+def mail_sink_command(host, port, quiet):
+    """Run a local SMTP server that prints and discards every message."""
+    import time
+    from .mail_sink import DebugSMTPServer
+
+    def show(message):
+        click.echo(f"--- {message.mail_from} -> {', '.join(message.rcpt_tos)}")
+        if not quiet:
+            click.echo(message.data)
+
+    with DebugSMTPServer(host, port, keep=100, on_message=show) as sink:
+        click.echo(f'SMTP sink listening on {host}:{sink.port} (set SMTP_SERVER={host} SMTP_PORT={sink.port} SMTP_USE_TLS=False)')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+@mail_cli.command('test')
+@click.argument('to_email')
+@with_appcontext
+def mail_test_command(to_email):
+    """Send a test message right away through the configured SMTP server."""
+    from .mail import pool, send_messages
+
+    if not pool.configured:
+        raise click.ClickException('SMTP_SERVER is not set.')
+    sent, _ = send_messages([{'to_email': to_email, 'subject': 'Test', 'body': 'SMTP test message', 'html_body': None}])
+    click.echo('Sent.' if sent else 'Failed, see the log.')
+
+
+def register_commands(app):
+    app.cli.add_command(ensure_schema_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(repair_counters_command)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(notifications_cli)
+    app.cli.add_command(activity_cli)
+    app.cli.add_command(mail_cli)
@@ -0,0 +1,205 @@
+"""
+Denormalized counter columns.
+
+Task.comment_count / attachment_count and Project.task_count / done_count /
+member_count are adjusted with atomic `col = col + delta` updates from the
+ORM flush, so they commit or roll back together with the rows they count.
+`repair_counters` recomputes all of them in bulk.
+
+User.unread_count follows the same rule for ORM changes to notifications;
+bulk statements that bypass the ORM call `adjust_unread_counts` themselves.
+New unread counts are pushed to the `user_{id}` room once the transaction
+commits.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from .extensions import db
+from .socket_metrics import broadcast
+
+TASK_COUNTERS = ('comment_count', 'attachment_count')
+PROJECT_COUNTERS = ('task_count', 'done_count', 'member_count')
+
+
+def _old_value(obj, attr):
+    """Value of `attr` before the flush (current value if unchanged)"""
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr)
+
+
+def _collect_deltas(session):
+    from .models import Task, TaskComment, TaskAttachment, ProjectMember, Notification
+
+    task_deltas = defaultdict(lambda: defaultdict(int))
+    project_deltas = defaultdict(lambda: defaultdict(int))
+    unread_deltas = defaultdict(int)
+
+    def count_task(project_id, status, sign):
+        project_deltas[project_id]['task_count'] += sign
+        if status == 'Done':
+            project_deltas[project_id]['done_count'] += sign
+
+    for obj in session.new:
+        if isinstance(obj, TaskComment):
+            task_deltas[obj.task_id]['comment_count'] += 1
+        elif isinstance(obj, TaskAttachment):
+            task_deltas[obj.task_id]['attachment_count'] += 1
+        elif isinstance(obj, Task):
+            count_task(obj.project_id, obj.status, 1)
+        elif isinstance(obj, ProjectMember):
+            project_deltas[obj.project_id]['member_count'] += 1
+        elif isinstance(obj, Notification) and not obj.is_read:
+            unread_deltas[obj.user_id] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, TaskComment):
+            task_deltas[obj.task_id]['comment_count'] -= 1
+        elif isinstance(obj, TaskAttachment):
+            task_deltas[obj.task_id]['attachment_count'] -= 1
+        elif isinstance(obj, Task):
+            count_task(_old_value(obj, 'project_id'), _old_value(obj, 'status'), -1)
+        elif isinstance(obj, ProjectMember):
+            project_deltas[obj.project_id]['member_count'] -= 1
+        elif isinstance(obj, Notification) and not _old_value(obj, 'is_read'):
+            unread_deltas[_old_value(obj, 'user_id')] -= 1
+
+    for obj in session.dirty:
+        if isinstance(obj, Task):
+            old_project_id = _old_value(obj, 'project_id')
+            old_status = _old_value(obj, 'status')
+            if (old_project_id, old_status == 'Done') != (obj.project_id, obj.status == 'Done'):
+                count_task(old_project_id, old_status, -1)
+                count_task(obj.project_id, obj.status, 1)
+        elif isinstance(obj, Notification):
+            old_user_id = _old_value(obj, 'user_id')
+            old_unread = not _old_value(obj, 'is_read')
+            if (old_user_id, old_unread) != (obj.user_id, not obj.is_read):
+                unread_deltas[old_user_id] -= old_unread
+                unread_deltas[obj.user_id] += not obj.is_read
+
+    return task_deltas, project_deltas, unread_deltas
+
+
+def _preserve_onupdate(table):
+    """Assign onupdate columns to themselves so counter writes don't bump them"""
+    return {column.name: column for column in table.columns if column.onupdate is not None}
+
+
+def _apply_deltas(connection, table, deltas):
+    touched = []
+    for row_id, columns in deltas.items():
+        values = {name: table.c[name] + delta for name, delta in columns.items() if delta}
+        if row_id is None or not values:
+            continue
+        connection.execute(
+            table.update().where(table.c.id == row_id).values(**values, **_preserve_onupdate(table))
+        )
+        touched.append((row_id, list(values)))
+    return touched
+
+
+def _apply_unread_deltas(session, deltas):
+    from .models import User
+
+    table = User.__table__
+    connection = session.connection()
+    touched = []
+    for user_id, delta in deltas.items():
+        if user_id is None or not delta:
+            continue
+        connection.execute(
+            table.update().where(table.c.id == user_id).values(unread_count=table.c.unread_count + delta)
+        )
+        touched.append(user_id)
+    session.info.setdefault('unread_changed', set()).update(touched)
+    return touched
+
+
+def adjust_unread_counts(deltas):
+    """Apply {user_id: delta} to User.unread_count in the current transaction.
+
+    Bulk statements on notifications bypass the flush hook, so their callers
+    report the change here.
+    """
+    from .models import User
+
+    for user_id in _apply_unread_deltas(db.session, deltas):
+        user = db.session.identity_map.get(db.session.identity_key(User, user_id))
+        if user is not None:
+            db.session.expire(user, ['unread_count'])
+
+
+@event.listens_for(Session, 'after_flush')
+def _maintain_counters(session, flush_context):
+    from .models import User, Task, Project
+
+    task_deltas, project_deltas, unread_deltas = _collect_deltas(session)
+    if not task_deltas and not project_deltas and not unread_deltas:
+        return
+
+    connection = session.connection()
+    stale = session.info.setdefault('stale_counters', [])
+    stale.extend((User, user_id, ['unread_count']) for user_id in _apply_unread_deltas(session, unread_deltas))
+    stale.extend((Task, row_id, names) for row_id, names in _apply_deltas(connection, Task.__table__, task_deltas))
+    stale.extend((Project, row_id, names) for row_id, names in _apply_deltas(connection, Project.__table__, project_deltas))
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_stale_counters(session, flush_context):
+    """Reload counters of in-session objects on next access"""
+    for model, row_id, names in session.info.pop('stale_counters', []):
+        obj = session.identity_map.get(session.identity_key(model, row_id))
+        if obj is not None:
+            session.expire(obj, names)
+
+
+@event.listens_for(Session, 'after_commit')
+def _push_unread_counts(session):
+    """Send the committed unread count to each affected user's room"""
+    from .models import User
+
+    user_ids = session.info.pop('unread_changed', None)
+    if not user_ids:
+        return
+
+    # The session cannot emit SQL from after_commit; use a short-lived connection
+    table = User.__table__
+    with db.engine.connect() as connection:
+        rows = connection.execute(
+            select(table.c.id, table.c.unread_count).where(table.c.id.in_(sorted(user_ids)))
+        ).all()
+    for user_id, count in rows:
+        broadcast('unread_count', {'count': count}, room=f'user_{user_id}')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_unread_changes(session):
+    session.info.pop('unread_changed', None)
+
+
+def repair_counters():
+    """Recompute every counter column from the source tables"""
+    from .models import User, Task, Project, TaskComment, TaskAttachment, ProjectMember, Notification
+
+    def count_of(model, fk, parent, *criteria):
+        return select(func.count()).select_from(model).where(fk == parent.id, *criteria).scalar_subquery()
+
+    db.session.execute(Task.__table__.update().values(
+        comment_count=count_of(TaskComment, TaskComment.task_id, Task),
+        attachment_count=count_of(TaskAttachment, TaskAttachment.task_id, Task),
+        **_preserve_onupdate(Task.__table__),
+    ))
+    db.session.execute(Project.__table__.update().values(
+        task_count=count_of(Task, Task.project_id, Project),
+        done_count=count_of(Task, Task.project_id, Project, Task.status == 'Done'),
+        member_count=count_of(ProjectMember, ProjectMember.project_id, Project),
+    ))
+    db.session.execute(User.__table__.update().values(
+        unread_count=count_of(Notification, Notification.user_id, User, Notification.is_read.is_(False)),
+    ))
+    db.session.commit()
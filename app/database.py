@@ -0,0 +1,107 @@
+"""
+SQLite engine profile.
+
+The pragmas are applied on every new DBAPI connection through a SQLAlchemy
+`connect` event, so pooled connections all share the same settings.
+"""
+
+from sqlalchemy import event
+
+# Pragmas applied at connect time, in this order, mapped to their config keys
+SQLITE_PRAGMA_CONFIG = (
+    ('journal_mode', 'SQLITE_JOURNAL_MODE'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+    ('temp_store', 'SQLITE_TEMP_STORE'),
+)
+
+
+def is_sqlite_uri(uri):
+    return uri.startswith('sqlite')
+
+
+def is_memory_uri(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+
+def sqlite_pragmas(config):
+    """Return the configured (pragma, value) pairs, skipping unset ones"""
+    if not config.get('SQLITE_PRAGMAS_ENABLED', True):
+        return []
+
+    pragmas = []
+    for pragma, key in SQLITE_PRAGMA_CONFIG:
+        value = config.get(key)
+        if value is not None and value != '':
+            pragmas.append((pragma, value))
+    return pragmas
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in pragmas:
+            cursor.execute(f'PRAGMA {pragma}={value}')
+    finally:
+        cursor.close()
+
+
+def engine_options(config):
+    """Build SQLALCHEMY_ENGINE_OPTIONS for the configured database"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if not is_sqlite_uri(uri) or is_memory_uri(uri):
+        return {}
+
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+
+
+def install_sqlite_profile(engine, pragmas):
+    """Apply `pragmas` to every connection `engine` opens"""
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, pragmas)
+
+    return set_sqlite_pragmas
+
+
+def effective_pragmas(engine):
+    """Read back the pragma values in effect on a pooled connection"""
+    values = {}
+    with engine.connect() as conn:
+        for pragma, _ in SQLITE_PRAGMA_CONFIG:
+            values[pragma] = conn.exec_driver_sql(f'PRAGMA {pragma}').scalar()
+    return values
+
+
+def init_database(app, db):
+    """Install the SQLite profile on the app's engine and log the result"""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if not is_sqlite_uri(uri):
+        return
+
+    pragmas = sqlite_pragmas(app.config)
+    with app.app_context():
+        engine = db.engine
+        if pragmas:
+            install_sqlite_profile(engine, pragmas)
+
+        if app.config.get('SQLITE_STARTUP_CHECK', True):
+            try:
+                values = effective_pragmas(engine)
+            except Exception as e:
+                app.logger.warning(f'SQLite startup check failed: {str(e)}')
+                return
+            app.logger.info('SQLite pragmas in effect: ' + ', '.join(
+                f'{name}={value}' for name, value in values.items()
+            ))
+            journal_mode = app.config.get('SQLITE_JOURNAL_MODE')
+            if journal_mode and not is_memory_uri(uri) and str(values['journal_mode']).lower() != str(journal_mode).lower():
+                app.logger.warning(
+                    f'SQLite journal_mode is {values["journal_mode"]}, expected {journal_mode}'
+                )
@@ -0,0 +1,79 @@
+"""
+Sequenced project-room events.
+
+Every event sent to a `project_<id>` room carries a per-project, gap-free
+`seq`. The number is allocated by bumping `Project.event_seq` inside the
+transaction that makes the change, and the event is stored in
+`project_event` in the same transaction, so sequence order is commit order
+and a logged event always describes a committed change. Only the latest
+PROJECT_EVENT_LOG_SIZE events per project are kept (a ring buffer in the
+database, shared by every process that serves sockets).
+
+Clients remember the last `seq` they applied. On reconnect, or when an event
+arrives with a gap, they call the `resync` socket event and get either the
+missed events or, when those were already pruned, a board snapshot.
+"""
+
+import json
+
+from flask import current_app
+from sqlalchemy import delete, select, update
+
+from .extensions import db
+
+# Old events are pruned once every this many events of a project
+PRUNE_EVERY = 50
+
+
+def _log_size():
+    return current_app.config.get('PROJECT_EVENT_LOG_SIZE', 200)
+
+
+def record_event(project_id, event, data):
+    """Allocate the next seq of the project and log the event; returns the payload to emit"""
+    from .models import Project, ProjectEvent
+
+    seq = db.session.execute(
+        update(Project).where(Project.id == project_id)
+        .values(event_seq=Project.event_seq + 1)
+        .returning(Project.event_seq)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+
+    data = dict(data, project_id=project_id, seq=seq)
+    db.session.add(ProjectEvent(project_id=project_id, seq=seq, event=event, data_json=json.dumps(data)))
+
+    if seq % PRUNE_EVERY == 0:
+        db.session.execute(delete(ProjectEvent).where(
+            ProjectEvent.project_id == project_id,
+            ProjectEvent.seq <= seq - _log_size()
+        ).execution_options(synchronize_session=False))
+    return data
+
+
+def current_seq(project_id):
+    from .models import Project
+
+    return db.session.execute(select(Project.event_seq).where(Project.id == project_id)).scalar()
+
+
+def events_since(project_id, since_seq):
+    """(seq, events) with the events after `since_seq`; events is None when they can't be replayed"""
+    from .models import ProjectEvent
+
+    seq = current_seq(project_id)
+    if since_seq == seq:
+        return seq, []
+    if since_seq > seq or seq - since_seq > _log_size():
+        # Client is ahead (database was reset) or too far behind
+        return seq, None
+
+    rows = db.session.execute(
+        select(ProjectEvent.seq, ProjectEvent.event, ProjectEvent.data_json)
+        .where(ProjectEvent.project_id == project_id, ProjectEvent.seq > since_seq, ProjectEvent.seq <= seq)
+        .order_by(ProjectEvent.seq)
+    ).all()
+    if len(rows) != seq - since_seq:
+        # Part of the gap was pruned
+        return seq, None
+    return seq, [{'seq': row.seq, 'event': row.event, 'data': json.loads(row.data_json)} for row in rows]
@@ -0,0 +1,211 @@
+"""
+HTTP conditional caching for read-heavy pages.
+
+`conditional(state)` wraps a view with a cheap validator: `state(**view_args)`
+returns the parts built from a few aggregate columns (max(updated_at),
+counts) of the page's scope, or None when the view should simply run
+(missing rows, no access). The parts are hashed together with everything
+per-user the layout renders (user id, name and role, unread count, project
+memberships, CSRF token) into a weak ETag, so `If-None-Match` is answered
+with a 304 before the view runs its queries and renders its template.
+
+No Last-Modified is sent and `If-Modified-Since` alone never gets a 304: a
+page changes without its newest timestamp moving (a task deleted,
+notifications marked read, a task turning overdue), which only the counts in
+the ETag notice.
+
+Responses are `private, no-cache` with `Vary: Cookie`: browsers and htmx
+keep them but always revalidate, and shared caches never store them.
+"""
+
+import hashlib
+import os
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import and_, case, func, or_, select
+from werkzeug.http import is_resource_modified
+
+from .extensions import db
+from .membership import can_access_project, get_member_project_ids
+
+# Hashed into every ETag so template changes invalidate cached pages
+_version = ''
+
+
+def configure_http_cache(app):
+    global _version
+    _version = app.config.get('HTTP_CACHE_VERSION') or _template_version(app)
+
+
+def _template_version(app):
+    """Latest mtime under the template folder; identical across workers of a deploy"""
+    root = os.path.join(app.root_path, app.template_folder)
+    latest = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            latest = max(latest, os.path.getmtime(os.path.join(dirpath, filename)))
+    return str(latest)
+
+
+def _user_parts():
+    return (
+        current_user.id, current_user.username, current_user.full_name, current_user.role,
+        # The (cached) project ids rather than the process-local membership version,
+        # so every server process computes the same ETag
+        current_user.unread_count, tuple(sorted(get_member_project_ids(current_user))),
+        hashlib.sha1(str(session.get('csrf_token')).encode()).hexdigest(),
+    )
+
+
+def _etag(parts, vary):
+    key = repr((_version, _user_parts(), tuple(request.headers.get(name) for name in vary), parts))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def conditional(state, vary=()):
+    """Answer unchanged GETs of the view with 304, validated by `state`.
+
+    `vary` names request headers the response depends on besides the user.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not current_app.config.get('HTTP_CACHE_ENABLED', True) or session.get('_flashes'):
+                # Pending flash messages are rendered into the page
+                return view(*args, **kwargs)
+
+            parts = state(*args, **kwargs)
+            if parts is None:
+                return view(*args, **kwargs)
+
+            etag = _etag(parts, vary)
+            if is_resource_modified(request.environ, etag=f'W/"{etag}"'):
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            else:
+                response = current_app.response_class(status=304)
+
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.update(('Cookie', *vary))
+            return response
+        return wrapped
+    return decorator
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _task_columns():
+    """max(updated_at), count, overdue count and card counters of a task scope"""
+    from .models import Task
+
+    return (
+        func.max(Task.updated_at),
+        func.count(Task.id),
+        # Tasks turn overdue without being written
+        _count_if(and_(Task.due_date < datetime.utcnow(), Task.status != 'Done')),
+        # Comment/attachment counters are maintained without touching updated_at
+        func.sum(Task.comment_count), func.sum(Task.attachment_count),
+    )
+
+
+def _project_state(project_id, with_board=False):
+    from .models import Project, ProjectMember, StatusConfig, Tag, Task, task_tags
+
+    project = db.session.get(Project, project_id)
+    if project is None or not can_access_project(current_user, project):
+        return None
+
+    member_filter = ProjectMember.project_id == project.id
+    row = db.session.execute(select(
+        *_task_columns(),
+        select(func.count()).select_from(ProjectMember).where(member_filter).scalar_subquery(),
+        select(func.max(ProjectMember.joined_at)).where(member_filter).scalar_subquery(),
+    ).where(Task.project_id == project.id)).one()
+
+    parts = [
+        (project.name, project.description, project.is_active, project.task_count, project.done_count,
+         project.event_seq),
+        tuple(row),
+    ]
+    if with_board:
+        parts.append(db.session.query(
+            StatusConfig.id, StatusConfig.name, StatusConfig.display_name,
+            StatusConfig.order_index, StatusConfig.wip_limit, StatusConfig.color,
+        ).filter(StatusConfig.project_id == project.id).order_by(StatusConfig.order_index).all())
+        # Cards render their tags; tagging a task only writes task_tags
+        parts.append(db.session.query(task_tags.c.task_id, Tag.id, Tag.name, Tag.color).join(
+            Tag, Tag.id == task_tags.c.tag_id
+        ).join(Task, Task.id == task_tags.c.task_id).filter(
+            Task.project_id == project.id
+        ).order_by(task_tags.c.task_id, Tag.id).all())
+    return parts
+
+
+def project_detail_state(project_id):
+    return _project_state(project_id)
+
+
+def project_board_state(project_id):
+    return _project_state(project_id, with_board=True)
+
+
+def task_detail_state(task_id):
+    from .models import Task
+
+    task = db.session.get(Task, task_id)
+    if task is None or not can_access_project(current_user, task.project_id):
+        return None
+    project = task.project
+    parts = (
+        task.updated_at, task.status, task.assignee_id, task.is_overdue(),
+        task.comment_count, task.attachment_count, [tag.id for tag in task.tags],
+        (project.name, project.is_active),
+    )
+    return parts
+
+
+def task_card_state(task_id):
+    from .models import Task
+
+    task = db.session.get(Task, task_id)
+    if task is None or not can_access_project(current_user, task.project_id):
+        return None
+    return (task.card_version(),)
+
+
+def _notification_columns():
+    from .models import Notification
+
+    mine = Notification.user_id == current_user.id
+    return (
+        select(func.max(Notification.created_at)).where(mine).scalar_subquery(),
+        select(func.count(Notification.id)).where(mine).scalar_subquery(),
+        select(func.max(Notification.id)).where(mine).scalar_subquery(),
+    )
+
+
+def recent_notifications_state():
+    return tuple(db.session.execute(select(*_notification_columns())).one())
+
+
+def dashboard_state():
+    from .models import Task
+
+    query = select(*_task_columns(), *_notification_columns())
+    if not current_user.is_admin():
+        query = query.where(or_(
+            Task.assignee_id == current_user.id,
+            Task.project_id.in_(sorted(get_member_project_ids(current_user))),
+        ))
+    row = db.session.execute(query).one()
+
+    # Weekly/monthly completion counters roll over with the date
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    return tuple(row), today
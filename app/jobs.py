@@ -0,0 +1,325 @@
+"""
+Durable in-process background jobs.
+
+Side effects of request handlers that are slow or talk to other systems
+(emails and socket fan-out: `email.send`, `email.send_batch`, `socket.emit`,
+`socket.emit_batch`) are enqueued as rows of the `job` table inside the
+request's own transaction, so a job exists exactly when the change that
+caused it was committed. Notifications are written inline by the request
+and activity rows go through the write-behind writer in activity.py; neither
+is a job. Worker threads claim due jobs, run the registered handler and mark
+the job done in the same transaction as the handler's writes. Failures are
+retried with exponential backoff until `max_attempts` is reached.
+
+Handlers must not commit; they are registered with `@job_handler(name)`.
+Maintenance tasks registered with `@periodic_job(name, interval_setting)`
+(`activity.archive`, `notifications.retention`) re-enqueue themselves every
+`app.config[interval_setting]` seconds, or right away while they return True
+(more work left).
+"""
+
+import random
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from .extensions import db
+
+JOB_HANDLERS = {}
+PERIODIC_JOBS = {}
+
+
+def job_handler(name):
+    """Register `func(**payload)` as the handler of jobs called `name`"""
+    def decorator(handler):
+        JOB_HANDLERS[name] = handler
+        return handler
+    return decorator
+
+
+def periodic_job(name, interval_setting):
+    """Register a handler that is rescheduled after every run"""
+    def decorator(handler):
+        JOB_HANDLERS[name] = handler
+        PERIODIC_JOBS[name] = interval_setting
+        return handler
+    return decorator
+
+
+def enqueue(name, payload=None, key=None, delay=0, max_attempts=None):
+    """Add a job to the current session; it becomes visible on commit.
+
+    Jobs with an `idempotency_key` that already exists are not enqueued
+    again and the existing job is returned.
+    """
+    from .models import Job
+
+    if name not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job: {name}')
+
+    if key is not None:
+        existing = Job.query.filter_by(idempotency_key=key).first()
+        if existing is not None:
+            return existing
+        # Also dedupe against jobs added earlier in this transaction
+        for obj in db.session.new:
+            if isinstance(obj, Job) and obj.idempotency_key == key:
+                return obj
+
+    job = Job(
+        name=name,
+        idempotency_key=key,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+        max_attempts=max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 5),
+    )
+    job.set_payload(payload)
+    db.session.add(job)
+    db.session.info['jobs_enqueued'] = True
+    return job
+
+
+def retry_delay(attempts, base, maximum):
+    """Exponential backoff with +/-20% jitter"""
+    delay = min(base * (2 ** max(attempts - 1, 0)), maximum)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim_next_job():
+    """Mark the next due pending job as running and return its id (or None)"""
+    from .models import Job
+
+    now = datetime.utcnow()
+    while True:
+        job_id = db.session.query(Job.id).filter(
+            Job.status == 'pending', Job.run_at <= now
+        ).order_by(Job.run_at, Job.id).limit(1).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+
+        # Conditional update: another worker may have claimed it meanwhile
+        claimed = db.session.query(Job).filter(
+            Job.id == job_id, Job.status == 'pending'
+        ).update({
+            Job.status: 'running',
+            Job.locked_at: now,
+            Job.attempts: Job.attempts + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return job_id
+
+
+def run_job(job_id):
+    """Run a claimed job; returns True on success"""
+    from .models import Job
+
+    job = db.session.get(Job, job_id)
+    handler = JOB_HANDLERS.get(job.name)
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job {job.name}')
+        more = handler(**job.get_payload())
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        job.last_error = None
+        if job.name in PERIODIC_JOBS:
+            _schedule_next_run(job.name, immediately=more is True)
+        db.session.commit()
+        return True
+    except Exception:
+        error = traceback.format_exc(limit=5)
+        db.session.rollback()
+
+    job = db.session.get(Job, job_id)
+    job.last_error = error
+    if job.attempts >= job.max_attempts:
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+        current_app.logger.error(f'Job {job.id} ({job.name}) failed permanently: {error}')
+        if job.name in PERIODIC_JOBS:
+            _schedule_next_run(job.name)
+    else:
+        delay = retry_delay(
+            job.attempts,
+            current_app.config.get('JOB_RETRY_BASE', 10),
+            current_app.config.get('JOB_RETRY_MAX', 3600),
+        )
+        job.status = 'pending'
+        job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+        current_app.logger.warning(f'Job {job.id} ({job.name}) failed, retrying in {delay:.0f}s')
+    job.locked_at = None
+    db.session.commit()
+    return False
+
+
+def _schedule_next_run(name, immediately=False):
+    interval = current_app.config.get(PERIODIC_JOBS[name], 0)
+    if interval > 0:
+        enqueue(name, delay=0 if immediately else interval)
+
+
+def schedule_periodic_jobs():
+    """Enqueue every enabled periodic job that has no pending or running run"""
+    from .models import Job
+
+    scheduled = db.session.query(Job.name).filter(
+        Job.name.in_(list(PERIODIC_JOBS)), Job.status.in_(['pending', 'running'])
+    ).distinct().all()
+    scheduled = {name for name, in scheduled}
+    for name, interval_setting in PERIODIC_JOBS.items():
+        if name not in scheduled and current_app.config.get(interval_setting, 0) > 0:
+            enqueue(name)
+    db.session.commit()
+
+
+def run_pending(limit=None):
+    """Run due jobs in the calling thread; returns the number processed"""
+    processed = 0
+    while limit is None or processed < limit:
+        job_id = claim_next_job()
+        if job_id is None:
+            break
+        run_job(job_id)
+        processed += 1
+    return processed
+
+
+def seconds_until_next_job(default):
+    """Time until the earliest pending job is due, capped at `default`"""
+    from .models import Job
+
+    next_run = db.session.query(func.min(Job.run_at)).filter(Job.status == 'pending').scalar()
+    db.session.rollback()
+    if next_run is None:
+        return default
+    return max(0.0, min(default, (next_run - datetime.utcnow()).total_seconds()))
+
+
+def release_stale_jobs(lock_timeout):
+    """Return `running` jobs whose worker died to the pending state"""
+    from .models import Job
+
+    cutoff = datetime.utcnow() - timedelta(seconds=lock_timeout)
+    released = db.session.query(Job).filter(
+        Job.status == 'running', Job.locked_at < cutoff
+    ).update({Job.status: 'pending', Job.locked_at: None}, synchronize_session=False)
+    db.session.commit()
+    return released
+
+
+def retry_job(job):
+    """Put a failed job back in the queue"""
+    job.status = 'pending'
+    job.attempts = 0
+    job.run_at = datetime.utcnow()
+    job.finished_at = None
+    job.locked_at = None
+    db.session.info['jobs_enqueued'] = True
+
+
+def purge_jobs(older_than_days):
+    """Delete finished (done) jobs older than the given age"""
+    from .models import Job
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deleted = db.session.query(Job).filter(
+        Job.status == 'done', Job.finished_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def job_counts():
+    """Number of jobs per status"""
+    from .models import Job
+
+    return dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+
+
+class JobWorkerPool:
+    """Daemon threads running due jobs; woken early whenever jobs are committed"""
+
+    def __init__(self):
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self, app):
+        with self._lock:
+            if self.running:
+                return
+            count = app.config.get('JOB_WORKERS', 2)
+            if count <= 0:
+                return
+            self._stop.clear()
+            with app.app_context():
+                released = release_stale_jobs(app.config.get('JOB_LOCK_TIMEOUT', 600))
+                if released:
+                    app.logger.warning(f'Released {released} stale jobs')
+            self._threads = [
+                threading.Thread(target=self._run, args=(app,), name=f'job-worker-{i}', daemon=True)
+                for i in range(count)
+            ]
+            for thread in self._threads:
+                thread.start()
+            # Only now: the commit wakes the running threads instead of re-entering start()
+            with app.app_context():
+                schedule_periodic_jobs()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self, app):
+        poll_interval = app.config.get('JOB_POLL_INTERVAL', 5)
+        while not self._stop.is_set():
+            try:
+                with app.app_context():
+                    processed = run_pending(limit=100)
+                    idle = 0 if processed else seconds_until_next_job(poll_interval)
+            except Exception:
+                app.logger.exception('Job worker error')
+                idle = poll_interval
+            if idle:
+                self._wakeup.wait(idle)
+                self._wakeup.clear()
+
+
+workers = JobWorkerPool()
+
+
+def init_jobs(app):
+    """Start the worker threads on the first request"""
+    @app.before_request
+    def _start_job_workers():
+        if not workers.running:
+            workers.start(app)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_enqueued', False):
+        if has_app_context() and not workers.running:
+            workers.start(current_app._get_current_object())
+        workers.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_enqueued(session):
+    session.info.pop('jobs_enqueued', None)
@@ -0,0 +1,291 @@
+"""
+Outgoing mail.
+
+Messages are queued as jobs, so they are only sent once the caller commits
+and are retried with the job queue's backoff. Job workers send them through
+a bounded pool of persistent SMTP connections (STARTTLS and login once per
+connection, NOOP health checks after MAIL_KEEPALIVE idle seconds) instead of
+a fresh connection per message, and a token bucket caps the overall rate at
+MAIL_RATE_LIMIT messages per second. `send_emails` queues many messages as
+batch jobs that go out over a single connection.
+
+For local testing and benchmarks point SMTP_SERVER at the debugging sink in
+`app.mail_sink` (`flask mail sink`).
+"""
+
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from flask import current_app
+
+from .jobs import enqueue, job_handler, retry_delay
+
+# Errors after which the connection can no longer be trusted
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+class MailNotConfigured(RuntimeError):
+    pass
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second (0 = unlimited)"""
+
+    def __init__(self, rate=0, burst=None):
+        self.configure(rate, burst)
+        self._lock = threading.Lock()
+
+    def configure(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SMTPConnectionPool:
+    """At most `size` SMTP connections, reused across messages and threads"""
+
+    def __init__(self):
+        self.settings = {}
+        self.size = 0
+        self._slots = None
+        self._idle = []  # (connection, last_used)
+        self._lock = threading.Lock()
+        self._stats = {
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'connections_dropped': 0,
+            'noop_checks': 0,
+            'sent': 0,
+            'failed': 0,
+        }
+
+    def configure(self, app):
+        config = app.config
+        self.close()
+        self.settings = {
+            'host': config.get('SMTP_SERVER'),
+            'port': config.get('SMTP_PORT', 587),
+            'username': config.get('SMTP_USERNAME'),
+            'password': config.get('SMTP_PASSWORD'),
+            'use_tls': config.get('SMTP_USE_TLS', True),
+            'timeout': config.get('MAIL_TIMEOUT', 30),
+            'keepalive': config.get('MAIL_KEEPALIVE', 30),
+            'max_idle': config.get('MAIL_MAX_IDLE', 300),
+        }
+        self.size = max(1, config.get('MAIL_POOL_SIZE', 2))
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    @property
+    def configured(self):
+        return bool(self.settings.get('host'))
+
+    def _connect(self):
+        settings = self.settings
+        connection = smtplib.SMTP(settings['host'], settings['port'], timeout=settings['timeout'])
+        try:
+            connection.ehlo()
+            if settings['use_tls']:
+                connection.starttls()
+                connection.ehlo()
+            if settings['username'] and settings['password']:
+                connection.login(settings['username'], settings['password'])
+        except Exception:
+            self._discard(connection)
+            raise
+        self._stats['connections_opened'] += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _healthy(self, connection, last_used):
+        idle = time.monotonic() - last_used
+        if idle > self.settings['max_idle']:
+            return False
+        if idle > self.settings['keepalive']:
+            self._stats['noop_checks'] += 1
+            try:
+                return connection.noop()[0] == 250
+            except CONNECTION_ERRORS + (smtplib.SMTPException,):
+                return False
+        return True
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, last_used = self._idle.pop()
+            if self._healthy(connection, last_used):
+                self._stats['connections_reused'] += 1
+                return connection
+            self._stats['connections_dropped'] += 1
+            self._discard(connection)
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it is closed instead of returned if the block raises"""
+        if not self.configured:
+            raise MailNotConfigured('SMTP_SERVER is not set')
+        self._slots.acquire()
+        try:
+            connection = self._checkout()
+            try:
+                yield connection
+            except BaseException:
+                self._stats['connections_dropped'] += 1
+                self._discard(connection)
+                raise
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def record(self, sent, failed):
+        self._stats['sent'] += sent
+        self._stats['failed'] += failed
+
+    def metrics(self):
+        stats = dict(self._stats)
+        stats['idle_connections'] = len(self._idle)
+        stats['pool_size'] = self.size
+        return stats
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            try:
+                connection.quit()
+            except Exception:
+                self._discard(connection)
+
+
+pool = SMTPConnectionPool()
+limiter = RateLimiter()
+
+
+def configure_mail(app):
+    pool.configure(app)
+    limiter.configure(app.config.get('MAIL_RATE_LIMIT', 0))
+
+
+def build_message(to_email, subject, body, html_body=None, sender=None):
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = to_email
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    if html_body:
+        msg.attach(MIMEText(html_body, 'html', 'utf-8'))
+    return msg
+
+
+def _sender():
+    config = current_app.config
+    return config.get('MAIL_SENDER') or config.get('SMTP_USERNAME') or 'noreply@localhost'
+
+
+def send_messages(messages):
+    """Send message dicts over pooled connections; returns (sent, failed) lists.
+
+    A message the server rejects is failed on its own; a broken connection
+    fails the rest of its batch.
+    """
+    sender = _sender()
+    batch_size = current_app.config.get('MAIL_BATCH_SIZE', 50)
+    sent, failed = [], []
+
+    for start in range(0, len(messages), batch_size):
+        batch = messages[start:start + batch_size]
+        done = 0
+        try:
+            with pool.connection() as connection:
+                for message in batch:
+                    limiter.acquire()
+                    try:
+                        connection.send_message(build_message(sender=sender, **message))
+                        sent.append(message)
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                        current_app.logger.warning(f"Mail to {message['to_email']} rejected: {e}")
+                        failed.append(message)
+                    done += 1
+        except CONNECTION_ERRORS + (smtplib.SMTPException,) as e:
+            current_app.logger.warning(f'SMTP connection failed: {e}')
+            failed.extend(batch[done:])
+
+    pool.record(len(sent), len(failed))
+    return sent, failed
+
+
+def _message(to_email, subject, body, html_body=None):
+    return {'to_email': to_email, 'subject': subject, 'body': body, 'html_body': html_body}
+
+
+def send_email(to_email, subject, body, html_body=None, key=None):
+    """Queue an email notification; it is sent when the caller commits"""
+    return enqueue('email.send', _message(to_email, subject, body, html_body), key=key)
+
+
+def send_emails(messages):
+    """Queue many (to_email, subject, body[, html_body]) messages as batch jobs"""
+    messages = [_message(*message) for message in messages]
+    batch_size = current_app.config.get('MAIL_BATCH_SIZE', 50)
+    return [
+        enqueue('email.send_batch', {'messages': messages[start:start + batch_size]})
+        for start in range(0, len(messages), batch_size)
+    ]
+
+
+@job_handler('email.send')
+def deliver_email(to_email, subject, body, html_body=None):
+    """Send one email (if SMTP is configured); raises so the job is retried"""
+    if not pool.configured:
+        # SMTP not configured, skip silently
+        return False
+    _, failed = send_messages([_message(to_email, subject, body, html_body)])
+    if failed:
+        raise RuntimeError(f'Mail to {to_email} was not sent')
+    return True
+
+
+@job_handler('email.send_batch')
+def deliver_email_batch(messages, attempt=1):
+    """Send a batch; only the messages that failed are queued again"""
+    if not pool.configured:
+        return False
+    sent, failed = send_messages(messages)
+    if failed and not sent:
+        # Nothing went out, so retrying the whole job is safe
+        raise RuntimeError(f'None of {len(failed)} mails were sent')
+    if failed:
+        config = current_app.config
+        if attempt >= config.get('JOB_MAX_ATTEMPTS', 5):
+            current_app.logger.error(f'Giving up on {len(failed)} mails after {attempt} attempts')
+        else:
+            delay = retry_delay(attempt, config.get('JOB_RETRY_BASE', 10), config.get('JOB_RETRY_MAX', 3600))
+            enqueue('email.send_batch', {'messages': failed, 'attempt': attempt + 1}, delay=delay)
+    return True
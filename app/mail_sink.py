@@ -0,0 +1,154 @@
+"""
+Debugging SMTP sink.
+
+A small threaded SMTP server that accepts every message and keeps it in
+memory (in the spirit of aiosmtpd's debugging handler, without the extra
+dependency). It speaks enough ESMTP for smtplib: EHLO/HELO, AUTH PLAIN and
+LOGIN (any credentials), MAIL, RCPT, DATA, RSET, NOOP and QUIT; STARTTLS is
+not offered, so clients must run with SMTP_USE_TLS=False.
+
+`connect_delay` and `message_delay` simulate the handshake and per-message
+latency of a real server, so connection reuse can be measured offline.
+"""
+
+import collections
+import socketserver
+import threading
+import time
+
+
+class SinkMessage:
+    def __init__(self, mail_from, rcpt_tos, data):
+        self.mail_from = mail_from
+        self.rcpt_tos = rcpt_tos
+        self.data = data
+        self.received_at = time.time()
+
+    def __repr__(self):
+        return f'<SinkMessage {self.mail_from} -> {", ".join(self.rcpt_tos)}>'
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def readline(self):
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError
+        return line.decode('utf-8', 'replace').rstrip('\r\n')
+
+    def handle(self):
+        sink = self.server.sink
+        sink._connection_opened()
+        time.sleep(sink.connect_delay)
+        self.reply('220 localhost debugging SMTP sink')
+        mail_from, rcpt_tos = None, []
+        try:
+            while True:
+                line = self.readline()
+                verb, _, arg = line.partition(' ')
+                verb = verb.upper()
+                if verb == 'EHLO':
+                    self.reply('250-localhost')
+                    self.reply('250-8BITMIME')
+                    self.reply('250-AUTH PLAIN LOGIN')
+                    self.reply('250 SIZE 33554432')
+                elif verb == 'HELO':
+                    self.reply('250 localhost')
+                elif verb == 'AUTH':
+                    mechanism, _, initial = arg.partition(' ')
+                    if mechanism.upper() == 'LOGIN':
+                        if not initial:
+                            self.reply('334 VXNlcm5hbWU6')
+                            self.readline()
+                        self.reply('334 UGFzc3dvcmQ6')
+                        self.readline()
+                    elif not initial:
+                        self.reply('334 ')
+                        self.readline()
+                    self.reply('235 Authentication successful')
+                elif verb == 'MAIL':
+                    mail_from, rcpt_tos = arg.partition(':')[2].strip().strip('<>'), []
+                    self.reply('250 OK')
+                elif verb == 'RCPT':
+                    rcpt_tos.append(arg.partition(':')[2].strip().strip('<>'))
+                    self.reply('250 OK')
+                elif verb == 'DATA':
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    lines = []
+                    while True:
+                        line = self.readline()
+                        if line == '.':
+                            break
+                        lines.append(line[1:] if line.startswith('.') else line)
+                    time.sleep(sink.message_delay)
+                    sink._store(SinkMessage(mail_from, rcpt_tos, '\n'.join(lines)))
+                    mail_from, rcpt_tos = None, []
+                    self.reply('250 OK: queued')
+                elif verb == 'RSET':
+                    mail_from, rcpt_tos = None, []
+                    self.reply('250 OK')
+                elif verb == 'NOOP':
+                    self.reply('250 OK')
+                elif verb == 'QUIT':
+                    self.reply('221 Bye')
+                    return
+                else:
+                    self.reply('502 Command not implemented')
+        except (ConnectionError, OSError):
+            return
+
+
+class _ThreadingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class DebugSMTPServer:
+    """In-memory SMTP sink; use as a context manager or start()/stop()"""
+
+    def __init__(self, host='127.0.0.1', port=0, keep=10000, connect_delay=0.0, message_delay=0.0,
+                 on_message=None):
+        self.host = host
+        self.port = port
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.on_message = on_message
+        self.messages = collections.deque(maxlen=keep)
+        self.received = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _connection_opened(self):
+        with self._lock:
+            self.connections += 1
+
+    def _store(self, message):
+        with self._lock:
+            self.messages.append(message)
+            self.received += 1
+        if self.on_message is not None:
+            self.on_message(message)
+
+    def start(self):
+        self._server = _ThreadingSMTPServer((self.host, self.port), _SMTPHandler)
+        self._server.sink = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,33 +1,31 @@
-from flask import render_template, redirect, url_for, request, send_file, current_app
+from flask import render_template, redirect, url_for, request, send_file, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from . import bp
 from ..models import User, Project, Task, Notification, Tag
-from ..utils import get_task_stats, is_ajax_request, ajax_response
+from ..utils import is_ajax_request, ajax_response
+from ..stats import task_stats
+from ..search import filter_tasks, search_tasks, search_projects
+from ..membership import get_member_project_ids, scope_to_member_projects
+from ..http_cache import conditional, dashboard_state
+from ..export import iter_tasks, generate_csv, generate_ndjson, write_xlsx
 from ..extensions import db
 from datetime import datetime, timedelta
 from sqlalchemy import and_, or_, func, desc
-import openpyxl
-from openpyxl.styles import Font, PatternFill
-import tempfile
 import os
 
 @bp.route('/')
 @bp.route('/dashboard')
 @login_required
+@conditional(dashboard_state)
 def dashboard():
     # Get task statistics
-    stats = get_task_stats(user=current_user)
+    stats = task_stats(user=current_user)
     
     # Get recent tasks for current user
     recent_tasks_query = Task.query
     
-    if not current_user.is_admin():
-        # For employees, only show tasks from projects they're members of
-        from app.models import ProjectMember
-        project_ids = db.session.query(ProjectMember.project_id).filter(
-            ProjectMember.user_id == current_user.id
-        ).subquery()
-        recent_tasks_query = recent_tasks_query.filter(Task.project_id.in_(project_ids))
+    # For employees, only show tasks from projects they're members of
+    recent_tasks_query = scope_to_member_projects(recent_tasks_query, Task.project_id, current_user)
     
     recent_tasks = recent_tasks_query.order_by(desc(Task.updated_at)).limit(10).all()
     
@@ -44,12 +42,7 @@ def dashboard():
         )
     )
     
-    if not current_user.is_admin():
-        from app.models import ProjectMember
-        project_ids = db.session.query(ProjectMember.project_id).filter(
-            ProjectMember.user_id == current_user.id
-        ).subquery()
-        overdue_tasks_query = overdue_tasks_query.filter(Task.project_id.in_(project_ids))
+    overdue_tasks_query = scope_to_member_projects(overdue_tasks_query, Task.project_id, current_user)
     
     overdue_tasks = overdue_tasks_query.limit(5).all()
     
@@ -65,9 +58,10 @@ def dashboard():
                          overdue_tasks=overdue_tasks,
                          recent_notifications=recent_notifications)
 
-@bp.route('/export/tasks.xlsx')
+@bp.route('/export/tasks.xlsx', defaults={'fmt': 'xlsx'})
+@bp.route('/export/tasks.<any(csv, ndjson):fmt>')
 @login_required
-def export_tasks():
+def export_tasks(fmt):
     # Get filter parameters from request
     project_id = request.args.get('project_id', type=int)
     status = request.args.get('status')
@@ -105,91 +99,53 @@ def export_tasks():
         )
     
     if search:
-        query = query.filter(
-            or_(
-                Task.title.contains(search),
-                Task.description.contains(search)
-            )
-        )
+        query = filter_tasks(query, search)
     
     # For employees, only show tasks from projects they're members of
-    if not current_user.is_admin():
-        from app.models import ProjectMember
-        project_ids = db.session.query(ProjectMember.project_id).filter(
-            ProjectMember.user_id == current_user.id
-        ).subquery()
-        query = query.filter(Task.project_id.in_(project_ids))
-    
-    tasks = query.order_by(Task.created_at.desc()).all()
-    
-    # Create Excel workbook
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Tasks"
-    
-    # Define headers
-    headers = [
-        'شناسه کار', 'پروژه', 'عنوان', 'مسئول', 'وضعیت', 'اولویت',
-        'برچسب‌ها', 'تخمین ساعت', 'تاریخ سررسید', 'تاریخ ایجاد',
-        'تاریخ آخرین بروزرسانی', 'عقب‌افتاده'
-    ]
-    
-    # Write headers
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-    
-    # Write data
-    for row, task in enumerate(tasks, 2):
-        ws.cell(row=row, column=1, value=task.id)
-        ws.cell(row=row, column=2, value=task.project.name)
-        ws.cell(row=row, column=3, value=task.title)
-        ws.cell(row=row, column=4, value=task.assignee.full_name if task.assignee else '')
-        ws.cell(row=row, column=5, value=task.get_status_display())
-        ws.cell(row=row, column=6, value=task.get_priority_display())
-        ws.cell(row=row, column=7, value=', '.join([tag.name for tag in task.tags]))
-        ws.cell(row=row, column=8, value=task.estimated_hours or '')
-        ws.cell(row=row, column=9, value=task.due_date.strftime('%Y-%m-%d %H:%M') if task.due_date else '')
-        ws.cell(row=row, column=10, value=task.created_at.strftime('%Y-%m-%d %H:%M'))
-        ws.cell(row=row, column=11, value=task.updated_at.strftime('%Y-%m-%d %H:%M'))
-        ws.cell(row=row, column=12, value='بله' if task.is_overdue() else 'خیر')
-    
-    # Auto-adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Save to temporary file
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-    wb.save(temp_file.name)
-    temp_file.close()
+    query = scope_to_member_projects(query, Task.project_id, current_user)
+    
+    tasks = iter_tasks(query, batch_size=current_app.config['EXPORT_BATCH_SIZE'])
     
     # Generate filename with timestamp
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'tasks_export_{timestamp}.xlsx'
+    filename = f'tasks_export_{timestamp}.{fmt}'
+    
+    # Text formats are streamed row batch by row batch
+    if fmt == 'csv':
+        return Response(
+            stream_with_context(generate_csv(tasks)),
+            mimetype='text/csv; charset=utf-8',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
     
-    def remove_file(response):
-        try:
-            os.unlink(temp_file.name)
-        except Exception:
-            pass
-        return response
+    if fmt == 'ndjson':
+        return Response(
+            stream_with_context(generate_ndjson(tasks)),
+            mimetype='application/x-ndjson; charset=utf-8',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    
+    path = write_xlsx(tasks)
     
-    return send_file(
-        temp_file.name,
+    response = send_file(
+        path,
         as_attachment=True,
         download_name=filename,
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
+    
+    # Remove the temporary workbook once the file has been sent; close
+    # callbacks only run when the body is not passed through to the server
+    response.direct_passthrough = False
+    
+    def remove_file():
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    
+    response.call_on_close(remove_file)
+    return response
 
 @bp.route('/search')
 @login_required
@@ -198,31 +154,18 @@ def search():
     if not query:
         return render_template('main/search_results.html', results=[], query='')
     
-    # Search in tasks
-    task_query = Task.query.join(Project).filter(
-        or_(
-            Task.title.contains(query),
-            Task.description.contains(query)
-        )
-    )
+    # Employees' matches are ranked within their own projects only
+    project_ids = None if current_user.is_admin() else get_member_project_ids(current_user)
+    
+    # Search in tasks (title, description and comments), best bm25 rank first
+    task_query = search_tasks(Task.query.join(Project), query, project_ids=project_ids)
     
     # Search in projects
-    project_query = Project.query.filter(
-        or_(
-            Project.name.contains(query),
-            Project.description.contains(query)
-        )
-    )
+    project_query = search_projects(Project.query, query, project_ids=project_ids)
     
     # For employees, only show results from projects they're members of
-    if not current_user.is_admin():
-        from app.models import ProjectMember
-        project_ids = db.session.query(ProjectMember.project_id).filter(
-            ProjectMember.user_id == current_user.id
-        ).subquery()
-        
-        task_query = task_query.filter(Task.project_id.in_(project_ids))
-        project_query = project_query.filter(Project.id.in_(project_ids))
+    task_query = scope_to_member_projects(task_query, Task.project_id, current_user)
+    project_query = scope_to_member_projects(project_query, Project.id, current_user)
     
     tasks = task_query.limit(20).all()
     projects = project_query.limit(10).all()
@@ -0,0 +1,166 @@
+"""
+Project-membership cache.
+
+A user's set of project ids is memoized per request on `flask.g` and kept in
+a process-level LRU, so access checks and "projects I belong to" scoping
+filters stop re-querying ProjectMember. Entries are dropped whenever a
+membership changes (`invalidate_user` / `invalidate_project`), in the other
+server processes too when SOCKETIO_MESSAGE_QUEUE is set (see
+message_queue.py), and expire after MEMBERSHIP_CACHE_TTL seconds as a safety
+net. Several processes without a queue only see each other's changes through
+the TTL, so keep it at a second or so there (0 never expires).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context
+
+from .extensions import db
+from .message_queue import on_invalidation, publish_invalidation
+
+
+class MembershipCache:
+    """Thread-safe LRU of user id -> frozenset of project ids"""
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            project_ids, stored_at = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return project_ids
+
+    def set(self, user_id, project_ids):
+        with self._lock:
+            self._entries[user_id] = (project_ids, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def invalidate_project(self, project_id):
+        with self._lock:
+            user_ids = [uid for uid, (ids, _) in self._entries.items() if project_id in ids]
+            for user_id in user_ids:
+                del self._entries[user_id]
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def version(self, user_id):
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = MembershipCache()
+on_invalidation('membership_user', _cache.invalidate_user)
+on_invalidation('membership_project', _cache.invalidate_project)
+
+
+def configure_membership_cache(app):
+    _cache.max_size = app.config.get('MEMBERSHIP_CACHE_SIZE', 1024)
+    _cache.ttl = app.config.get('MEMBERSHIP_CACHE_TTL', 60)
+
+
+def _user_id(user):
+    return user if isinstance(user, int) else user.id
+
+
+def _project_id(project):
+    return project if isinstance(project, int) else project.id
+
+
+def _request_memo():
+    if not has_request_context():
+        return None
+    memo = getattr(g, '_member_project_ids', None)
+    if memo is None:
+        memo = g._member_project_ids = {}
+    return memo
+
+
+def _load_project_ids(user_id):
+    from .models import ProjectMember
+    rows = db.session.query(ProjectMember.project_id).filter(
+        ProjectMember.user_id == user_id
+    ).all()
+    return frozenset(row[0] for row in rows)
+
+
+def get_member_project_ids(user):
+    """Return the frozenset of project ids `user` (or a user id) is a member of"""
+    user_id = _user_id(user)
+
+    memo = _request_memo()
+    if memo is not None and user_id in memo:
+        return memo[user_id]
+
+    project_ids = _cache.get(user_id)
+    if project_ids is None:
+        project_ids = _load_project_ids(user_id)
+        _cache.set(user_id, project_ids)
+
+    if memo is not None:
+        memo[user_id] = project_ids
+    return project_ids
+
+
+def is_project_member(user, project):
+    """Check membership of `user` in `project` (objects or ids)"""
+    return _project_id(project) in get_member_project_ids(user)
+
+
+def can_access_project(user, project):
+    """Admins can access every project, everyone else only their own"""
+    return user.is_admin() or is_project_member(user, project)
+
+
+def scope_to_member_projects(query, column, user):
+    """Filter `query` to rows whose `column` is one of the user's projects"""
+    if user.is_admin():
+        return query
+    return query.filter(column.in_(sorted(get_member_project_ids(user))))
+
+
+def membership_version(user):
+    """Counter bumped every time the user's memberships are invalidated in this process"""
+    return _cache.version(_user_id(user))
+
+
+def _forget_request_memo():
+    memo = _request_memo()
+    if memo is not None:
+        memo.clear()
+
+
+def invalidate_user(user):
+    """Drop cached memberships of `user` (or a user id)"""
+    _cache.invalidate_user(_user_id(user))
+    _forget_request_memo()
+    publish_invalidation('membership_user', _user_id(user))
+
+
+def invalidate_project(project):
+    """Drop cached memberships of every user cached as a member of `project`"""
+    _cache.invalidate_project(_project_id(project))
+    _forget_request_memo()
+    publish_invalidation('membership_project', _project_id(project))
@@ -0,0 +1,120 @@
+"""
+@mention resolution.
+
+All usernames in a comment are extracted once and looked up in a
+process-level username -> user directory; names it has not seen yet are
+loaded with a single `IN` query. Project membership of the candidates is then
+checked with one query against the project's members, so a comment
+mentioning ten people costs at most two queries instead of ~twenty. The
+directory is cleared whenever a transaction that wrote users commits, in the
+other server processes too when SOCKETIO_MESSAGE_QUEUE is set, and expires
+after MENTION_CACHE_TTL seconds as a safety net.
+"""
+
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .extensions import db
+from .message_queue import on_invalidation, publish_invalidation
+
+MENTION_PATTERN = re.compile(r'@(\w+)')
+
+# The directory (including cached misses) is dropped when it grows past this
+MAX_DIRECTORY_SIZE = 10000
+
+
+class UsernameDirectory:
+    """Thread-safe username -> (user id, is admin) map, filled on demand"""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._entries = {}
+        self._loaded_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _expire_if_stale(self):
+        if self.ttl and time.monotonic() - self._loaded_at > self.ttl:
+            self._entries.clear()
+            self._loaded_at = time.monotonic()
+
+    def lookup(self, usernames):
+        """{username: (user_id, is_admin)} for the usernames that exist"""
+        from .models import User
+
+        with self._lock:
+            self._expire_if_stale()
+            known = {name: self._entries[name] for name in usernames if name in self._entries}
+        missing = [name for name in usernames if name not in known]
+        if missing:
+            rows = db.session.query(User.username, User.id, User.role).filter(User.username.in_(missing)).all()
+            # Unknown names are cached as None so typos don't hit the database every time
+            loaded = dict.fromkeys(missing)
+            loaded.update({username: (user_id, role == 'ADMIN') for username, user_id, role in rows})
+            with self._lock:
+                if len(self._entries) + len(loaded) > MAX_DIRECTORY_SIZE:
+                    self._entries.clear()
+                self._entries.update(loaded)
+            known.update(loaded)
+        return {name: entry for name, entry in known.items() if entry is not None}
+
+    def refresh(self):
+        with self._lock:
+            self._entries.clear()
+            self._loaded_at = time.monotonic()
+
+
+directory = UsernameDirectory()
+on_invalidation('usernames', lambda key: directory.refresh())
+
+
+def configure_mention_directory(app):
+    directory.ttl = app.config.get('MENTION_CACHE_TTL', 300)
+
+
+def extract_mentions(text):
+    """Distinct @usernames in `text`, in order of first appearance"""
+    return list(dict.fromkeys(MENTION_PATTERN.findall(text or '')))
+
+
+def resolve_mentions(text, project_id):
+    """Ids of the mentioned users who can access the project"""
+    from .models import ProjectMember
+
+    users = directory.lookup(extract_mentions(text))
+    if not users:
+        return []
+
+    candidate_ids = [user_id for user_id, is_admin in users.values() if not is_admin]
+    members = set()
+    if candidate_ids:
+        members = {user_id for user_id, in db.session.query(ProjectMember.user_id).filter(
+            ProjectMember.project_id == project_id,
+            ProjectMember.user_id.in_(candidate_ids)
+        )}
+
+    # Admins can access every project
+    return [user_id for user_id, is_admin in users.values() if is_admin or user_id in members]
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_users_dirty(session, flush_context):
+    from .models import User
+
+    if any(isinstance(obj, User) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['usernames_dirty'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_after_commit(session):
+    if session.info.pop('usernames_dirty', False):
+        directory.refresh()
+        publish_invalidation('usernames')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_users_dirty(session):
+    session.info.pop('usernames_dirty', None)
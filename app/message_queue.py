@@ -0,0 +1,182 @@
+"""
+Socket.IO message queue for running several server processes.
+
+Without a queue, rooms live in the memory of one process and an emit only
+reaches the sockets connected to it. With SOCKETIO_MESSAGE_QUEUE set, every
+process publishes its emits (and room changes of remote sockets) on a shared
+channel and delivers what the others publish to its own sockets:
+
+- `redis://` / `rediss://`, `kafka://`, `zmq+tcp://` or any Kombu URL
+  (`amqp://`, ...): the python-socketio managers for those brokers
+- `sqlite:///path/to/queue.db`: `SQLiteManager`, a dependency-free queue for
+  processes on one host. Messages are rows of an AUTOINCREMENT table that
+  listeners poll, so every process sees them in commit order; rows older than
+  SOCKETIO_QUEUE_RETENTION seconds are pruned by the publishers.
+
+Processes that only emit (`flask jobs work`) use a write-only `emitter`
+instead of the server's manager: it publishes without listening, and
+`socket_metrics.broadcast` sends through it when it is set.
+
+Each publisher's messages reach every process in order. Emits of different
+processes may interleave differently per process; project-room events carry
+a seq for that (see events.py).
+
+The channel also carries cache invalidations: `publish_invalidation` sends an
+`invalidate` message that the listener of every other process hands to the
+handler registered with `on_invalidation` (membership.py, mentions.py) instead
+of passing it to python-socketio, which ignores unknown methods anyway.
+Write-only emitters publish them but do not listen, so `flask jobs work`
+still relies on the caches' TTLs.
+"""
+
+import sqlite3
+import threading
+import time
+
+import socketio
+from socketio.pubsub_manager import PubSubManager
+
+# Write-only manager used instead of the server by processes that only emit
+emitter = None
+
+# Old messages are pruned once every this many publishes of a process
+PRUNE_EVERY = 500
+
+# cache name -> callable(key) dropping the key from this process's cache
+_invalidation_handlers = {}
+
+
+def on_invalidation(cache, handler):
+    """Call `handler(key)` for invalidations of `cache` published by other processes"""
+    _invalidation_handlers[cache] = handler
+
+
+def _server_manager():
+    from .extensions import socketio
+    return socketio.server.manager if socketio.server is not None else None
+
+
+def publish_invalidation(cache, key=None):
+    """Tell the other processes to drop `key` from `cache`; a no-op without a queue"""
+    manager = emitter or _server_manager()
+    if isinstance(manager, PubSubManager):
+        manager._publish({'method': 'invalidate', 'cache': cache, 'key': key, 'host_id': manager.host_id})
+
+
+class InvalidationListener:
+    """Manager mixin that applies the invalidations on the channel before dispatching the rest"""
+
+    def _listen(self):
+        for message in super()._listen():
+            data = message
+            if not isinstance(data, dict):
+                try:
+                    data = self.json.loads(message)
+                except Exception:
+                    yield message
+                    continue
+            if not isinstance(data, dict) or data.get('method') != 'invalidate':
+                yield data
+                continue
+            # The publishing process already dropped its own entries
+            handler = _invalidation_handlers.get(data.get('cache'))
+            if handler is not None and data.get('host_id') != self.host_id:
+                try:
+                    handler(data.get('key'))
+                except Exception:
+                    self._get_logger().exception('Cache invalidation %s failed', data.get('cache'))
+
+
+class SQLiteManager(PubSubManager):
+    """Pub/sub over a table in a local SQLite file, polled by each listener"""
+
+    name = 'sqlite'
+
+    def __init__(self, url='sqlite:///socketio-queue.db', channel='socketio', write_only=False,
+                 logger=None, json=None, poll_interval=0.02, retention=60):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.path = url[len('sqlite:///'):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._local = threading.local()
+        self._published = 0
+        self._connection().executescript('''
+            CREATE TABLE IF NOT EXISTS socketio_message (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_socketio_message_created_at ON socketio_message (created_at);
+        ''')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit: every insert commits on its own, in id order
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Messages are transient; a crash loses in-flight emits, clients resync
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def _publish(self, data):
+        connection = self._connection()
+        now = time.time()
+        connection.execute(
+            'INSERT INTO socketio_message (channel, payload, created_at) VALUES (?, ?, ?)',
+            (self.channel, self.json.dumps(data), now)
+        )
+        self._published += 1
+        if self._published % PRUNE_EVERY == 0:
+            connection.execute('DELETE FROM socketio_message WHERE created_at < ?', (now - self.retention,))
+
+    def _listen(self):
+        connection = self._connection()
+        last_id = connection.execute('SELECT coalesce(max(id), 0) FROM socketio_message').fetchone()[0]
+        while True:
+            rows = connection.execute(
+                'SELECT id, payload FROM socketio_message WHERE id > ? AND channel = ? ORDER BY id LIMIT 500',
+                (last_id, self.channel)
+            ).fetchall()
+            for last_id, payload in rows:
+                yield payload
+            if not rows:
+                time.sleep(self.poll_interval)
+
+
+def queue_manager(config, write_only=False):
+    """Client manager for SOCKETIO_MESSAGE_QUEUE, or None when no queue is configured"""
+    url = config.get('SOCKETIO_MESSAGE_QUEUE')
+    if not url:
+        return None
+
+    channel = config.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    if url.startswith('sqlite:///'):
+        return _listening(SQLiteManager)(
+            url, channel=channel, write_only=write_only,
+            poll_interval=config.get('SOCKETIO_QUEUE_POLL_INTERVAL', 0.02),
+            retention=config.get('SOCKETIO_QUEUE_RETENTION', 60),
+        )
+    if url.startswith(('redis://', 'rediss://')):
+        queue_class = socketio.RedisManager
+    elif url.startswith('kafka://'):
+        queue_class = socketio.KafkaManager
+    elif url.startswith('zmq'):
+        queue_class = socketio.ZmqManager
+    else:
+        queue_class = socketio.KombuManager
+    return _listening(queue_class)(url, channel=channel, write_only=write_only)
+
+
+def _listening(queue_class):
+    """`queue_class` with InvalidationListener mixed in"""
+    return type(queue_class.__name__, (InvalidationListener, queue_class), {})
+
+
+def start_emitter(app):
+    """Send this process's emits through a write-only manager; False without a queue"""
+    global emitter
+    emitter = queue_manager(app.config, write_only=True)
+    return emitter is not None
@@ -3,6 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
+import zlib
 
 from .extensions import db
 
@@ -23,6 +24,9 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     force_password_change = db.Column(db.Boolean, default=False, nullable=False)
     
+    # Counter cache, maintained by app.counters
+    unread_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    
     # Relationships
     created_projects = db.relationship('Project', backref='creator', lazy='dynamic', foreign_keys='Project.created_by')
     assigned_tasks = db.relationship('Task', backref='assignee', lazy='dynamic', foreign_keys='Task.assignee_id')
@@ -43,7 +47,7 @@ class User(UserMixin, db.Model):
         return self.role == 'ADMIN'
     
     def get_unread_notifications_count(self):
-        return self.notifications.filter_by(is_read=False).count()
+        return self.unread_count
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -56,6 +60,14 @@ class Project(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    # Counter caches, maintained by app.counters
+    task_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    done_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    member_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    
+    # Sequence number of the project's latest socket event, allocated by app.events
+    event_seq = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    
     # Relationships
     tasks = db.relationship('Task', backref='project', lazy='dynamic', cascade='all, delete-orphan')
     members = db.relationship('ProjectMember', backref='project', lazy='dynamic', cascade='all, delete-orphan')
@@ -65,13 +77,17 @@ class Project(db.Model):
         return User.query.join(ProjectMember).filter(ProjectMember.project_id == self.id).all()
     
     def is_member(self, user):
-        return ProjectMember.query.filter_by(user_id=user.id, project_id=self.id).first() is not None
+        from .membership import is_project_member
+        return is_project_member(user, self)
     
     def __repr__(self):
         return f'<Project {self.name}>'
 
 class ProjectMember(db.Model):
     __tablename__ = 'project_member'
+    __table_args__ = (
+        db.Index('ix_project_member_project_id', 'project_id'),
+    )
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
     role_in_project = db.Column(db.String(50), default='MEMBER')  # MEMBER, LEAD, etc.
@@ -79,6 +95,9 @@ class ProjectMember(db.Model):
 
 class StatusConfig(db.Model):
     __tablename__ = 'status_config'
+    __table_args__ = (
+        db.Index('ix_status_config_project_order', 'project_id', 'order_index'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     name = db.Column(db.String(50), nullable=False)  # ToDo, Doing, Review, Done
@@ -91,6 +110,14 @@ class StatusConfig(db.Model):
         return f'<StatusConfig {self.name}>'
 
 class Task(db.Model):
+    # Composite indexes for the hot filters of task lists, board, dashboard and export
+    __table_args__ = (
+        db.Index('ix_task_project_status_updated', 'project_id', 'status', 'updated_at'),
+        db.Index('ix_task_assignee_status_due', 'assignee_id', 'status', 'due_date'),
+        db.Index('ix_task_updated_at', 'updated_at'),
+        db.Index('ix_task_due_date', 'due_date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
@@ -104,6 +131,10 @@ class Task(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
+    # Counter caches, maintained by app.counters
+    comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    attachment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    
     # Relationships
     attachments = db.relationship('TaskAttachment', backref='task', lazy='dynamic', cascade='all, delete-orphan')
     comments = db.relationship('TaskComment', backref='task', lazy='dynamic', cascade='all, delete-orphan')
@@ -114,6 +145,15 @@ class Task(db.Model):
             return datetime.utcnow() > self.due_date
         return False
     
+    def card_version(self):
+        """Changes whenever the task's board card renders differently"""
+        # Counters and tags (task_tags rows, tag renames) change without touching updated_at
+        tags = zlib.crc32(repr(sorted((tag.id, tag.name, tag.color) for tag in self.tags)).encode('utf-8'))
+        return (
+            f'{self.updated_at.isoformat()}.{self.comment_count}.{self.attachment_count}.'
+            f'{int(self.is_overdue())}.{tags:08x}'
+        )
+    
     def get_priority_display(self):
         priority_map = {'Low': 'کم', 'Med': 'متوسط', 'High': 'بالا'}
         return priority_map.get(self.priority, self.priority)
@@ -133,7 +173,7 @@ class Task(db.Model):
 class TaskAttachment(db.Model):
     __tablename__ = 'task_attachment'
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
     path = db.Column(db.String(500), nullable=False)
@@ -156,7 +196,7 @@ class TaskAttachment(db.Model):
 class TaskComment(db.Model):
     __tablename__ = 'task_comment'
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False, index=True)
     body = db.Column(db.Text, nullable=False)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -180,12 +220,23 @@ class Tag(db.Model):
         return f'<Tag {self.name}>'
 
 class Notification(db.Model):
+    # Unread badge / inbox listing per user
+    __table_args__ = (
+        db.Index('ix_notification_user_read_created', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_notification_user_created', 'user_id', 'created_at'),
+        # Retention scans for old read notifications
+        db.Index('ix_notification_read_created', 'is_read', 'created_at'),
+        # Coalescing lookups of a recent notification about the same subject
+        db.Index('ix_notification_user_type_key', 'user_id', 'type', 'coalesce_key'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     type = db.Column(db.String(50), nullable=False)  # task_assigned, task_updated, comment_mention, etc.
     title = db.Column(db.String(200), nullable=False)
     message = db.Column(db.Text, nullable=False)
     payload_json = db.Column(db.Text)  # JSON data for additional info
+    coalesce_key = db.Column(db.String(100))  # e.g. task:12; repeats within a window update this row
     is_read = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
@@ -205,8 +256,38 @@ class Notification(db.Model):
     def __repr__(self):
         return f'<Notification {self.type}>'
 
+class NotificationArchive(db.Model):
+    # Notifications moved out of the inbox by app.retention, partitioned by month
+    __tablename__ = 'notification_archive'
+    __table_args__ = (
+        db.Index('ix_notification_archive_month', 'month'),
+        db.Index('ix_notification_archive_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notification_archive_notification_id', 'notification_id'),
+    )
+    
+    # Own key: SQLite hands out the id of an archived notification again
+    id = db.Column(db.Integer, primary_key=True)
+    notification_id = db.Column(db.Integer)  # id of the original notification
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    payload_json = db.Column(db.Text)
+    coalesce_key = db.Column(db.String(100))
+    is_read = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM of created_at
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<NotificationArchive {self.month} {self.type}>'
+
 class ActivityLog(db.Model):
     __tablename__ = 'activity_log'
+    __table_args__ = (
+        db.Index('ix_activity_log_created_at', 'created_at'),
+        db.Index('ix_activity_log_entity', 'entity_type', 'entity_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     actor_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     entity_type = db.Column(db.String(50), nullable=False)  # Task, Project, User, etc.
@@ -230,4 +311,55 @@ class ActivityLog(db.Model):
         self.meta_json = json.dumps(data) if data else None
     
     def __repr__(self):
-        return f'<ActivityLog {self.action} {self.entity_type}>'
\ No newline at end of file
+        return f'<ActivityLog {self.action} {self.entity_type}>'
+
+class ProjectEvent(db.Model):
+    # Recent socket events of a project room, replayed to reconnecting clients by app.events
+    __tablename__ = 'project_event'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    event = db.Column(db.String(50), nullable=False)
+    data_json = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def get_data(self):
+        return json.loads(self.data_json)
+    
+    def __repr__(self):
+        return f'<ProjectEvent {self.project_id}#{self.seq} {self.event}>'
+
+class Job(db.Model):
+    # Workers poll pending jobs that are due; idempotency keys are unique
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)  # handler name, e.g. email.send
+    payload_json = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, running, done, failed
+    idempotency_key = db.Column(db.String(200), unique=True)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    last_error = db.Column(db.Text)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def get_payload(self):
+        """Get payload as Python dict"""
+        if self.payload_json:
+            try:
+                return json.loads(self.payload_json)
+            except:
+                return {}
+        return {}
+    
+    def set_payload(self, data):
+        """Set payload from Python dict"""
+        self.payload_json = json.dumps(data) if data else None
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.name} {self.status}>'
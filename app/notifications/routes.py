@@ -2,25 +2,23 @@ from flask import render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from . import bp
 from ..models import Notification
-from ..utils import is_ajax_request, ajax_response
+from ..utils import is_ajax_request, ajax_response, mark_notifications_read, delete_notifications
+from ..pagination import keyset_paginate
+from ..http_cache import conditional, recent_notifications_state
 from ..extensions import db
 from sqlalchemy import desc
 
 @bp.route('/')
 @login_required
 def index():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     
-    notifications = current_user.notifications.order_by(desc(Notification.created_at)).paginate(
-        page=page, per_page=20, error_out=False
+    notifications = keyset_paginate(
+        current_user.notifications, [Notification.created_at, Notification.id], cursor=cursor, per_page=20
     )
     
     # Mark all notifications as read when viewing the page
-    unread_notifications = current_user.notifications.filter_by(is_read=False).all()
-    for notification in unread_notifications:
-        notification.is_read = True
-    
-    if unread_notifications:
+    if current_user.unread_count and mark_notifications_read(current_user.id):
         db.session.commit()
     
     return render_template('notifications/index.html', notifications=notifications)
@@ -28,12 +26,19 @@ def index():
 @bp.route('/unread-count')
 @login_required
 def unread_count():
-    """Get unread notifications count for AJAX requests"""
-    count = current_user.get_unread_notifications_count()
-    return jsonify({'count': count})
+    """Unread count fallback for clients without a socket connection.
+    
+    Served from the User.unread_count counter (the user row is already loaded
+    for the session), with an ETag so unchanged polls get a 304.
+    """
+    response = jsonify({'count': current_user.unread_count})
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 @bp.route('/recent')
 @login_required
+@conditional(recent_notifications_state, vary=('HX-Request', 'X-Requested-With'))
 def recent():
     """Get recent notifications for dropdown/popup"""
     notifications = current_user.notifications.order_by(desc(Notification.created_at)).limit(10).all()
@@ -73,7 +78,7 @@ def mark_read(notification_id):
 @bp.route('/mark-all-read', methods=['POST'])
 @login_required
 def mark_all_read():
-    current_user.notifications.filter_by(is_read=False).update({'is_read': True})
+    mark_notifications_read(current_user.id)
     db.session.commit()
     
     if is_ajax_request():
@@ -102,7 +107,7 @@ def delete(notification_id):
 @bp.route('/clear-all', methods=['POST'])
 @login_required
 def clear_all():
-    current_user.notifications.delete()
+    delete_notifications(current_user.id)
     db.session.commit()
     
     if is_ajax_request():
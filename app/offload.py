@@ -0,0 +1,119 @@
+"""
+Blocking database work for Socket.IO handlers.
+
+SQLAlchemy and the sqlite3/psycopg drivers block the calling OS thread. Under
+eventlet or gevent that thread is the event loop, so one slow query stalls
+every websocket of the process. Socket handlers therefore hand their
+database work to `run_db`, which runs it on a bounded pool of real OS
+threads (SOCKETIO_DB_POOL_SIZE) and waits without blocking the loop:
+
+- threading: a ThreadPoolExecutor; the bound doubles as back-pressure on the
+  database when many sockets fire at once
+- eventlet: `eventlet.tpool`, capped by a green semaphore
+- gevent: the hub's native thread pool
+
+The work runs in a copy of the handler's request context, so `current_user`,
+`request.sid` and a fresh `db.session` are available; emits and room joins
+stay in the handler.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import copy_current_request_context, current_app, has_request_context
+
+# Modes Flask-SocketIO can serve; asyncio/ASGI servers are not supported by it
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+
+
+class DatabasePool:
+    """At most `size` concurrent blocking calls, awaited in the server's async mode"""
+
+    def __init__(self):
+        self.mode = 'threading'
+        self.size = 0
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    def configure(self, async_mode, size):
+        self.shutdown()
+        self.mode = async_mode
+        self.size = max(1, size)
+        if async_mode == 'eventlet':
+            from eventlet.semaphore import Semaphore
+            self._slots = Semaphore(self.size)
+        elif async_mode == 'gevent':
+            from gevent.threadpool import ThreadPool
+            self._executor = ThreadPool(self.size)
+        else:
+            self._executor = ThreadPoolExecutor(self.size, thread_name_prefix='socket-db')
+
+    def _track(self, delta):
+        with self._lock:
+            self._stats['in_flight'] += delta
+            if delta > 0:
+                self._stats['calls'] += 1
+                self._stats['max_in_flight'] = max(self._stats['max_in_flight'], self._stats['in_flight'])
+
+    def _call(self, fn, args, kwargs):
+        self._track(1)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._track(-1)
+
+    def run(self, fn, *args, **kwargs):
+        if self.mode == 'eventlet':
+            from eventlet import tpool
+            with self._slots:
+                return tpool.execute(self._call, fn, args, kwargs)
+        if self.mode == 'gevent':
+            return self._executor.apply(self._call, (fn, args, kwargs))
+        if self._executor is None:
+            # Not configured (scripts importing the handlers directly)
+            return fn(*args, **kwargs)
+        return self._executor.submit(self._call, fn, args, kwargs).result()
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._stats, mode=self.mode, pool_size=self.size)
+
+    def shutdown(self):
+        if isinstance(self._executor, ThreadPoolExecutor):
+            self._executor.shutdown(wait=False)
+        elif self._executor is not None:
+            self._executor.kill()
+        self._executor = None
+
+
+pool = DatabasePool()
+
+
+def configure_offload(app):
+    pool.configure(app.config['SOCKETIO_ASYNC_MODE'], app.config.get('SOCKETIO_DB_POOL_SIZE', 8))
+
+
+def check_async_mode(mode):
+    """Validate SOCKETIO_ASYNC_MODE before the server is created"""
+    if mode not in ASYNC_MODES:
+        raise ValueError(
+            f'SOCKETIO_ASYNC_MODE must be one of {", ".join(ASYNC_MODES)}, not {mode!r}'
+            ' (Flask-SocketIO cannot be served by asyncio/ASGI servers)'
+        )
+    return mode
+
+
+def run_db(fn, *args, **kwargs):
+    """Run `fn` on the database pool inside a copy of the current context and return its result"""
+    if has_request_context():
+        fn = copy_current_request_context(fn)
+    else:
+        app = current_app._get_current_object()
+        work = fn
+
+        def fn(*args, **kwargs):
+            with app.app_context():
+                return work(*args, **kwargs)
+    return pool.run(fn, *args, **kwargs)
@@ -0,0 +1,205 @@
+"""
+Keyset (seek) pagination.
+
+Pages are addressed by an opaque cursor holding the sort key of the last (or
+first) row of the previous page, so fetching any page costs one index seek
+plus LIMIT rows instead of COUNT(*) and an OFFSET walk.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app, request, url_for
+from sqlalchemy import func, select, tuple_
+
+from .extensions import db
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values, direction):
+    """Encode a sort key and direction ('next' or 'prev') as an opaque token"""
+    payload = [direction] + [
+        {'dt': v.isoformat()} if isinstance(v, datetime) else v
+        for v in values
+    ]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token produced by `encode_cursor` into (values, direction)"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+        direction, values = payload[0], payload[1:]
+        if direction not in ('next', 'prev'):
+            raise InvalidCursor(token)
+        values = [
+            datetime.fromisoformat(v['dt']) if isinstance(v, dict) else v
+            for v in values
+        ]
+    except InvalidCursor:
+        raise
+    except Exception:
+        raise InvalidCursor(token)
+    return values, direction
+
+
+def _seek_condition(columns, values, descending, forward):
+    """WHERE clause selecting rows strictly after `values` in scan order.
+
+    A row-value comparison, `(created_at, id) < (?, ?)`, which SQLite and
+    PostgreSQL turn into a range on the sort index; the equivalent OR of
+    per-column comparisons only narrows on the index's equality prefix.
+    """
+    after = descending == forward  # walking towards smaller keys
+    key = tuple_(*columns)
+    bound = tuple_(*values, types=[column.type for column in columns])
+    return key < bound if after else key > bound
+
+
+def _count_rows(query, limit):
+    """Count matching rows, stopping at `limit` (None for an exact count)"""
+    statement = query.order_by(None).statement
+    if limit:
+        statement = statement.limit(limit + 1)
+    return db.session.execute(
+        select(func.count()).select_from(statement.subquery())
+    ).scalar()
+
+
+class KeysetPage:
+    """One page of a keyset-paginated query"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None,
+                 total=None, total_is_estimate=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def next_url(self, **kwargs):
+        return _cursor_url(self.next_cursor, **kwargs) if self.has_next else None
+
+    def prev_url(self, **kwargs):
+        return _cursor_url(self.prev_cursor, **kwargs) if self.has_prev else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _cursor_url(cursor, **kwargs):
+    args = request.args.to_dict()
+    args.pop('page', None)
+    args.update(kwargs)
+    args['cursor'] = cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def _parse_cursor(cursor, width=None):
+    """(values, direction) of a cursor; invalid or mismatched cursors start over"""
+    if not cursor:
+        return None, 'next'
+    try:
+        values, direction = decode_cursor(cursor)
+    except InvalidCursor:
+        return None, 'next'
+    if width is not None and len(values) != width:
+        return None, 'next'
+    return values, direction
+
+
+def _page_cursors(rows, key_of, values, forward, has_more):
+    next_cursor = prev_cursor = None
+    if rows:
+        if (forward and has_more) or (not forward and values is not None):
+            next_cursor = encode_cursor(key_of(rows[-1]), 'next')
+        if (forward and values is not None) or (not forward and has_more):
+            prev_cursor = encode_cursor(key_of(rows[0]), 'prev')
+    return next_cursor, prev_cursor
+
+
+def keyset_rows(query, columns, values, forward, limit, descending=True):
+    """Up to `limit` rows of `query` strictly past `values`, in scan order"""
+    if values is not None:
+        query = query.filter(_seek_condition(columns, values, descending, forward))
+    scan_descending = descending == forward
+    ordering = [c.desc() if scan_descending else c.asc() for c in columns]
+    return query.order_by(None).order_by(*ordering).limit(limit).all()
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=20, descending=True, count=None):
+    """Return a KeysetPage of `query` ordered by `columns`.
+
+    `columns` must end with a unique column (normally the primary key) so
+    that the sort key is total. `count` caps the approximate total: pass
+    None to use the PAGINATION_COUNT_LIMIT config, 0 to skip counting.
+    """
+    if count is None:
+        count = current_app.config.get('PAGINATION_COUNT_LIMIT', 0)
+
+    values, direction = _parse_cursor(cursor, len(columns))
+    forward = direction == 'next'
+    rows = keyset_rows(query, columns, values, forward, per_page + 1, descending)
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    def key_of(item):
+        return [getattr(item, c.key) for c in columns]
+
+    next_cursor, prev_cursor = _page_cursors(rows, key_of, values, forward, has_more)
+
+    total = None
+    total_is_estimate = False
+    if count:
+        total = _count_rows(query, count)
+        if total > count:
+            total, total_is_estimate = count, True
+
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor, total, total_is_estimate)
+
+
+def merge_paginate(fetchers, key_of, cursor=None, per_page=20):
+    """Newest-first keyset pagination over several sources merged in Python.
+
+    Each fetcher is called as `fetcher(values, forward, limit)` and returns up
+    to `limit` items strictly past the sort key `values` in scan order
+    (descending when `forward`). Items whose key was already returned by an
+    earlier fetcher are skipped. No total is computed.
+    """
+    values, direction = _parse_cursor(cursor)
+    forward = direction == 'next'
+
+    merged = {}
+    for fetch in fetchers:
+        for item in fetch(values, forward, per_page + 1):
+            merged.setdefault(tuple(key_of(item)), item)
+    rows = [merged[key] for key in sorted(merged, reverse=forward)]
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    next_cursor, prev_cursor = _page_cursors(rows, key_of, values, forward, has_more)
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor)
@@ -3,7 +3,11 @@ from flask_login import login_required, current_user
 from . import bp
 from ..models import Project, ProjectMember, User, Task, StatusConfig
 from ..forms import ProjectForm, ProjectMemberForm, StatusConfigForm
-from ..utils import admin_required, project_member_required, is_ajax_request, ajax_response, log_activity, create_notification
+from ..utils import admin_required, project_member_required, is_ajax_request, ajax_response, log_activity, create_notifications
+from ..search import filter_projects
+from ..board import load_board, serialize_board
+from ..membership import can_access_project, scope_to_member_projects, invalidate_user, invalidate_project
+from ..http_cache import conditional, project_detail_state, project_board_state
 from ..extensions import db
 from sqlalchemy import desc, and_
 
@@ -16,17 +20,10 @@ def index():
     query = Project.query
     
     # For employees, only show projects they're members of
-    if not current_user.is_admin():
-        project_ids = db.session.query(ProjectMember.project_id).filter(
-            ProjectMember.user_id == current_user.id
-        ).subquery()
-        query = query.filter(Project.id.in_(project_ids))
+    query = scope_to_member_projects(query, Project.id, current_user)
     
     if search:
-        query = query.filter(
-            (Project.name.contains(search)) |
-            (Project.description.contains(search))
-        )
+        query = filter_projects(query, search)
     
     projects = query.filter_by(is_active=True).order_by(desc(Project.created_at)).paginate(
         page=page, per_page=12, error_out=False
@@ -74,8 +71,6 @@ def create():
         )
         db.session.add(member)
         
-        db.session.commit()
-        
         log_activity(
             actor_user_id=current_user.id,
             entity_type='Project',
@@ -84,6 +79,9 @@ def create():
             description=f'پروژه جدید "{project.name}" ایجاد شد'
         )
         
+        db.session.commit()
+        invalidate_user(current_user)
+        
         flash(f'پروژه "{project.name}" با موفقیت ایجاد شد.', 'success')
         
         if is_ajax_request():
@@ -95,17 +93,18 @@ def create():
 
 @bp.route('/<int:project_id>')
 @login_required
+@conditional(project_detail_state)
 def detail(project_id):
     project = Project.query.get_or_404(project_id)
     
     # Check access
-    if not current_user.is_admin() and not project.is_member(current_user):
+    if not can_access_project(current_user, project):
         flash('شما عضو این پروژه نیستید.', 'error')
         return redirect(url_for('projects.index'))
     
     # Get project statistics
-    total_tasks = project.tasks.count()
-    completed_tasks = project.tasks.filter_by(status='Done').count()
+    total_tasks = project.task_count
+    completed_tasks = project.done_count
     
     # Get tasks by status
     status_counts = db.session.query(
@@ -134,12 +133,11 @@ def edit(project_id):
     form = ProjectForm(obj=project)
     
     if form.validate_on_submit():
+        was_active = project.is_active
         project.name = form.name.data
         project.description = form.description.data
         project.is_active = form.is_active.data
         
-        db.session.commit()
-        
         log_activity(
             actor_user_id=current_user.id,
             entity_type='Project',
@@ -148,6 +146,11 @@ def edit(project_id):
             description=f'پروژه "{project.name}" ویرایش شد'
         )
         
+        db.session.commit()
+        
+        if was_active != project.is_active:
+            invalidate_project(project)
+        
         flash(f'پروژه "{project.name}" با موفقیت ویرایش شد.', 'success')
         
         if is_ajax_request():
@@ -159,25 +162,17 @@ def edit(project_id):
 
 @bp.route('/<int:project_id>/board')
 @login_required
+@conditional(project_board_state)
 def board(project_id):
     project = Project.query.get_or_404(project_id)
     
     # Check access
-    if not current_user.is_admin() and not project.is_member(current_user):
+    if not can_access_project(current_user, project):
         flash('شما عضو این پروژه نیستید.', 'error')
         return redirect(url_for('projects.index'))
     
-    # Get status configurations
-    status_configs = StatusConfig.query.filter_by(project_id=project.id).order_by(StatusConfig.order_index).all()
-    
-    # Get tasks grouped by status
-    tasks_by_status = {}
-    for status_config in status_configs:
-        tasks = project.tasks.filter_by(status=status_config.name).order_by(Task.created_at.desc()).all()
-        tasks_by_status[status_config.name] = {
-            'config': status_config,
-            'tasks': tasks
-        }
+    # Status columns and all tasks of the project, grouped by status
+    status_configs, tasks_by_status = load_board(project)
     
     # Get project members for task assignment
     members = project.get_members()
@@ -188,6 +183,23 @@ def board(project_id):
                          tasks_by_status=tasks_by_status,
                          members=members)
 
+@bp.route('/<int:project_id>/board.json')
+@login_required
+def board_json(project_id):
+    project = Project.query.get_or_404(project_id)
+    
+    # Check access
+    if not can_access_project(current_user, project):
+        return jsonify({'error': 'شما عضو این پروژه نیستید.'}), 403
+    
+    status_configs, tasks_by_status = load_board(project)
+    
+    # ETag over the payload; unchanged boards are answered with 304
+    response = jsonify(serialize_board(project, status_configs, tasks_by_status))
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
 @bp.route('/<int:project_id>/members')
 @login_required
 @admin_required
@@ -223,13 +235,12 @@ def add_member(project_id):
             )
             
             db.session.add(member)
-            db.session.commit()
             
             user = User.query.get(form.user_id.data)
             
             # Create notification for the new member
-            create_notification(
-                user_id=user.id,
+            create_notifications(
+                [user.id],
                 notification_type='project_added',
                 title='به پروژه جدیدی اضافه شدید',
                 message=f'شما به پروژه "{project.name}" اضافه شدید.',
@@ -244,6 +255,9 @@ def add_member(project_id):
                 description=f'{user.full_name} به پروژه "{project.name}" اضافه شد'
             )
             
+            db.session.commit()
+            invalidate_user(user.id)
+            
             flash(f'{user.full_name} با موفقیت به پروژه اضافه شد.', 'success')
             
             if is_ajax_request():
@@ -271,11 +285,10 @@ def remove_member(project_id, user_id):
         return redirect(url_for('projects.members', project_id=project.id))
     
     db.session.delete(member)
-    db.session.commit()
     
     # Create notification
-    create_notification(
-        user_id=user.id,
+    create_notifications(
+        [user.id],
         notification_type='project_removed',
         title='از پروژه‌ای حذف شدید',
         message=f'شما از پروژه "{project.name}" حذف شدید.',
@@ -290,6 +303,9 @@ def remove_member(project_id, user_id):
         description=f'{user.full_name} از پروژه "{project.name}" حذف شد'
     )
     
+    db.session.commit()
+    invalidate_user(user_id)
+    
     flash(f'{user.full_name} از پروژه حذف شد.', 'success')
     
     if is_ajax_request():
@@ -0,0 +1,241 @@
+"""
+Registry of hot queries and an EXPLAIN QUERY PLAN verifier.
+
+Each registered query is a callable returning a SQLAlchemy Query/Select that
+mirrors one of the filters used by the routes. `check_query_plans` runs
+EXPLAIN QUERY PLAN on every entry and reports any full table scan.
+"""
+
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, desc, func
+
+from .extensions import db
+from .pagination import _seek_condition
+
+HOT_QUERIES = {}
+
+# "SCAN task" (SQLite >= 3.36) or "SCAN TABLE task" (older) without an index
+_FULL_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+
+
+def hot_query(name):
+    """Register a query builder under `name`"""
+    def decorator(f):
+        HOT_QUERIES[name] = f
+        return f
+    return decorator
+
+
+def explain_query_plan(query):
+    """Return the EXPLAIN QUERY PLAN detail lines for a Query/Select"""
+    statement = getattr(query, 'statement', query)
+    # Expanding IN lists are rendered as one placeholder per value
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.construct_params()
+    values = []
+    for name in compiled.positiontup:
+        value = params[name]
+        if isinstance(value, datetime):
+            value = value.isoformat(' ')
+        values.append(value)
+
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', tuple(values)).fetchall()
+    return [row[-1] for row in rows]
+
+
+def find_full_scans(plan):
+    """Return the table names that the plan reads with a full table scan"""
+    scans = []
+    for detail in plan:
+        match = _FULL_SCAN_RE.match(detail.strip())
+        # Scans of subqueries (FTS matches, grouped ranks) read their own small results
+        if match and match.group(1) in db.metadata.tables:
+            scans.append(match.group(1))
+    return scans
+
+
+def check_query_plans(names=None):
+    """Explain every registered hot query.
+
+    Returns a list of (name, plan, full_scans) tuples.
+    """
+    results = []
+    for name, builder in HOT_QUERIES.items():
+        if names and name not in names:
+            continue
+        plan = explain_query_plan(builder())
+        results.append((name, plan, find_full_scans(plan)))
+    return results
+
+
+def _next_page(query, columns, per_page):
+    """`query` as keyset_paginate runs it for a page after the first (newest first)"""
+    values = [datetime(2024, 1, 1), 1000]
+    return query.filter(
+        _seek_condition(columns, values, descending=True, forward=True)
+    ).order_by(*(column.desc() for column in columns)).limit(per_page + 1)
+
+
+def _member_project_ids(user_id=1):
+    from .models import ProjectMember
+    return db.select(ProjectMember.project_id).where(ProjectMember.user_id == user_id)
+
+
+@hot_query('tasks.index')
+def _tasks_index():
+    from .models import Task, Project
+    return Task.query.join(Project).filter(
+        Task.project_id.in_(_member_project_ids())
+    ).order_by(desc(Task.updated_at)).limit(20)
+
+
+@hot_query('tasks.index.project_status')
+def _tasks_index_project_status():
+    from .models import Task
+    return Task.query.filter(
+        Task.project_id == 1,
+        Task.status == 'Doing'
+    ).order_by(desc(Task.updated_at)).limit(20)
+
+
+@hot_query('projects.board')
+def _board():
+    # board.load_board: all tasks of the project, split into columns in Python
+    from .models import Task
+    return Task.query.filter(Task.project_id == 1).order_by(Task.created_at.desc(), Task.id.desc())
+
+
+@hot_query('projects.detail.status_counts')
+def _project_status_counts():
+    from .models import Task
+    return db.session.query(Task.status, func.count(Task.id)).filter(
+        Task.project_id == 1
+    ).group_by(Task.status)
+
+
+@hot_query('main.dashboard.recent_tasks')
+def _dashboard_recent_tasks():
+    from .models import Task
+    return Task.query.order_by(desc(Task.updated_at)).limit(10)
+
+
+@hot_query('main.dashboard.my_tasks')
+def _dashboard_my_tasks():
+    from .models import Task
+    return Task.query.filter_by(assignee_id=1).filter(
+        Task.status != 'Done'
+    ).order_by(Task.due_date.asc().nullslast()).limit(5)
+
+
+@hot_query('main.dashboard.overdue_tasks')
+def _dashboard_overdue_tasks():
+    from .models import Task
+    return Task.query.filter(
+        Task.due_date < datetime.utcnow(),
+        Task.status != 'Done'
+    ).limit(5)
+
+
+@hot_query('tasks.detail.comments')
+def _task_comments():
+    from .models import TaskComment
+    return TaskComment.query.filter_by(task_id=1).order_by(TaskComment.created_at.asc())
+
+
+@hot_query('tasks.detail.attachments')
+def _task_attachments():
+    from .models import TaskAttachment
+    return TaskAttachment.query.filter_by(task_id=1).order_by(TaskAttachment.uploaded_at.desc())
+
+
+@hot_query('projects.members')
+def _project_members():
+    from .models import User, ProjectMember
+    return User.query.join(ProjectMember).filter(ProjectMember.project_id == 1)
+
+
+@hot_query('notifications.unread_count')
+def _notifications_unread_count():
+    from .models import Notification
+    return db.session.query(func.count(Notification.id)).filter(
+        Notification.user_id == 1,
+        Notification.is_read == False
+    )
+
+
+@hot_query('notifications.index')
+def _notifications_index():
+    from .models import Notification
+    return _next_page(
+        Notification.query.filter_by(user_id=1), [Notification.created_at, Notification.id], 20
+    )
+
+
+@hot_query('admin.activity_log')
+def _activity_log():
+    from .models import ActivityLog
+    return _next_page(ActivityLog.query, [ActivityLog.created_at, ActivityLog.id], 50)
+
+
+@hot_query('activity_log.entity')
+def _activity_log_entity():
+    from .models import ActivityLog
+    return _next_page(
+        ActivityLog.query.filter_by(entity_type='Task', entity_id=1), [ActivityLog.created_at, ActivityLog.id], 50
+    )
+
+
+def _task_stats(*criteria):
+    # stats._compute_task_stats: one conditional-aggregation row per status
+    from .models import Task
+    now = datetime.utcnow()
+    done = Task.status == 'Done'
+
+    def count_if(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    return db.session.query(
+        Task.status,
+        func.count(Task.id),
+        count_if(and_(done, Task.updated_at >= now - timedelta(days=7))),
+        count_if(and_(done, Task.updated_at >= now - timedelta(days=30))),
+        count_if(and_(Task.due_date < now, Task.status != 'Done')),
+    ).filter(*criteria).group_by(Task.status)
+
+
+# stats._compute_system_stats is left out: its whole-table counts are
+# expected scans, run at most once per STATS_CACHE_TTL
+@hot_query('stats.tasks.project')
+def _stats_tasks_project():
+    from .models import Task
+    return _task_stats(Task.project_id == 1)
+
+
+@hot_query('stats.tasks.member_projects')
+def _stats_tasks_member_projects():
+    from .models import Task
+    return _task_stats(Task.project_id.in_([1, 2]))
+
+
+@hot_query('search.tasks')
+def _search_tasks():
+    from .models import Task
+    from .search import search_tasks
+    return search_tasks(Task.query, 'report').limit(20)
+
+
+@hot_query('search.tasks.member_projects')
+def _search_tasks_member_projects():
+    from .models import Task
+    from .search import search_tasks
+    return search_tasks(Task.query, 'report', project_ids={1, 2}).limit(20)
+
+
+@hot_query('search.projects')
+def _search_projects():
+    from .models import Project
+    from .search import search_projects
+    return search_projects(Project.query, 'report').limit(20)
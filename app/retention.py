@@ -0,0 +1,177 @@
+"""
+Notification retention.
+
+Read notifications older than NOTIFICATION_ARCHIVE_AFTER_DAYS, and each
+user's oldest notifications beyond NOTIFICATION_INBOX_CAP, are moved to the
+`notification_archive` table (partitioned by a YYYY-MM `month` column) in
+batches of NOTIFICATION_RETENTION_BATCH_SIZE rows. Every batch is its own
+short transaction, so the write lock is never held for longer than one
+batch. In the background this runs as a periodic job that handles one batch
+per run and reschedules itself immediately while work remains;
+`flask notifications retention` runs a full pass in the foreground.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, insert
+
+from .counters import adjust_unread_counts
+from .extensions import db
+from .jobs import periodic_job
+
+# Rough per-row storage overhead on top of the text columns (ids, flags, dates, index entries)
+ROW_OVERHEAD_BYTES = 64
+
+ARCHIVED_COLUMNS = (
+    'id', 'user_id', 'type', 'title', 'message', 'payload_json', 'coalesce_key', 'is_read', 'created_at',
+)
+
+
+def new_report():
+    return {
+        'archived': 0,
+        'capped': 0,
+        'bytes_reclaimed': 0,
+        'batches': 0,
+        'seconds': 0.0,
+    }
+
+
+def format_report(report):
+    return (
+        f"Archived {report['archived']} read notifications and {report['capped']} over the inbox cap "
+        f"(~{report['bytes_reclaimed'] / 1024:.1f} KiB) in {report['batches']} batches, "
+        f"{report['seconds']:.2f}s"
+    )
+
+
+def _row_bytes(row):
+    text = (row.title, row.message, row.payload_json or '', row.type, row.coalesce_key or '')
+    return ROW_OVERHEAD_BYTES + sum(len(value.encode('utf-8')) for value in text)
+
+
+def _archive(rows):
+    """Copy rows to the archive and delete them from the inbox; returns bytes moved"""
+    from .models import Notification, NotificationArchive
+
+    if not rows:
+        return 0
+
+    archived_at = datetime.utcnow()
+    db.session.execute(insert(NotificationArchive), [
+        dict(
+            {column: getattr(row, column) for column in ARCHIVED_COLUMNS if column != 'id'},
+            notification_id=row.id,
+            month=row.created_at.strftime('%Y-%m'),
+            archived_at=archived_at,
+        )
+        for row in rows
+    ])
+    db.session.query(Notification).filter(
+        Notification.id.in_([row.id for row in rows])
+    ).delete(synchronize_session=False)
+
+    unread = {}
+    for row in rows:
+        if not row.is_read:
+            unread[row.user_id] = unread.get(row.user_id, 0) - 1
+    adjust_unread_counts(unread)
+
+    return sum(_row_bytes(row) for row in rows)
+
+
+def backfill_archive_notification_ids():
+    """Set notification_id of rows archived when the archive reused the notification id as its key"""
+    from .models import NotificationArchive
+
+    updated = db.session.query(NotificationArchive).filter(
+        NotificationArchive.notification_id.is_(None)
+    ).update({NotificationArchive.notification_id: NotificationArchive.id}, synchronize_session=False)
+    db.session.commit()
+    return updated
+
+
+def _expired_batch(older_than_days, batch_size):
+    from .models import Notification
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    return db.session.query(*(getattr(Notification, column) for column in ARCHIVED_COLUMNS)).filter(
+        Notification.is_read.is_(True), Notification.created_at < cutoff
+    ).order_by(Notification.created_at, Notification.id).limit(batch_size).all()
+
+
+def _overflow_batch(cap, batch_size):
+    from .models import Notification
+
+    columns = [getattr(Notification, column) for column in ARCHIVED_COLUMNS]
+    user_ids = db.session.query(Notification.user_id).group_by(
+        Notification.user_id
+    ).having(func.count(Notification.id) > cap).limit(batch_size).all()
+
+    rows = []
+    for user_id, in user_ids:
+        if len(rows) >= batch_size:
+            break
+        # Everything past the newest `cap` notifications of this user
+        rows.extend(db.session.query(*columns).filter(
+            Notification.user_id == user_id
+        ).order_by(
+            Notification.created_at.desc(), Notification.id.desc()
+        ).offset(cap).limit(batch_size - len(rows)).all())
+    return rows
+
+
+def retention_step(report, config=None):
+    """Archive at most one batch per rule in the current transaction.
+
+    Returns True if a rule filled its batch, i.e. more work is likely left.
+    """
+    config = config or current_app.config
+    batch_size = config.get('NOTIFICATION_RETENTION_BATCH_SIZE', 500)
+    older_than_days = config.get('NOTIFICATION_ARCHIVE_AFTER_DAYS', 90)
+    cap = config.get('NOTIFICATION_INBOX_CAP', 500)
+
+    more = False
+    if older_than_days > 0:
+        rows = _expired_batch(older_than_days, batch_size)
+        report['bytes_reclaimed'] += _archive(rows)
+        report['archived'] += len(rows)
+        more = more or len(rows) == batch_size
+    if cap > 0:
+        rows = _overflow_batch(cap, batch_size)
+        report['bytes_reclaimed'] += _archive(rows)
+        report['capped'] += len(rows)
+        more = more or len(rows) == batch_size
+    report['batches'] += 1
+    return more
+
+
+def run_retention(max_batches=None):
+    """Run retention to completion, committing after every batch"""
+    report = new_report()
+    started = time.perf_counter()
+    try:
+        while max_batches is None or report['batches'] < max_batches:
+            more = retention_step(report)
+            db.session.commit()
+            if not more:
+                break
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        report['seconds'] = time.perf_counter() - started
+    return report
+
+
+@periodic_job('notifications.retention', 'NOTIFICATION_RETENTION_INTERVAL')
+def _retention_job():
+    report = new_report()
+    started = time.perf_counter()
+    more = retention_step(report)
+    report['seconds'] = time.perf_counter() - started
+    if report['archived'] or report['capped']:
+        current_app.logger.info(format_report(report))
+    return more
@@ -0,0 +1,323 @@
+"""
+Full-text search over tasks, projects and comments (SQLite FTS5).
+
+SQLite cannot load a custom FTS5 tokenizer from Python, so normalization
+happens in the indexer instead: every indexed text and every search query
+goes through `normalize_text` (Arabic/Persian letter variants, ZWNJ,
+diacritics, digits) before reaching the `unicode61` tokenizer. The index is
+kept in sync from the ORM flush, inside the same transaction as the change.
+"""
+
+import re
+
+from flask import current_app
+from sqlalchemy import DDL, bindparam, event, inspect, text, Integer, Float
+from sqlalchemy.orm import Session
+
+from .extensions import db
+
+SEARCH_TABLE = 'search_index'
+
+# rowid = entity id * 4 + kind code, so updates and deletes hit the rowid
+KIND_CODES = {'task': 1, 'project': 2, 'comment': 3}
+
+CREATE_SEARCH_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+    'kind UNINDEXED, ref_id UNINDEXED, task_id UNINDEXED, project_id UNINDEXED, '
+    'title, body, tokenize="unicode61 remove_diacritics 2")'
+)
+
+# bm25 weights, one per column: title matches rank ten times higher than body
+BM25_WEIGHTS = '0.0, 0.0, 0.0, 0.0, 10.0, 1.0'
+
+_CHAR_MAP = str.maketrans({
+    '\u064a': '\u06cc',  # Arabic yeh -> Persian yeh
+    '\u0649': '\u06cc',  # alef maksura -> Persian yeh
+    '\u0643': '\u06a9',  # Arabic kaf -> Persian keheh
+    '\u0629': '\u0647',  # teh marbuta -> heh
+    '\u06c0': '\u0647',  # heh with yeh above -> heh
+    '\u0623': '\u0627',  # alef with hamza above -> alef
+    '\u0625': '\u0627',  # alef with hamza below -> alef
+    '\u0671': '\u0627',  # alef wasla -> alef
+    '\u0624': '\u0648',  # waw with hamza -> waw
+    '\u200c': None,  # ZWNJ (نیم‌فاصله)
+    '\u200d': None,  # ZWJ
+    '\u0640': None,  # tatweel
+    **{chr(0x06f0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic-Indic digits
+})
+
+# Arabic harakat, superscript alef and Quranic marks
+_DIACRITICS_RE = re.compile('[\u064b-\u065f\u0670\u06d6-\u06ed]')
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_text(value):
+    """Normalize Persian/Arabic text for indexing and querying"""
+    if not value:
+        return ''
+    value = _DIACRITICS_RE.sub('', value.translate(_CHAR_MAP))
+    return value.lower()
+
+
+def build_match_query(query):
+    """Turn user input into an FTS5 MATCH expression (all terms, prefix match)"""
+    tokens = _TOKEN_RE.findall(normalize_text(query))
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def fts_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def _rowid(kind, entity_id):
+    return entity_id * 4 + KIND_CODES[kind]
+
+
+def _document(obj):
+    """Return (kind, values) for an indexable object, or None"""
+    from .models import Task, Project, TaskComment
+
+    if isinstance(obj, Task):
+        return 'task', {
+            'ref_id': obj.id, 'task_id': obj.id, 'project_id': obj.project_id,
+            'title': obj.title, 'body': obj.description,
+        }
+    if isinstance(obj, Project):
+        return 'project', {
+            'ref_id': obj.id, 'task_id': None, 'project_id': obj.id,
+            'title': obj.name, 'body': obj.description,
+        }
+    if isinstance(obj, TaskComment):
+        project_id = obj.task.project_id if obj.task is not None else None
+        return 'comment', {
+            'ref_id': obj.id, 'task_id': obj.task_id, 'project_id': project_id,
+            'title': '', 'body': obj.body,
+        }
+    return None
+
+
+_INDEXED_ATTRS = {
+    'task': ('title', 'description', 'project_id'),
+    'project': ('name', 'description'),
+    'comment': ('body', 'task_id'),
+}
+
+
+def _needs_reindex(obj, kind):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in _INDEXED_ATTRS[kind])
+
+
+def index_document(connection, kind, values):
+    connection.execute(
+        text(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid'),
+        {'rowid': _rowid(kind, values['ref_id'])}
+    )
+    connection.execute(
+        text(f'INSERT INTO {SEARCH_TABLE} (rowid, kind, ref_id, task_id, project_id, title, body) '
+             'VALUES (:rowid, :kind, :ref_id, :task_id, :project_id, :title, :body)'),
+        {
+            **values,
+            'rowid': _rowid(kind, values['ref_id']),
+            'kind': kind,
+            'title': normalize_text(values['title']),
+            'body': normalize_text(values['body']),
+        }
+    )
+
+
+def remove_document(connection, kind, entity_id):
+    connection.execute(
+        text(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid'),
+        {'rowid': _rowid(kind, entity_id)}
+    )
+
+
+_ready_engines = set()
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    """Mirror inserts, updates and deletes of indexed models into the FTS table"""
+    connection = session.connection()
+    if connection.dialect.name != 'sqlite':
+        return
+
+    # Databases created before the index existed get an empty one; run
+    # `flask rebuild-search-index` to backfill it
+    if connection.engine not in _ready_engines:
+        connection.execute(text(CREATE_SEARCH_TABLE))
+        _ready_engines.add(connection.engine)
+
+    for obj in session.new:
+        document = _document(obj)
+        if document:
+            index_document(connection, *document)
+
+    for obj in session.dirty:
+        document = _document(obj)
+        if document and _needs_reindex(obj, document[0]):
+            index_document(connection, *document)
+
+    for obj in session.deleted:
+        document = _document(obj)
+        if document:
+            remove_document(connection, document[0], document[1]['ref_id'])
+
+
+# Created together with the regular tables by db.create_all()
+event.listen(
+    db.metadata, 'after_create',
+    DDL(CREATE_SEARCH_TABLE).execute_if(dialect='sqlite')
+)
+
+
+def rebuild_search_index(batch_size=1000):
+    """Re-index every task, project and comment; returns the document count"""
+    from .models import Task, Project, TaskComment
+
+    db.session.execute(text(CREATE_SEARCH_TABLE))
+    db.session.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+    connection = db.session.connection()
+
+    sources = (
+        ('project', db.session.query(
+            Project.id, db.null(), Project.id, Project.name, Project.description
+        )),
+        ('task', db.session.query(
+            Task.id, Task.id, Task.project_id, Task.title, Task.description
+        )),
+        ('comment', db.session.query(
+            TaskComment.id, TaskComment.task_id, Task.project_id, db.literal(''), TaskComment.body
+        ).join(Task, Task.id == TaskComment.task_id)),
+    )
+
+    count = 0
+    for kind, query in sources:
+        batch = []
+        for ref_id, task_id, project_id, title, body in query.yield_per(batch_size):
+            batch.append({
+                'rowid': _rowid(kind, ref_id), 'kind': kind, 'ref_id': ref_id,
+                'task_id': task_id, 'project_id': project_id,
+                'title': normalize_text(title), 'body': normalize_text(body),
+            })
+            if len(batch) >= batch_size:
+                count += _insert_documents(connection, batch)
+                batch = []
+        count += _insert_documents(connection, batch)
+
+    db.session.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+    return count
+
+
+def _insert_documents(connection, rows):
+    if rows:
+        connection.execute(
+            text(f'INSERT INTO {SEARCH_TABLE} (rowid, kind, ref_id, task_id, project_id, title, body) '
+                 'VALUES (:rowid, :kind, :ref_id, :task_id, :project_id, :title, :body)'),
+            rows
+        )
+    return len(rows)
+
+
+def match_subquery(query, kinds, limit=None, name='fts', project_ids=None):
+    """FTS matches of `query` as a subquery with (ref_id, task_id, project_id, score).
+
+    Lower scores are better (bm25). The LIMIT keeps SQLite from flattening the
+    subquery, which bm25() does not allow; -1 means no limit. With
+    `project_ids` only matches in those projects are ranked, so the LIMIT is
+    not used up by rows the caller would filter out afterwards. Task and
+    comment matches are scoped through their task's current project (the
+    indexed project_id of a comment is not updated when its task moves).
+    """
+    kind_list = ', '.join(f"'{kind}'" for kind in kinds)
+    scope = ''
+    params = {'match': build_match_query(query), 'limit': limit if limit else -1}
+    if project_ids is not None:
+        if kinds == ('project',):
+            scope = 'AND ref_id IN :project_ids '
+        else:
+            scope = 'AND task_id IN (SELECT id FROM task WHERE project_id IN :project_ids) '
+        params['project_ids'] = sorted(project_ids)
+    statement = text(
+        f'SELECT ref_id, task_id, project_id, bm25({SEARCH_TABLE}, {BM25_WEIGHTS}) AS score '
+        f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match AND kind IN ({kind_list}) '
+        f'{scope}ORDER BY score LIMIT :limit'
+    )
+    if project_ids is not None:
+        statement = statement.bindparams(bindparam('project_ids', expanding=True))
+    statement = statement.bindparams(**params).columns(
+        ref_id=Integer, task_id=Integer, project_id=Integer, score=Float
+    )
+    return statement.subquery(name)
+
+
+def filter_tasks(task_query, query, include_comments=False):
+    """Restrict a Task query to tasks matching `query`"""
+    from .models import Task
+    from sqlalchemy import or_
+
+    if not build_match_query(query):
+        return task_query
+    if not fts_enabled():
+        return task_query.filter(or_(Task.title.contains(query), Task.description.contains(query)))
+
+    kinds = ('task', 'comment') if include_comments else ('task',)
+    matches = match_subquery(query, kinds)
+    return task_query.filter(Task.id.in_(db.select(matches.c.task_id)))
+
+
+def filter_projects(project_query, query):
+    """Restrict a Project query to projects matching `query`"""
+    from .models import Project
+    from sqlalchemy import or_
+
+    if not build_match_query(query):
+        return project_query
+    if not fts_enabled():
+        return project_query.filter(or_(Project.name.contains(query), Project.description.contains(query)))
+
+    matches = match_subquery(query, ('project',))
+    return project_query.filter(Project.id.in_(db.select(matches.c.ref_id)))
+
+
+def search_tasks(task_query, query, include_comments=True, project_ids=None):
+    """Tasks matching `query`, ordered by bm25 rank (best first).
+
+    `project_ids` (None = all projects) limits the ranked matches to those
+    projects before SEARCH_MAX_MATCHES is applied.
+    """
+    from .models import Task
+    from sqlalchemy import func, or_
+
+    if not build_match_query(query):
+        return task_query.filter(db.false())
+    if not fts_enabled():
+        return task_query.filter(or_(Task.title.contains(query), Task.description.contains(query)))
+
+    kinds = ('task', 'comment') if include_comments else ('task',)
+    matches = match_subquery(
+        query, kinds, limit=current_app.config.get('SEARCH_MAX_MATCHES'), project_ids=project_ids
+    )
+    ranked = db.select(
+        matches.c.task_id.label('task_id'), func.min(matches.c.score).label('score')
+    ).group_by(matches.c.task_id).subquery('ranked_tasks')
+    return task_query.join(ranked, ranked.c.task_id == Task.id).order_by(ranked.c.score)
+
+
+def search_projects(project_query, query, project_ids=None):
+    """Projects matching `query`, ordered by bm25 rank (best first); see `search_tasks`"""
+    from .models import Project
+    from sqlalchemy import or_
+
+    if not build_match_query(query):
+        return project_query.filter(db.false())
+    if not fts_enabled():
+        return project_query.filter(or_(Project.name.contains(query), Project.description.contains(query)))
+
+    matches = match_subquery(
+        query, ('project',), limit=current_app.config.get('SEARCH_MAX_MATCHES'), project_ids=project_ids
+    )
+    return project_query.join(matches, matches.c.ref_id == Project.id).order_by(matches.c.score)
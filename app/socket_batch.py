@@ -0,0 +1,196 @@
+"""
+Coalesced project-room emits.
+
+Sequenced project events (the ones carrying a `seq`, see events.py) are
+sent through a per-room outbound buffer. The next event of an idle room
+goes out at once; events arriving within SOCKET_BATCH_WINDOW seconds of the
+last send to the room are held and sent together when the window ends, or
+as soon as SOCKET_BATCH_MAX_SIZE events are waiting.
+
+Job worker threads (and, with a message queue, other processes) emit
+concurrently, so events reach the buffer in any order. A buffer is kept by
+seq and split into runs of consecutive seqs when it is sent; a run is one
+frame. Within a run a later (higher seq) `task_status_changed` or
+`task_updated` of a task replaces the earlier one, keeping the first
+`old_status`, so drag sequences and bulk edits reach subscribers as the
+task's latest state. A buffer that does not continue the room's last sent
+seq is held back for one more window, as the missing events are usually
+still being emitted by another thread.
+
+A batch frame is
+
+    {'project_id': ..., 'first_seq': ..., 'seq': ..., 'events': [{'event': ..., 'data': ...}, ...]}
+
+with the events in seq order. Every seq in `first_seq..seq` was received by
+this outbox and the frame holds the latest state of each, so clients accept
+the seqs dropped by coalescing without a resync; ranges of different
+processes never overlap. A window of 0 sends every event on its own.
+"""
+
+import threading
+import time
+
+# Events that describe a task's state; only the latest per task is kept
+COALESCED_EVENTS = ('task_status_changed', 'task_updated')
+
+
+def _runs(seqs):
+    """Split sorted seqs into lists of consecutive numbers"""
+    runs = []
+    for seq in seqs:
+        if runs and seq == runs[-1][-1] + 1:
+            runs[-1].append(seq)
+        else:
+            runs.append([seq])
+    return runs
+
+
+class RoomOutbox:
+    """Per-room buffers of sequenced events, flushed by a background thread"""
+
+    def __init__(self, send, window=0.05, max_size=50):
+        self.send = send
+        self.window = window
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._due_changed = threading.Condition(self._lock)
+        # Held while sending so frames of a room leave in seq order
+        self._send_lock = threading.Lock()
+        self._buffers = {}  # room -> {'events': {seq: (event, data)}, 'held': bool}
+        self._due = {}  # room -> monotonic time its buffer is sent
+        self._sent_at = {}  # room -> monotonic time of its last frame
+        self._sent_seq = {}  # room -> highest seq sent
+        self._thread = None
+        self._stats = {'events_in': 0, 'coalesced': 0, 'frames_out': 0, 'batch_frames': 0, 'held_back': 0}
+
+    def configure(self, window, max_size):
+        self.window = window
+        self.max_size = max(1, max_size)
+
+    def add(self, event, data, room):
+        """Send the event now if it continues an idle room, otherwise buffer it"""
+        with self._send_lock:
+            with self._lock:
+                frames = self._add(event, data, room, time.monotonic())
+            for frame in frames:
+                self.send(*frame, room)
+
+    def _add(self, event, data, room, now):
+        self._stats['events_in'] += 1
+        seq = data['seq']
+        buffer = self._buffers.get(room)
+        sent_seq = self._sent_seq.get(room)
+        idle = now - self._sent_at.get(room, float('-inf')) >= self.window
+        if buffer is None and idle and (sent_seq is None or seq == sent_seq + 1):
+            self._sent_at[room] = now
+            self._sent_seq[room] = seq
+            self._stats['frames_out'] += 1
+            return [(event, data)]
+
+        if buffer is None:
+            buffer = self._buffers[room] = {'events': {}, 'held': False}
+            self._due[room] = max(now, self._sent_at.get(room, now) + self.window)
+            self._start()
+            self._due_changed.notify()
+        buffer['events'][seq] = (event, data)
+
+        if len(buffer['events']) >= self.max_size:
+            return self._take(room, now)
+        return []
+
+    def _has_gap(self, room, seqs):
+        """Whether the sorted buffered seqs leave a hole after the room's last sent seq"""
+        sent_seq = self._sent_seq.get(room)
+        if sent_seq is None:
+            start = seqs[0]
+        else:
+            # Late events (at or below it) go out as they are
+            seqs = [seq for seq in seqs if seq > sent_seq]
+            if not seqs:
+                return False
+            start = sent_seq + 1
+        return seqs[-1] - start + 1 != len(seqs)
+
+    def _take(self, room, now):
+        """Remove the room's buffer and return its frames as (event, data), one per run"""
+        buffer = self._buffers.pop(room)
+        self._due.pop(room, None)
+        self._sent_at[room] = now
+
+        frames = []
+        for run in _runs(sorted(buffer['events'])):
+            latest = {}  # coalescing key -> seq of the kept event
+            kept = {}
+            for seq in run:
+                event, data = buffer['events'][seq]
+                task_id = data.get('task_id')
+                key = (event, task_id) if event in COALESCED_EVENTS and task_id is not None else (event, seq)
+                previous = latest.get(key)
+                if previous is not None:
+                    self._stats['coalesced'] += 1
+                    if event == 'task_status_changed':
+                        data = dict(data, old_status=kept[previous][1].get('old_status'))
+                    del kept[previous]
+                latest[key] = seq
+                kept[seq] = (event, data)
+
+            events = [kept[seq] for seq in sorted(kept)]
+            if len(run) == 1:
+                frames.append(events[0])
+            else:
+                self._stats['batch_frames'] += 1
+                frames.append(('batch', {
+                    'project_id': events[-1][1].get('project_id'),
+                    'first_seq': run[0],
+                    'seq': run[-1],
+                    'events': [{'event': event, 'data': data} for event, data in events],
+                }))
+            self._sent_seq[room] = max(self._sent_seq.get(room, run[-1]), run[-1])
+        self._stats['frames_out'] += len(frames)
+        return frames
+
+    def _take_due(self, now, due_only):
+        frames = []
+        for room, due in list(self._due.items()):
+            if due_only and due > now:
+                continue
+            buffer = self._buffers[room]
+            if due_only and not buffer['held'] and self._has_gap(room, sorted(buffer['events'])):
+                # The missing seqs are most likely still on their way; wait one more window
+                buffer['held'] = True
+                self._due[room] = now + self.window
+                self._stats['held_back'] += 1
+                continue
+            frames.extend((room, frame) for frame in self._take(room, now))
+        return frames
+
+    def flush(self, due_only=False):
+        """Send the buffered frames (only those whose window ended with `due_only`)"""
+        with self._send_lock:
+            with self._lock:
+                frames = self._take_due(time.monotonic(), due_only)
+            for room, (event, data) in frames:
+                self.send(event, data, room)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='socket-outbox', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._due:
+                    self._due_changed.wait()
+                    continue
+                delay = min(self._due.values()) - time.monotonic()
+                if delay > 0:
+                    self._due_changed.wait(delay)
+                    continue
+            self.flush(due_only=True)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats, buffered_rooms=len(self._buffers))
+        stats['events_per_frame'] = stats['events_in'] / stats['frames_out'] if stats['frames_out'] else 0.0
+        return dict(stats, window=self.window, max_size=self.max_size)
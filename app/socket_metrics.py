@@ -0,0 +1,142 @@
+"""
+Socket room metrics and sampled structured logging.
+
+Server-side emits go through `broadcast`, which counts the room's local
+subscribers before sending, so fan-out per event (emits, recipients, max)
+is tracked without extra bookkeeping; per-room subscriber counts are read
+from the Socket.IO manager on demand. With a message queue, counts cover
+this process's sockets only. Sequenced project events pass through the
+coalescing `outbox` (socket_batch.py) first; its events in vs frames out
+are reported with the rest. Connection events are logged as one JSON
+object per line on the `app.socket_metrics` logger, sampled at
+SOCKET_LOG_SAMPLE_RATE; denials are always logged.
+"""
+
+import atexit
+import json
+import logging
+import random
+import threading
+from collections import defaultdict
+
+from . import message_queue
+from .extensions import socketio
+from .socket_batch import RoomOutbox
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = '/'
+
+
+class SocketMetrics:
+    """Thread-safe fan-out counters per event name"""
+
+    def __init__(self):
+        self.sample_rate = 0.1
+        self._lock = threading.Lock()
+        self._fanout = defaultdict(lambda: {'emits': 0, 'recipients': 0, 'max_fanout': 0})
+        self._events = defaultdict(int)
+
+    def record_emit(self, event, recipients):
+        with self._lock:
+            stats = self._fanout[event]
+            stats['emits'] += 1
+            stats['recipients'] += recipients
+            stats['max_fanout'] = max(stats['max_fanout'], recipients)
+
+    def count(self, name):
+        with self._lock:
+            self._events[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            fanout = {event: dict(stats) for event, stats in self._fanout.items()}
+            events = dict(self._events)
+        for stats in fanout.values():
+            stats['avg_fanout'] = stats['recipients'] / stats['emits']
+        return fanout, events
+
+
+metrics = SocketMetrics()
+
+
+def _rooms():
+    """room name -> local subscriber count, excluding each socket's own sid room"""
+    server = socketio.server
+    if server is None:
+        return {}
+    rooms = server.manager.rooms.get(NAMESPACE, {})
+    return {
+        room: len(participants)
+        for room, participants in list(rooms.items())
+        if room is not None and not (len(participants) == 1 and room in participants)
+    }
+
+
+def subscriber_count(room):
+    server = socketio.server
+    if server is None:
+        return 0
+    rooms = server.manager.rooms.get(NAMESPACE, {})
+    if room is None:
+        return len(rooms.get(None, ()))
+    return len(rooms.get(room, ()))
+
+
+def _send(event, data, room=None):
+    if message_queue.emitter is not None:
+        # Emit-only process (no sockets of its own): publish to the web processes
+        metrics.record_emit(event, 0)
+        message_queue.emitter.emit(event, data, namespace=NAMESPACE, room=room)
+        return
+    metrics.record_emit(event, subscriber_count(room))
+    socketio.emit(event, data, room=room)
+
+
+outbox = RoomOutbox(_send)
+
+
+def broadcast(event, data, room=None):
+    """socketio.emit that records the fan-out of the event; sequenced project events may be batched"""
+    if isinstance(data, dict) and 'seq' in data:
+        outbox.add(event, data, room)
+    else:
+        _send(event, data, room)
+
+
+_flush_registered = False
+
+
+def configure_socket_metrics(app):
+    global _flush_registered
+    metrics.sample_rate = app.config.get('SOCKET_LOG_SAMPLE_RATE', 0.1)
+    outbox.configure(app.config.get('SOCKET_BATCH_WINDOW', 0.05), app.config.get('SOCKET_BATCH_MAX_SIZE', 50))
+    if not _flush_registered:
+        # Buffered frames of short-lived processes (`flask jobs work --once`)
+        atexit.register(outbox.flush)
+        _flush_registered = True
+
+
+def log_event(name, level=logging.INFO, **fields):
+    """Count `name` and log it as JSON; INFO events are sampled"""
+    metrics.count(name)
+    if level <= logging.INFO and random.random() >= metrics.sample_rate:
+        return
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({'event': name, **fields}, ensure_ascii=False))
+
+
+def socket_metrics():
+    rooms = _rooms()
+    fanout, events = metrics.snapshot()
+    project_rooms = {room: count for room, count in rooms.items() if room.startswith('project_')}
+    manager = socketio.server.manager if socketio.server else None
+    return {
+        'message_queue': getattr(manager, 'name', None),
+        'connected': subscriber_count(None),
+        'user_rooms': sum(1 for room in rooms if room.startswith('user_')),
+        'project_rooms': dict(sorted(project_rooms.items(), key=lambda item: -item[1])),
+        'fanout': fanout,
+        'events': events,
+        'batching': outbox.metrics(),
+    }
@@ -1,133 +1,137 @@
+import logging
+import time
+from flask import current_app, session
 from flask_socketio import emit, join_room, leave_room, disconnect
 from flask_login import current_user
 from .extensions import socketio, db
-from .models import Project, ProjectMember
+from .models import Project
+from .membership import can_access_project, membership_version
+from .jobs import enqueue, job_handler
+from .events import record_event, events_since
+from .offload import run_db
+from .socket_metrics import broadcast, log_event
+
+# Handlers keep emits and room changes to themselves and run their database
+# work (including loading current_user) through run_db, off the event loop.
+# A socket only joins its user room at connect; pages join the project rooms
+# they show with `join_project`, and the socket's session caches the user
+# and each project's access decision.
+
+def _connect_user():
+    if not current_user.is_authenticated:
+        return None
+    return {'id': current_user.id, 'username': current_user.username}
 
 @socketio.on('connect')
 def on_connect():
-    if not current_user.is_authenticated:
+    user = run_db(_connect_user)
+    if user is None:
         disconnect()
         return False
     
-    print(f'User {current_user.username} connected')
-    
-    # Join user to their project rooms
-    if current_user.is_admin():
-        # Admin joins all active project rooms
-        projects = Project.query.filter_by(is_active=True).all()
-    else:
-        # Regular users join only their project rooms
-        project_ids = db.session.query(ProjectMember.project_id).filter(
-            ProjectMember.user_id == current_user.id
-        ).subquery()
-        projects = Project.query.filter(
-            Project.id.in_(project_ids),
-            Project.is_active == True
-        ).all()
-    
-    for project in projects:
-        join_room(f'project_{project.id}')
-        print(f'User {current_user.username} joined room project_{project.id}')
+    session['socket_user'] = user
+    session['project_access'] = {}
     
     # Join user's personal notification room
-    join_room(f'user_{current_user.id}')
+    join_room(f'user_{user["id"]}')
+    log_event('connect', user_id=user['id'])
     
     emit('connected', {'message': 'اتصال برقرار شد'})
 
 @socketio.on('disconnect')
 def on_disconnect():
-    if current_user.is_authenticated:
-        print(f'User {current_user.username} disconnected')
+    user = session.get('socket_user')
+    if user:
+        log_event('disconnect', user_id=user['id'])
+
+def _project_access(project_id):
+    """(allowed, project name) for the current user"""
+    project = db.session.get(Project, project_id)
+    if not project:
+        return False, None
+    
+    # Check if user has access to this project
+    return can_access_project(current_user, project), project.name
+
+def _cached_project_access(user, project_id):
+    """Access decision for the project, reused while the user's memberships are unchanged"""
+    version = membership_version(user['id'])
+    ttl = current_app.config.get('MEMBERSHIP_CACHE_TTL', 60)
+    cached = session['project_access'].get(project_id)
+    if cached and cached['version'] == version and time.monotonic() - cached['checked_at'] < ttl:
+        return cached['allowed'], cached['name']
+    
+    allowed, name = run_db(_project_access, project_id)
+    session['project_access'][project_id] = {
+        'version': version, 'checked_at': time.monotonic(), 'allowed': allowed, 'name': name
+    }
+    return allowed, name
 
 @socketio.on('join_project')
 def on_join_project(data):
-    if not current_user.is_authenticated:
-        return
-    
+    """Subscribe to a project room; the ack says whether the socket joined"""
+    user = session.get('socket_user')
     project_id = data.get('project_id')
-    if not project_id:
-        return
+    if not user or not isinstance(project_id, int):
+        return {'project_id': project_id, 'joined': False}
     
-    project = Project.query.get(project_id)
-    if not project:
-        return
-    
-    # Check if user has access to this project
-    if not current_user.is_admin() and not project.is_member(current_user):
-        return
+    allowed, project_name = _cached_project_access(user, project_id)
+    if not allowed:
+        log_event('join_denied', level=logging.WARNING, user_id=user['id'], project_id=project_id)
+        return {'project_id': project_id, 'joined': False}
     
     join_room(f'project_{project_id}')
-    emit('joined_project', {'project_id': project_id, 'project_name': project.name})
-    print(f'User {current_user.username} joined project room {project_id}')
+    emit('joined_project', {'project_id': project_id, 'project_name': project_name})
+    log_event('join_project', user_id=user['id'], project_id=project_id)
+    return {'project_id': project_id, 'joined': True}
 
 @socketio.on('leave_project')
 def on_leave_project(data):
-    if not current_user.is_authenticated:
-        return
-    
+    user = session.get('socket_user')
     project_id = data.get('project_id')
-    if not project_id:
+    if not user or not project_id:
         return
     
     leave_room(f'project_{project_id}')
     emit('left_project', {'project_id': project_id})
-    print(f'User {current_user.username} left project room {project_id}')
+    log_event('leave_project', user_id=user['id'], project_id=project_id)
 
-@socketio.on('task_status_update')
-def on_task_status_update(data):
-    """Handle real-time task status updates from drag & drop"""
-    if not current_user.is_authenticated:
-        return
-    
-    task_id = data.get('task_id')
-    new_status = data.get('new_status')
-    project_id = data.get('project_id')
-    
-    if not all([task_id, new_status, project_id]):
-        emit('error', {'message': 'داده‌های ناقص'})
-        return
-    
+def _update_task_status(task_id, new_status):
+    """Apply a drag & drop status change; returns the (event, data) to send back"""
     from .models import Task
-    from .utils import log_activity, create_notification
+    from .utils import log_activity, create_notifications
     from datetime import datetime
     
-    task = Task.query.get(task_id)
+    if not current_user.is_authenticated:
+        return None
+    
+    task = db.session.get(Task, task_id)
     if not task:
-        emit('error', {'message': 'کار یافت نشد'})
-        return
+        return 'error', {'message': 'کار یافت نشد'}
     
     # Check access
-    if not current_user.is_admin() and not task.project.is_member(current_user):
-        emit('error', {'message': 'دسترسی غیرمجاز'})
-        return
+    if not can_access_project(current_user, task.project_id):
+        return 'error', {'message': 'دسترسی غیرمجاز'}
     
     old_status = task.status
     task.status = new_status
     task.updated_at = datetime.utcnow()
     
-    db.session.commit()
-    
-    # Create notification for assignee
-    if task.assignee_id and task.assignee_id != current_user.id:
-        create_notification(
-            user_id=task.assignee_id,
-            notification_type='task_status_changed',
-            title='وضعیت کار تغییر کرد',
-            message=f'وضعیت کار "{task.title}" به "{task.get_status_display()}" تغییر کرد.',
-            payload={
-                'task_id': task.id,
-                'project_id': task.project_id,
-                'old_status': old_status,
-                'new_status': new_status
-            }
-        )
-        
-        # Emit notification to assignee
-        emit('new_notification', {
-            'title': 'وضعیت کار تغییر کرد',
-            'message': f'وضعیت کار "{task.title}" تغییر کرد',
-            'type': 'task_status_changed'
-        }, room=f'user_{task.assignee_id}')
+    # Notify the assignee (the new_notification event is sent after commit)
+    create_notifications(
+        [task.assignee_id],
+        notification_type='task_status_changed',
+        title='وضعیت کار تغییر کرد',
+        message=f'وضعیت کار "{task.title}" به "{task.get_status_display()}" تغییر کرد.',
+        payload={
+            'task_id': task.id,
+            'project_id': task.project_id,
+            'old_status': old_status,
+            'new_status': new_status
+        },
+        exclude=current_user.id,
+        coalesce_key=f'task:{task.id}'
+    )
     
     log_activity(
         actor_user_id=current_user.id,
@@ -138,37 +142,105 @@ def on_task_status_update(data):
     )
     
     # Broadcast to all project members
-    emit('task_status_changed', {
+    queue_project_event(task.project_id, 'task_status_changed', {
         'task_id': task.id,
         'old_status': old_status,
         'new_status': new_status,
         'title': task.title,
         'assignee': task.assignee.full_name if task.assignee else None,
         'updated_by': current_user.full_name
-    }, room=f'project_{project_id}')
+    })
+    
+    # Task change and its side-effect jobs commit together
+    db.session.commit()
     
-    emit('status_update_success', {
+    return 'status_update_success', {
         'task_id': task_id,
         'new_status': new_status,
         'message': 'وضعیت کار با موفقیت تغییر کرد'
-    })
+    }
+
+@socketio.on('task_status_update')
+def on_task_status_update(data):
+    """Handle real-time task status updates from drag & drop"""
+    task_id = data.get('task_id')
+    new_status = data.get('new_status')
+    project_id = data.get('project_id')
+    
+    if not all([task_id, new_status, project_id]):
+        emit('error', {'message': 'داده‌های ناقص'})
+        return
+    
+    reply = run_db(_update_task_status, task_id, new_status)
+    if reply is not None:
+        emit(*reply)
+
+def _resync(project_id, since_seq):
+    if not current_user.is_authenticated:
+        return None
+    
+    project = db.session.get(Project, project_id)
+    if not project or not can_access_project(current_user, project):
+        return {'error': 'دسترسی غیرمجاز'}
+    
+    # seq is read before the board, so the snapshot is at least as new as seq
+    seq, events = events_since(project_id, since_seq)
+    if events is not None:
+        return {'project_id': project_id, 'seq': seq, 'events': events}
+    
+    from .board import load_board, serialize_board
+    return {'project_id': project_id, 'seq': seq, 'snapshot': serialize_board(project, *load_board(project))}
+
+@socketio.on('resync')
+def on_resync(data):
+    """Replay the project events after `since_seq`, or send a board snapshot if they are gone"""
+    project_id = data.get('project_id')
+    since_seq = data.get('since_seq')
+    if not isinstance(project_id, int) or not isinstance(since_seq, int):
+        return {'error': 'داده‌های ناقص'}
+    
+    return run_db(_resync, project_id, since_seq)
 
 @socketio.on('ping')
 def on_ping():
     """Handle ping for connection testing"""
-    if current_user.is_authenticated:
+    if session.get('socket_user'):
         from datetime import datetime
         emit('pong', {'timestamp': str(datetime.utcnow())})
 
+# Socket fan-out from request handlers goes through the job queue
+@job_handler('socket.emit')
+def _emit_job(event, data, room=None):
+    broadcast(event, data, room=room)
+
+def queue_emit(event, data, room=None):
+    """Emit `event` to `room` from a job worker once the current transaction commits"""
+    return enqueue('socket.emit', {'event': event, 'data': data, 'room': room})
+
+def queue_project_event(project_id, event, data):
+    """queue_emit to the project room, with the next seq of the project's event log"""
+    return queue_emit(event, record_event(project_id, event, data), room=f'project_{project_id}')
+
+@job_handler('socket.emit_batch')
+def _emit_batch_job(events):
+    for event, data, room in events:
+        broadcast(event, data, room=room)
+
+def queue_emits(events):
+    """Like queue_emit for many (event, data, room) tuples, sent by a single job"""
+    events = [list(item) for item in events]
+    if events:
+        return enqueue('socket.emit_batch', {'events': events})
+
 # Helper functions that work regardless of socketio availability
 def emit_notification_to_user(user_id, notification_data):
     """Emit notification to a specific user"""
-    socketio.emit('new_notification', notification_data, room=f'user_{user_id}')
+    broadcast('new_notification', notification_data, room=f'user_{user_id}')
 
 def emit_task_update_to_project(project_id, update_data):
     """Emit task update to all project members"""
-    socketio.emit('task_updated', update_data, room=f'project_{project_id}')
+    broadcast('task_updated', update_data, room=f'project_{project_id}')
 
 def emit_comment_to_project(project_id, comment_data):
     """Emit new comment to all project members"""
-    socketio.emit('comment_added', comment_data, room=f'project_{project_id}')
\ No newline at end of file
+    broadcast('comment_added', comment_data, room=f'project_{project_id}')
\ No newline at end of file
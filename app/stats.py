@@ -0,0 +1,186 @@
+"""
+Aggregate statistics for the dashboard and the admin system stats page.
+
+Every scope is answered by a single conditional-aggregation query
+(SUM(CASE ...) per counter) instead of one COUNT per number, and results are
+kept in a short-TTL cache keyed by scope. The cache is cleared whenever a
+transaction that wrote tasks (or users/projects/tags for the system stats)
+commits.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, event, func, select
+from sqlalchemy.orm import Session
+
+from .extensions import db
+from .membership import get_member_project_ids
+
+
+class StatsCache:
+    """Thread-safe scope key -> value cache with a TTL"""
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        if not self.ttl:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = StatsCache()
+
+
+def configure_stats_cache(app):
+    _cache.ttl = app.config.get('STATS_CACHE_TTL', 30)
+
+
+def _cached(key, compute):
+    value = _cache.get(key)
+    if value is None:
+        value = compute()
+        _cache.set(key, value)
+    return value
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _compute_task_stats(project_id, project_ids):
+    from .models import Task
+
+    now = datetime.utcnow()
+    week_ago = now - timedelta(days=7)
+    month_ago = now - timedelta(days=30)
+    done = Task.status == 'Done'
+
+    # One row per status; the other counters are summed across rows
+    query = db.session.query(
+        Task.status,
+        func.count(Task.id),
+        _count_if(and_(done, Task.updated_at >= week_ago)),
+        _count_if(and_(done, Task.updated_at >= month_ago)),
+        _count_if(and_(Task.due_date < now, Task.status != 'Done')),
+    )
+    if project_id is not None:
+        query = query.filter(Task.project_id == project_id)
+    if project_ids is not None:
+        query = query.filter(Task.project_id.in_(sorted(project_ids)))
+
+    stats = {
+        'total_tasks': 0,
+        'status_counts': {},
+        'completed_last_week': 0,
+        'completed_last_month': 0,
+        'overdue_tasks': 0,
+    }
+    for status, count, last_week, last_month, overdue in query.group_by(Task.status):
+        stats['status_counts'][status] = count
+        stats['total_tasks'] += count
+        stats['completed_last_week'] += last_week
+        stats['completed_last_month'] += last_month
+        stats['overdue_tasks'] += overdue
+    return stats
+
+
+def task_stats(project=None, user=None):
+    """Task counters for a project and/or the projects visible to `user`"""
+    project_id = project.id if project is not None else None
+
+    # Employees are scoped by their project set, so users sharing the same
+    # memberships share a cache entry
+    project_ids = None
+    if user is not None and not user.is_admin():
+        project_ids = get_member_project_ids(user)
+
+    key = ('tasks', project_id, project_ids)
+    return _cached(key, lambda: _compute_task_stats(project_id, project_ids))
+
+
+def _compute_system_stats():
+    from .models import User, Project, Task, Tag
+
+    def count(model, *criteria):
+        return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+    totals = db.session.execute(select(
+        count(User).label('total_users'),
+        count(User, User.is_active.is_(True)).label('active_users'),
+        count(Project).label('total_projects'),
+        count(Project, Project.is_active.is_(True)).label('active_projects'),
+        count(Tag).label('total_tags'),
+    )).mappings().one()
+
+    status_counts = {}
+    priority_counts = {}
+    rows = db.session.query(Task.status, Task.priority, func.count(Task.id)).group_by(Task.status, Task.priority)
+    for status, priority, task_count in rows:
+        status_counts[status] = status_counts.get(status, 0) + task_count
+        priority_counts[priority] = priority_counts.get(priority, 0) + task_count
+
+    stats = dict(totals)
+    stats['total_tasks'] = sum(status_counts.values())
+    stats['completed_tasks'] = status_counts.get('Done', 0)
+    return {
+        'stats': stats,
+        'status_counts': status_counts,
+        'priority_counts': priority_counts,
+    }
+
+
+def system_stats():
+    """System-wide counters and task distributions by status and priority"""
+    return _cached(('system',), _compute_system_stats)
+
+
+def invalidate_stats():
+    _cache.clear()
+
+
+def _writes_stats_models(session):
+    from .models import User, Project, Task, Tag
+
+    models = (User, Project, Task, Tag)
+    return any(
+        isinstance(obj, models)
+        for obj in (*session.new, *session.dirty, *session.deleted)
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_stats_dirty(session, flush_context):
+    if _writes_stats_models(session):
+        session.info['stats_dirty'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_stats_after_commit(session):
+    if session.info.pop('stats_dirty', False):
+        invalidate_stats()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_stats_dirty(session):
+    session.info.pop('stats_dirty', None)
@@ -3,8 +3,14 @@ from flask_login import login_required, current_user
 from . import bp
 from ..models import Task, Project, User, Tag, TaskComment, TaskAttachment, ProjectMember
 from ..forms import TaskForm, TaskCommentForm, TaskAttachmentForm, TaskFilterForm
-from ..utils import project_member_required, is_ajax_request, ajax_response, log_activity, create_notification, save_uploaded_file, process_mentions
-from ..extensions import db, socketio
+from ..utils import project_member_required, is_ajax_request, ajax_response, log_activity, create_notifications, save_uploaded_file, process_mentions
+from ..pagination import keyset_paginate
+from ..search import filter_tasks
+from ..membership import can_access_project, scope_to_member_projects
+from ..http_cache import conditional, task_card_state, task_detail_state
+from ..board import render_card
+from ..extensions import db
+from ..sockets import queue_project_event
 from sqlalchemy import desc, and_, or_
 from datetime import datetime
 import os
@@ -12,7 +18,7 @@ import os
 @bp.route('/')
 @login_required
 def index():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     project_id = request.args.get('project_id', type=int)
     
     # Get filter form
@@ -20,21 +26,18 @@ def index():
     if project_id:
         project = Project.query.get_or_404(project_id)
         # Check access
-        if not current_user.is_admin() and not project.is_member(current_user):
+        if not can_access_project(current_user, project):
             flash('شما عضو این پروژه نیستید.', 'error')
             return redirect(url_for('tasks.index'))
     
-    form = TaskFilterForm(project=project)
+    # Filters come from the query string so they survive cursor links
+    form = TaskFilterForm(project=project, formdata=request.args, meta={'csrf': False})
     
     # Build query
     query = Task.query.join(Project)
     
     # For employees, only show tasks from projects they're members of
-    if not current_user.is_admin():
-        project_ids = db.session.query(ProjectMember.project_id).filter(
-            ProjectMember.user_id == current_user.id
-        ).subquery()
-        query = query.filter(Task.project_id.in_(project_ids))
+    query = scope_to_member_projects(query, Task.project_id, current_user)
     
     # Apply filters
     if project_id:
@@ -42,13 +45,7 @@ def index():
     
     if form.validate():
         if form.search.data:
-            search_term = form.search.data
-            query = query.filter(
-                or_(
-                    Task.title.contains(search_term),
-                    Task.description.contains(search_term)
-                )
-            )
+            query = filter_tasks(query, form.search.data)
         
         if form.status.data:
             query = query.filter(Task.status == form.status.data)
@@ -70,17 +67,11 @@ def index():
                 )
             )
     
-    tasks = query.order_by(desc(Task.updated_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    tasks = keyset_paginate(query, [Task.updated_at, Task.id], cursor=cursor, per_page=20)
     
     # Get available projects for filter
     projects_query = Project.query.filter_by(is_active=True)
-    if not current_user.is_admin():
-        project_ids = db.session.query(ProjectMember.project_id).filter(
-            ProjectMember.user_id == current_user.id
-        ).subquery()
-        projects_query = projects_query.filter(Project.id.in_(project_ids))
+    projects_query = scope_to_member_projects(projects_query, Project.id, current_user)
     
     projects = projects_query.all()
     
@@ -101,7 +92,7 @@ def create():
     project = Project.query.get_or_404(project_id)
     
     # Check access
-    if not current_user.is_admin() and not project.is_member(current_user):
+    if not can_access_project(current_user, project):
         flash('شما عضو این پروژه نیستید.', 'error')
         return redirect(url_for('projects.index'))
     
@@ -133,20 +124,18 @@ def create():
                     db.session.add(tag)
                 task.tags.append(tag)
         
-        db.session.commit()
-        
         # Create notification for assignee
-        if task.assignee_id and task.assignee_id != current_user.id:
-            create_notification(
-                user_id=task.assignee_id,
-                notification_type='task_assigned',
-                title='کار جدیدی به شما اختصاص یافت',
-                message=f'کار "{task.title}" در پروژه "{project.name}" به شما اختصاص یافت.',
-                payload={
-                    'task_id': task.id,
-                    'project_id': project.id
-                }
-            )
+        create_notifications(
+            [task.assignee_id],
+            notification_type='task_assigned',
+            title='کار جدیدی به شما اختصاص یافت',
+            message=f'کار "{task.title}" در پروژه "{project.name}" به شما اختصاص یافت.',
+            payload={
+                'task_id': task.id,
+                'project_id': project.id
+            },
+            exclude=current_user.id
+        )
         
         log_activity(
             actor_user_id=current_user.id,
@@ -157,13 +146,16 @@ def create():
         )
         
         # Emit socket event for real-time updates
-        socketio.emit('task_created', {
+        queue_project_event(project.id, 'task_created', {
             'task_id': task.id,
-            'project_id': project.id,
             'title': task.title,
             'status': task.status,
-            'assignee': task.assignee.full_name if task.assignee else None
-        }, room=f'project_{project.id}')
+            'assignee': task.assignee.full_name if task.assignee else None,
+            'card_url': url_for('tasks.card', task_id=task.id)
+        })
+        
+        # Task, notification, activity log and socket event commit together
+        db.session.commit()
         
         flash(f'کار "{task.title}" با موفقیت ایجاد شد.', 'success')
         
@@ -176,11 +168,12 @@ def create():
 
 @bp.route('/<int:task_id>')
 @login_required
+@conditional(task_detail_state)
 def detail(task_id):
     task = Task.query.get_or_404(task_id)
     
     # Check access
-    if not current_user.is_admin() and not task.project.is_member(current_user):
+    if not can_access_project(current_user, task.project_id):
         flash('شما عضو این پروژه نیستید.', 'error')
         return redirect(url_for('tasks.index'))
     
@@ -201,13 +194,25 @@ def detail(task_id):
                          comment_form=comment_form,
                          attachment_form=attachment_form)
 
+@bp.route('/<int:task_id>/card')
+@login_required
+@conditional(task_card_state)
+def card(task_id):
+    """Board card fragment, fetched by boards to patch a single card"""
+    task = Task.query.get_or_404(task_id)
+    
+    if not can_access_project(current_user, task.project_id):
+        return ajax_response(status='error', message='دسترسی غیرمجاز'), 403
+    
+    return render_card(task)
+
 @bp.route('/<int:task_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit(task_id):
     task = Task.query.get_or_404(task_id)
     
     # Check access
-    if not current_user.is_admin() and not task.project.is_member(current_user):
+    if not can_access_project(current_user, task.project_id):
         flash('شما عضو این پروژه نیستید.', 'error')
         return redirect(url_for('tasks.index'))
     
@@ -241,51 +246,50 @@ def edit(task_id):
                     db.session.add(tag)
                 task.tags.append(tag)
         
-        db.session.commit()
-        
         # Create notifications for status or assignee changes
         if old_status != task.status:
             # Notify assignee about status change
-            if task.assignee_id and task.assignee_id != current_user.id:
-                create_notification(
-                    user_id=task.assignee_id,
-                    notification_type='task_status_changed',
-                    title='وضعیت کار تغییر کرد',
-                    message=f'وضعیت کار "{task.title}" به "{task.get_status_display()}" تغییر کرد.',
-                    payload={
-                        'task_id': task.id,
-                        'project_id': task.project_id,
-                        'old_status': old_status,
-                        'new_status': task.status
-                    }
-                )
+            create_notifications(
+                [task.assignee_id],
+                notification_type='task_status_changed',
+                title='وضعیت کار تغییر کرد',
+                message=f'وضعیت کار "{task.title}" به "{task.get_status_display()}" تغییر کرد.',
+                payload={
+                    'task_id': task.id,
+                    'project_id': task.project_id,
+                    'old_status': old_status,
+                    'new_status': task.status
+                },
+                exclude=current_user.id,
+                coalesce_key=f'task:{task.id}'
+            )
         
         if old_assignee_id != task.assignee_id:
             # Notify new assignee
-            if task.assignee_id and task.assignee_id != current_user.id:
-                create_notification(
-                    user_id=task.assignee_id,
-                    notification_type='task_assigned',
-                    title='کاری به شما اختصاص یافت',
-                    message=f'کار "{task.title}" به شما اختصاص یافت.',
-                    payload={
-                        'task_id': task.id,
-                        'project_id': task.project_id
-                    }
-                )
+            create_notifications(
+                [task.assignee_id],
+                notification_type='task_assigned',
+                title='کاری به شما اختصاص یافت',
+                message=f'کار "{task.title}" به شما اختصاص یافت.',
+                payload={
+                    'task_id': task.id,
+                    'project_id': task.project_id
+                },
+                exclude=current_user.id
+            )
             
             # Notify old assignee
-            if old_assignee_id and old_assignee_id != current_user.id:
-                create_notification(
-                    user_id=old_assignee_id,
-                    notification_type='task_unassigned',
-                    title='کاری از شما گرفته شد',
-                    message=f'کار "{task.title}" دیگر به شما اختصاص ندارد.',
-                    payload={
-                        'task_id': task.id,
-                        'project_id': task.project_id
-                    }
-                )
+            create_notifications(
+                [old_assignee_id],
+                notification_type='task_unassigned',
+                title='کاری از شما گرفته شد',
+                message=f'کار "{task.title}" دیگر به شما اختصاص ندارد.',
+                payload={
+                    'task_id': task.id,
+                    'project_id': task.project_id
+                },
+                exclude=current_user.id
+            )
         
         log_activity(
             actor_user_id=current_user.id,
@@ -296,13 +300,15 @@ def edit(task_id):
         )
         
         # Emit socket event for real-time updates
-        socketio.emit('task_updated', {
+        queue_project_event(task.project_id, 'task_updated', {
             'task_id': task.id,
-            'project_id': task.project_id,
             'title': task.title,
             'status': task.status,
-            'assignee': task.assignee.full_name if task.assignee else None
-        }, room=f'project_{task.project_id}')
+            'assignee': task.assignee.full_name if task.assignee else None,
+            'card_url': url_for('tasks.card', task_id=task.id)
+        })
+        
+        db.session.commit()
         
         flash(f'کار "{task.title}" با موفقیت ویرایش شد.', 'success')
         
@@ -319,7 +325,7 @@ def update_status(task_id):
     task = Task.query.get_or_404(task_id)
     
     # Check access
-    if not current_user.is_admin() and not task.project.is_member(current_user):
+    if not can_access_project(current_user, task.project_id):
         return ajax_response(status='error', message='دسترسی غیرمجاز')
     
     new_status = request.json.get('status')
@@ -330,22 +336,21 @@ def update_status(task_id):
     task.status = new_status
     task.updated_at = datetime.utcnow()
     
-    db.session.commit()
-    
     # Create notification for assignee
-    if task.assignee_id and task.assignee_id != current_user.id:
-        create_notification(
-            user_id=task.assignee_id,
-            notification_type='task_status_changed',
-            title='وضعیت کار تغییر کرد',
-            message=f'وضعیت کار "{task.title}" به "{task.get_status_display()}" تغییر کرد.',
-            payload={
-                'task_id': task.id,
-                'project_id': task.project_id,
-                'old_status': old_status,
-                'new_status': new_status
-            }
-        )
+    create_notifications(
+        [task.assignee_id],
+        notification_type='task_status_changed',
+        title='وضعیت کار تغییر کرد',
+        message=f'وضعیت کار "{task.title}" به "{task.get_status_display()}" تغییر کرد.',
+        payload={
+            'task_id': task.id,
+            'project_id': task.project_id,
+            'old_status': old_status,
+            'new_status': new_status
+        },
+        exclude=current_user.id,
+        coalesce_key=f'task:{task.id}'
+    )
     
     log_activity(
         actor_user_id=current_user.id,
@@ -356,13 +361,14 @@ def update_status(task_id):
     )
     
     # Emit socket event for real-time updates
-    socketio.emit('task_status_changed', {
+    queue_project_event(task.project_id, 'task_status_changed', {
         'task_id': task.id,
-        'project_id': task.project_id,
         'old_status': old_status,
         'new_status': new_status,
         'title': task.title
-    }, room=f'project_{task.project_id}')
+    })
+    
+    db.session.commit()
     
     return ajax_response(message='وضعیت کار با موفقیت تغییر کرد')
 
@@ -372,7 +378,7 @@ def add_comment(task_id):
     task = Task.query.get_or_404(task_id)
     
     # Check access
-    if not current_user.is_admin() and not task.project.is_member(current_user):
+    if not can_access_project(current_user, task.project_id):
         return ajax_response(status='error', message='دسترسی غیرمجاز')
     
     form = TaskCommentForm()
@@ -385,7 +391,7 @@ def add_comment(task_id):
         )
         
         db.session.add(comment)
-        db.session.commit()
+        db.session.flush()  # To get the comment ID
         
         # Process mentions
         process_mentions(comment.body, task)
@@ -399,14 +405,16 @@ def add_comment(task_id):
         )
         
         # Emit socket event for real-time updates
-        socketio.emit('comment_added', {
+        queue_project_event(task.project_id, 'comment_added', {
             'task_id': task.id,
-            'project_id': task.project_id,
             'comment_id': comment.id,
             'author': current_user.full_name,
             'body': comment.body,
-            'created_at': comment.created_at.isoformat()
-        }, room=f'project_{task.project_id}')
+            'created_at': comment.created_at.isoformat(),
+            'card_url': url_for('tasks.card', task_id=task.id)
+        })
+        
+        db.session.commit()
         
         if is_ajax_request():
             return ajax_response(message='نظر با موفقیت اضافه شد')
@@ -421,7 +429,7 @@ def add_attachment(task_id):
     task = Task.query.get_or_404(task_id)
     
     # Check access
-    if not current_user.is_admin() and not task.project.is_member(current_user):
+    if not can_access_project(current_user, task.project_id):
         return ajax_response(status='error', message='دسترسی غیرمجاز')
     
     form = TaskAttachmentForm()
@@ -441,7 +449,7 @@ def add_attachment(task_id):
             )
             
             db.session.add(attachment)
-            db.session.commit()
+            db.session.flush()  # To get the attachment ID
             
             log_activity(
                 actor_user_id=current_user.id,
@@ -451,6 +459,8 @@ def add_attachment(task_id):
                 description=f'فایل "{attachment.original_filename}" به کار "{task.title}" اضافه شد'
             )
             
+            db.session.commit()
+            
             if is_ajax_request():
                 return ajax_response(message='فایل با موفقیت آپلود شد')
             
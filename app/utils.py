@@ -1,15 +1,20 @@
 import os
 import uuid
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
 from functools import wraps
 from flask import current_app, flash, redirect, url_for, request, jsonify
 from flask_login import current_user
 from werkzeug.utils import secure_filename
-from .models import User, Notification, ActivityLog
+from sqlalchemy import insert, update
+from .models import User, Notification
 from .extensions import db
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from .membership import can_access_project
+from .activity import log_activity
+from .mail import send_email, send_emails
+from .mentions import resolve_mentions
+from .sockets import queue_emits
+from .counters import adjust_unread_counts
 
 def admin_required(f):
     """Decorator to require admin role"""
@@ -29,7 +34,7 @@ def project_member_required(project):
             if not current_user.is_authenticated:
                 return redirect(url_for('auth.login'))
             
-            if current_user.is_admin() or project.is_member(current_user):
+            if can_access_project(current_user, project):
                 return f(*args, **kwargs)
             
             flash('شما عضو این پروژه نیستید.', 'error')
@@ -70,98 +75,142 @@ def save_uploaded_file(file, subfolder=''):
         }
     return None
 
-def create_notification(user_id, notification_type, title, message, payload=None):
-    """Create a new notification for a user"""
-    notification = Notification(
-        user_id=user_id,
-        type=notification_type,
-        title=title,
-        message=message
-    )
-    if payload:
-        notification.set_payload(payload)
+# Rows per multi-row INSERT, well below SQLite's bound-parameter limit
+NOTIFICATION_INSERT_CHUNK = 500
+
+def _coalesce_notifications(user_ids, notification_type, coalesce_key, title, message, payload, now):
+    """Fold the notification into recent unread ones with the same key.
     
-    db.session.add(notification)
-    db.session.commit()
-    return notification
+    Matching rows get the new title/message/payload (keeping the first
+    notification's `old_*` payload values, e.g. the original old_status) and
+    move to the top of the inbox. Returns {user_id: notification_id}.
+    """
+    window = current_app.config.get('NOTIFICATION_COALESCE_WINDOW', 0)
+    if not window:
+        return {}
+    
+    existing = db.session.query(Notification.id, Notification.user_id, Notification.payload_json).filter(
+        Notification.user_id.in_(user_ids),
+        Notification.type == notification_type,
+        Notification.coalesce_key == coalesce_key,
+        Notification.is_read == False,
+        Notification.created_at >= now - timedelta(seconds=window)
+    ).order_by(Notification.created_at.desc()).all()
+    
+    updates = {}
+    for notification_id, user_id, payload_json in existing:
+        if user_id in updates:
+            continue
+        merged = dict(payload or {})
+        if payload_json:
+            previous = json.loads(payload_json)
+            merged.update({key: value for key, value in previous.items() if key.startswith('old_')})
+        updates[user_id] = {
+            'id': notification_id,
+            'title': title,
+            'message': message,
+            'payload_json': json.dumps(merged) if merged else None,
+            'created_at': now,
+        }
+    
+    if updates:
+        db.session.execute(update(Notification), list(updates.values()))
+    return {user_id: row['id'] for user_id, row in updates.items()}
 
-def log_activity(actor_user_id, entity_type, entity_id, action, description, meta=None):
-    """Log user activity"""
-    activity = ActivityLog(
-        actor_user_id=actor_user_id,
-        entity_type=entity_type,
-        entity_id=entity_id,
-        action=action,
-        description=description
-    )
-    if meta:
-        activity.set_meta(meta)
+def create_notifications(recipients, notification_type, title, message, payload=None, exclude=None, coalesce_key=None):
+    """Create the same notification for several users (ids or User objects).
+    
+    All rows are inserted in the caller's transaction with one multi-row
+    INSERT, and the `new_notification` socket events are sent as one batch
+    after commit. None, duplicates and `exclude` are skipped; returns the
+    ids that were notified.
+    
+    With a `coalesce_key` (e.g. 'task:12'), a recipient's unread notification
+    of the same type and key from the last NOTIFICATION_COALESCE_WINDOW
+    seconds is updated in place instead, and `notification_updated` is sent.
+    """
+    user_ids = []
+    seen = {None, exclude}
+    for recipient in recipients:
+        user_id = recipient.id if isinstance(recipient, User) else recipient
+        if user_id not in seen:
+            seen.add(user_id)
+            user_ids.append(user_id)
+    
+    if not user_ids:
+        return []
     
-    db.session.add(activity)
-    db.session.commit()
-    return activity
+    created_at = datetime.utcnow()
+    event_data = {'title': title, 'message': message, 'type': notification_type, 'payload': payload}
+    events = []
+    
+    coalesced = {}
+    if coalesce_key is not None:
+        coalesced = _coalesce_notifications(
+            user_ids, notification_type, coalesce_key, title, message, payload, created_at
+        )
+        events.extend(
+            ('notification_updated', dict(event_data, id=notification_id), f'user_{user_id}')
+            for user_id, notification_id in coalesced.items()
+        )
+    
+    new_ids = [user_id for user_id in user_ids if user_id not in coalesced]
+    payload_json = json.dumps(payload) if payload else None
+    rows = [{
+        'user_id': user_id,
+        'type': notification_type,
+        'title': title,
+        'message': message,
+        'payload_json': payload_json,
+        'coalesce_key': coalesce_key,
+        'is_read': False,
+        'created_at': created_at,
+    } for user_id in new_ids]
+    
+    for start in range(0, len(rows), NOTIFICATION_INSERT_CHUNK):
+        db.session.execute(insert(Notification).values(rows[start:start + NOTIFICATION_INSERT_CHUNK]))
+    adjust_unread_counts({user_id: 1 for user_id in new_ids})
+    
+    events.extend(('new_notification', event_data, f'user_{user_id}') for user_id in new_ids)
+    queue_emits(events)
+    
+    return user_ids
 
-def send_email(to_email, subject, body, html_body=None):
-    """Send email notification (if SMTP is configured)"""
-    try:
-        smtp_server = os.environ.get('SMTP_SERVER')
-        smtp_port = int(os.environ.get('SMTP_PORT', 587))
-        smtp_username = os.environ.get('SMTP_USERNAME')
-        smtp_password = os.environ.get('SMTP_PASSWORD')
-        smtp_use_tls = os.environ.get('SMTP_USE_TLS', 'True').lower() == 'true'
-        
-        if not all([smtp_server, smtp_username, smtp_password]):
-            # SMTP not configured, skip silently
-            return False
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = smtp_username
-        msg['To'] = to_email
-        
-        # Add text part
-        text_part = MIMEText(body, 'plain', 'utf-8')
-        msg.attach(text_part)
-        
-        # Add HTML part if provided
-        if html_body:
-            html_part = MIMEText(html_body, 'html', 'utf-8')
-            msg.attach(html_part)
-        
-        # Send email
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        if smtp_use_tls:
-            server.starttls()
-        server.login(smtp_username, smtp_password)
-        server.send_message(msg)
-        server.quit()
-        
-        return True
-    except Exception as e:
-        current_app.logger.error(f'Failed to send email: {str(e)}')
-        return False
+def mark_notifications_read(user_id):
+    """Mark all unread notifications of a user as read with one UPDATE"""
+    updated = Notification.query.filter_by(user_id=user_id, is_read=False).update({Notification.is_read: True}, synchronize_session='fetch')
+    adjust_unread_counts({user_id: -updated})
+    return updated
+
+def delete_notifications(user_id):
+    """Delete all notifications of a user; returns the number of rows removed"""
+    query = Notification.query.filter_by(user_id=user_id)
+    unread = query.filter_by(is_read=False).delete(synchronize_session=False)
+    deleted = query.delete(synchronize_session=False)
+    adjust_unread_counts({user_id: -unread})
+    return unread + deleted
+
+def create_notification(user_id, notification_type, title, message, payload=None):
+    """Create a notification for a single user"""
+    return create_notifications([user_id], notification_type, title, message, payload)
 
 def process_mentions(comment_body, task):
     """Process @mentions in comments and create notifications"""
-    import re
-    mentions = re.findall(r'@(\w+)', comment_body)
+    # One lookup for all usernames and one membership query for the project
+    recipients = resolve_mentions(comment_body, task.project_id)
     
-    for username in mentions:
-        user = User.query.filter_by(username=username).first()
-        if user and user.id != current_user.id:
-            # Check if user is a member of the task's project
-            if task.project.is_member(user) or user.is_admin():
-                create_notification(
-                    user_id=user.id,
-                    notification_type='comment_mention',
-                    title='شما در نظری ذکر شدید',
-                    message=f'{current_user.full_name} شما را در نظری برای کار "{task.title}" ذکر کرد.',
-                    payload={
-                        'task_id': task.id,
-                        'project_id': task.project_id,
-                        'comment_author': current_user.full_name
-                    }
-                )
+    create_notifications(
+        recipients,
+        notification_type='comment_mention',
+        title='شما در نظری ذکر شدید',
+        message=f'{current_user.full_name} شما را در نظری برای کار "{task.title}" ذکر کرد.',
+        payload={
+            'task_id': task.id,
+            'project_id': task.project_id,
+            'comment_author': current_user.full_name
+        },
+        exclude=current_user.id
+    )
 
 def get_persian_date(date_obj):
     """Convert datetime to Persian date string"""
@@ -179,63 +228,6 @@ def get_persian_date(date_obj):
     month_name = persian_months[date_obj.month - 1] if date_obj.month <= 12 else str(date_obj.month)
     return f'{date_obj.day} {month_name} {date_obj.year}'
 
-def get_task_stats(project=None, user=None):
-    """Get task statistics for dashboard"""
-    from app.models import Task
-    from sqlalchemy import and_, func
-    from datetime import datetime, timedelta
-    
-    query = Task.query
-    
-    if project:
-        query = query.filter(Task.project_id == project.id)
-    
-    if user and not user.is_admin():
-        # For employees, only show tasks from projects they're members of
-        from app.models import ProjectMember
-        project_ids = db.session.query(ProjectMember.project_id).filter(
-            ProjectMember.user_id == user.id
-        ).subquery()
-        query = query.filter(Task.project_id.in_(project_ids))
-    
-    total_tasks = query.count()
-    
-    # Tasks by status
-    status_counts = db.session.query(
-        Task.status, func.count(Task.id)
-    ).filter(
-        query.whereclause if query.whereclause is not None else True
-    ).group_by(Task.status).all()
-    
-    # Recent completed tasks (last 7 and 30 days)
-    now = datetime.utcnow()
-    week_ago = now - timedelta(days=7)
-    month_ago = now - timedelta(days=30)
-    
-    completed_last_week = query.filter(
-        and_(Task.status == 'Done', Task.updated_at >= week_ago)
-    ).count()
-    
-    completed_last_month = query.filter(
-        and_(Task.status == 'Done', Task.updated_at >= month_ago)
-    ).count()
-    
-    # Overdue tasks
-    overdue_tasks = query.filter(
-        and_(
-            Task.due_date < now,
-            Task.status != 'Done'
-        )
-    ).count()
-    
-    return {
-        'total_tasks': total_tasks,
-        'status_counts': dict(status_counts),
-        'completed_last_week': completed_last_week,
-        'completed_last_month': completed_last_month,
-        'overdue_tasks': overdue_tasks
-    }
-
 def format_file_size(size_bytes):
     """Format file size in human readable format"""
     if size_bytes == 0:
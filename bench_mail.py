@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mail throughput benchmark against the bundled debugging SMTP sink.
+
+Sends the same messages twice through a local sink that simulates the
+handshake cost of a real server: once opening a connection (EHLO + login)
+per message, as `deliver_email` used to, and once through the pooled,
+batched sender in app.mail. Runs fully offline.
+
+    python bench_mail.py --messages 500 --workers 2 --connect-delay 0.05
+"""
+
+import argparse
+import os
+import smtplib
+import sys
+import threading
+import time
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.mail import build_message, configure_mail, pool, send_messages
+from app.mail_sink import DebugSMTPServer
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def make_messages(count):
+    return [
+        {'to_email': f'user{i}@example.com', 'subject': f'Message {i}', 'body': 'x' * 500, 'html_body': None}
+        for i in range(count)
+    ]
+
+
+def run_parallel(work, chunks):
+    threads = [threading.Thread(target=work, args=(chunk,)) for chunk in chunks]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started
+
+
+def bench_per_message(port, messages, workers):
+    latencies = []
+    lock = threading.Lock()
+
+    def work(chunk):
+        for message in chunk:
+            started = time.perf_counter()
+            server = smtplib.SMTP('127.0.0.1', port, timeout=30)
+            try:
+                server.login('bench', 'bench')
+                server.send_message(build_message(sender='bench@example.com', **message))
+            finally:
+                server.quit()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    elapsed = run_parallel(work, [messages[i::workers] for i in range(workers)])
+    return elapsed, latencies
+
+
+def bench_pooled(app, messages, workers, batch_size):
+    latencies = []
+    lock = threading.Lock()
+
+    def work(chunk):
+        with app.app_context():
+            for start in range(0, len(chunk), batch_size):
+                batch = chunk[start:start + batch_size]
+                started = time.perf_counter()
+                send_messages(batch)
+                with lock:
+                    latencies.extend([(time.perf_counter() - started) / len(batch)] * len(batch))
+
+    elapsed = run_parallel(work, [messages[i::workers] for i in range(workers)])
+    return elapsed, latencies
+
+
+def report(label, count, elapsed, latencies, connections):
+    print(f'\n== {label}')
+    print(f'   {count / elapsed:9.1f} msg/s   p50={percentile(latencies, 50) * 1000:7.2f}ms  '
+          f'p99={percentile(latencies, 99) * 1000:7.2f}ms   connections={connections}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=2, help='concurrent senders (job workers)')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--connect-delay', type=float, default=0.05, help='simulated handshake seconds')
+    parser.add_argument('--message-delay', type=float, default=0.001, help='simulated seconds per message')
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+
+    with DebugSMTPServer(connect_delay=args.connect_delay, message_delay=args.message_delay, keep=10) as sink:
+        # Before: a new connection, login and QUIT per message
+        elapsed, latencies = bench_per_message(sink.port, messages, args.workers)
+        report('before (connection per message)', len(messages), elapsed, latencies, sink.connections)
+
+        # After: pooled connections, batches, no rate cap
+        app = Flask(__name__)
+        app.config.update(
+            SMTP_SERVER='127.0.0.1', SMTP_PORT=sink.port, SMTP_USERNAME='bench', SMTP_PASSWORD='bench',
+            SMTP_USE_TLS=False, MAIL_SENDER='bench@example.com', MAIL_POOL_SIZE=args.workers,
+            MAIL_BATCH_SIZE=args.batch_size, MAIL_RATE_LIMIT=0,
+        )
+        configure_mail(app)
+        connections_before = sink.connections
+        elapsed, latencies = bench_pooled(app, messages, args.workers, args.batch_size)
+        report('after (pooled, batched)', len(messages), elapsed, latencies, sink.connections - connections_before)
+        pool.close()
+        print(f'\n   sink received {sink.received} messages; pool: {pool.metrics()}')
+
+
+if __name__ == '__main__':
+    main()
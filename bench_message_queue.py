@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-process Socket.IO check over SOCKETIO_MESSAGE_QUEUE.
+
+Starts --workers server processes on one seeded database, all sharing the
+message queue (a local SQLite queue unless --queue is given), and connects
+--clients websocket clients to each of them, every one joined to the same
+project room. Then:
+
+1. --publishers standalone write-only emitters (what `flask jobs work` uses)
+   each publish --messages numbered events to the room at once; every client
+   must receive every publisher's events, each publisher's in order
+   (cross-process room delivery, ordering)
+2. a client of the first worker moves a task back and forth; the
+   `task_status_changed` broadcast is sent by whichever process's job worker
+   picks it up and is timed on the clients of every worker (latency through
+   the queue)
+
+Exits with status 1 when an event is lost or arrives out of order.
+
+    python bench_message_queue.py --workers 3 --clients 20 --publishers 3 --messages 200
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from bench_socketio import BenchClient, login, measure_broadcast, percentile, start_server, stop_server
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+EVENT = 'queue_check'
+
+
+def publish(queue, channel, room, publisher, messages):
+    """Child process: emit `messages` numbered events to `room` through a write-only manager"""
+    sys.path.insert(0, ROOT)
+    from app.message_queue import queue_manager
+
+    emitter = queue_manager({'SOCKETIO_MESSAGE_QUEUE': queue, 'SOCKETIO_CHANNEL': channel}, write_only=True)
+    for n in range(messages):
+        emitter.emit(EVENT, {'publisher': publisher, 'n': n}, namespace='/', room=room)
+
+
+def check_order(clients, publishers, messages):
+    """(lost, reordered) event counts over all clients"""
+    lost = reordered = 0
+    for client in clients:
+        received = defaultdict(list)
+        for event, data in client.received:
+            if event == EVENT:
+                received[data['publisher']].append(data['n'])
+        for publisher in range(publishers):
+            numbers = received[publisher]
+            lost += messages - len(set(numbers))
+            reordered += sum(1 for a, b in zip(numbers, numbers[1:]) if b < a)
+    return lost, reordered
+
+
+def wait_for(clients, expected, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(sum(1 for event, _ in client.received if event == EVENT) >= expected for client in clients):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=20, help='clients per worker')
+    parser.add_argument('--publishers', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=200, help='events per publisher')
+    parser.add_argument('--rounds', type=int, default=10, help='task_status_changed broadcasts to time')
+    parser.add_argument('--queue', help='SOCKETIO_MESSAGE_QUEUE (default: a sqlite queue in a temp dir)')
+    parser.add_argument('--channel', default='bench-message-queue')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--project-id', type=int, default=1)
+    parser.add_argument('--task-id', type=int, default=1)
+    parser.add_argument('--publish', type=int, metavar='PUBLISHER', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    room = f'project_{args.project_id}'
+    if args.publish is not None:
+        publish(args.queue, args.channel, room, args.publish, args.messages)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        queue = args.queue or f'sqlite:///{os.path.join(workdir, "queue.db")}'
+        env = {'SOCKETIO_MESSAGE_QUEUE': queue, 'SOCKETIO_CHANNEL': args.channel}
+        database = os.path.join(workdir, 'app.db')
+        servers, clients = [], []
+        failed = False
+        try:
+            # One at a time: the first worker creates and seeds the database
+            for _ in range(args.workers):
+                servers.append(start_server('threading', workdir, database=database, env=env))
+
+            for _, port in servers:
+                cookie = login(port, 'admin', 'admin123')
+                clients.extend(
+                    BenchClient(port, cookie, args.timeout, args.project_id) for _ in range(args.clients)
+                )
+            print(f'\n== {args.workers} workers, {len(clients)} clients, queue {queue.split("://")[0]}')
+
+            started = time.monotonic()
+            publishers = [
+                subprocess.Popen([
+                    sys.executable, os.path.abspath(__file__), '--publish', str(publisher),
+                    '--queue', queue, '--channel', args.channel, '--messages', str(args.messages),
+                    '--project-id', str(args.project_id),
+                ])
+                for publisher in range(args.publishers)
+            ]
+            for process in publishers:
+                process.wait()
+            complete = wait_for(clients, args.publishers * args.messages, args.timeout)
+            elapsed = time.monotonic() - started
+            lost, reordered = check_order(clients, args.publishers, args.messages)
+            failed = not complete or lost or reordered
+            print(f'   ordering:    {args.publishers}x{args.messages} events to {len(clients)} clients '
+                  f'in {elapsed:.2f}s, lost={lost} out of order={reordered} -> {"FAIL" if failed else "ok"}')
+
+            broadcast = measure_broadcast(clients, args.project_id, args.task_id, args.rounds)
+            print(f'   broadcast:   {len(broadcast)}/{args.rounds * len(clients)} deliveries, '
+                  f'p50={percentile(broadcast, 50) * 1000:.1f}ms p99={percentile(broadcast, 99) * 1000:.1f}ms')
+        finally:
+            for client in clients:
+                client.close()
+            for process, _ in servers:
+                stop_server(process)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
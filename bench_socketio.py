@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Socket.IO capacity benchmark per async mode.
+
+For every requested SOCKETIO_ASYNC_MODE this starts the app in a child
+process (`python app.py`-style, monkey patching included) on a fresh seeded
+database, then from this process:
+
+1. opens websocket clients (connect + join_project) in steps until
+   --max-clients or until a connect fails or takes longer than --timeout
+   (max concurrent connections)
+2. moves a task back and forth over the socket; every client times the
+   `task_status_changed` broadcast (emit latency, end to end through the
+   job queue)
+3. has every client send `ping` at once and times the `pong` (handler
+   round trip while all sockets are busy)
+
+The clients speak Engine.IO v4 directly over simple-websocket, which
+Flask-SocketIO already depends on. Modes whose library is not installed
+are skipped.
+
+    python bench_socketio.py --modes threading eventlet gevent --max-clients 1000
+"""
+
+import argparse
+import http.cookiejar
+import importlib.util
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import simple_websocket
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def serve(mode, port, database):
+    """Child process: run the app in `mode` on `port`"""
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    os.environ['SOCKETIO_ASYNC_MODE'] = mode
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.chdir(os.path.dirname(database))
+    sys.path.insert(0, ROOT)
+
+    from app import create_app
+    from app.extensions import db, socketio
+    from app.models import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        if User.query.first() is None:
+            import seed
+            seed.create_demo_data()
+    socketio.run(app, host='127.0.0.1', port=port, debug=False, use_reloader=False,
+                 log_output=False, allow_unsafe_werkzeug=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, workdir, database=None, env=None):
+    """Serve the app in a child process; `env` is added to its environment"""
+    port = free_port()
+    database = database or os.path.join(workdir, f'{mode}.db')
+    log_path = os.path.join(workdir, f'{mode}-{port}.log')
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'bench_socketio.py'), '--serve', mode, '--port', str(port),
+             '--database', database],
+            stdout=subprocess.DEVNULL, stderr=log, env=dict(os.environ, **(env or {})),
+        )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log_path, errors='replace') as log:
+                raise RuntimeError(log.read()[-2000:])
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+def login(port, username, password):
+    """Session cookie header for `username`"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    base = f'http://127.0.0.1:{port}'
+    page = opener.open(f'{base}/auth/login').read().decode()
+    token = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', page).group(1)
+    opener.open(f'{base}/auth/login', urllib.parse.urlencode(
+        {'csrf_token': token, 'username': username, 'password': password}
+    ).encode())
+    return '; '.join(f'{cookie.name}={cookie.value}' for cookie in jar)
+
+
+class BenchClient:
+    """Minimal Socket.IO client: Engine.IO v4 over a websocket, default namespace"""
+
+    def __init__(self, port, cookie, timeout, project_id):
+        self.arrivals = {}  # seq -> monotonic arrival time
+        self.received = []  # (event, data) of every event after the join, in arrival order
+        self.pong_at = None
+        self.pong = threading.Event()
+        self.closed = False
+        self.ws = simple_websocket.Client.connect(
+            f'ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket', headers={'Cookie': cookie}
+        )
+        packet = self.ws.receive(timeout=timeout)
+        if packet is None or not packet.startswith('0'):
+            raise ConnectionError('no Engine.IO handshake')
+        self.ws.send('40')
+        while True:
+            packet = self.ws.receive(timeout=timeout)
+            if packet is None:
+                raise TimeoutError('connect timed out')
+            if packet.startswith('44'):
+                raise ConnectionError('connection refused')
+            if packet.startswith('42["connected"'):
+                break
+        # Project rooms are joined on demand, as the board page does
+        self.emit('join_project', {'project_id': project_id})
+        while True:
+            packet = self.ws.receive(timeout=timeout)
+            if packet is None:
+                raise TimeoutError('join_project timed out')
+            if packet.startswith('42["joined_project"'):
+                break
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        while not self.closed:
+            try:
+                packet = self.ws.receive(timeout=1)
+            except simple_websocket.ConnectionClosed:
+                return
+            if packet is None:
+                continue
+            if packet == '2':
+                self.ws.send('3')
+            elif packet.startswith('42'):
+                event, *args = json.loads(packet[2:])
+                if event == 'batch':
+                    # Coalesced project events
+                    items = [(item['event'], item['data']) for item in args[0]['events']]
+                else:
+                    items = [(event, args[0] if args else None)]
+                for event, data in items:
+                    self.received.append((event, data))
+                    if event == 'task_status_changed':
+                        self.arrivals[data['seq']] = time.monotonic()
+                    elif event == 'pong':
+                        self.pong_at = time.monotonic()
+                        self.pong.set()
+
+    def emit(self, event, data=None):
+        self.ws.send('42' + json.dumps([event] if data is None else [event, data]))
+
+    def close(self):
+        self.closed = True
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def connect_clients(port, cookie, args):
+    clients, connect_times = [], []
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def open_one():
+        started = time.monotonic()
+        try:
+            client = BenchClient(port, cookie, args.timeout, args.project_id)
+        except Exception:
+            failed.set()
+            return
+        elapsed = time.monotonic() - started
+        with lock:
+            clients.append(client)
+            connect_times.append(elapsed)
+        if elapsed > args.timeout:
+            failed.set()
+
+    while len(clients) < args.max_clients and not failed.is_set():
+        step = min(args.step, args.max_clients - len(clients))
+        threads = [threading.Thread(target=open_one) for _ in range(step)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return clients, connect_times
+
+
+def measure_broadcast(clients, project_id, task_id, rounds):
+    latencies = []
+    sender = clients[0]
+    for i in range(rounds):
+        before = set(sender.arrivals)
+        sent_at = time.monotonic()
+        sender.emit('task_status_update', {
+            'task_id': task_id, 'project_id': project_id, 'new_status': 'Doing' if i % 2 == 0 else 'ToDo'
+        })
+        deadline = sent_at + 10
+        while time.monotonic() < deadline and set(sender.arrivals) == before:
+            time.sleep(0.005)
+        new = set(sender.arrivals) - before
+        if not new:
+            continue
+        seq = new.pop()
+        # Give the slowest clients a moment to receive it as well
+        while time.monotonic() < deadline and not all(seq in client.arrivals for client in clients):
+            time.sleep(0.005)
+        latencies.extend(client.arrivals[seq] - sent_at for client in clients if seq in client.arrivals)
+    return latencies
+
+
+def measure_ping(clients):
+    for client in clients:
+        client.pong.clear()
+    sent_at = time.monotonic()
+    for client in clients:
+        client.emit('ping')
+    for client in clients:
+        client.pong.wait(timeout=10)
+    return [client.pong_at - sent_at for client in clients if client.pong.is_set()]
+
+
+def bench_mode(mode, args, workdir):
+    process, port = start_server(mode, workdir)
+    clients = []
+    try:
+        cookie = login(port, 'admin', 'admin123')
+        clients, connect_times = connect_clients(port, cookie, args)
+        print(f'\n== {mode}')
+        print(f'   connections: {len(clients)} (p50 connect {percentile(connect_times, 50) * 1000:.1f}ms, '
+              f'p99 {percentile(connect_times, 99) * 1000:.1f}ms)')
+        if not clients:
+            return
+
+        broadcast = measure_broadcast(clients, args.project_id, args.task_id, args.rounds)
+        print(f'   broadcast:   {len(broadcast)} deliveries, p50={percentile(broadcast, 50) * 1000:.1f}ms '
+              f'p99={percentile(broadcast, 99) * 1000:.1f}ms')
+
+        pings = measure_ping(clients)
+        print(f'   ping burst:  {len(pings)}/{len(clients)} answered, p50={percentile(pings, 50) * 1000:.1f}ms '
+              f'p99={percentile(pings, 99) * 1000:.1f}ms')
+    finally:
+        for client in clients:
+            client.close()
+        stop_server(process)
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['threading', 'eventlet', 'gevent'])
+    parser.add_argument('--max-clients', type=int, default=500)
+    parser.add_argument('--step', type=int, default=50, help='connections opened concurrently per step')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds a connect may take')
+    parser.add_argument('--rounds', type=int, default=10, help='broadcasts to time')
+    parser.add_argument('--project-id', type=int, default=1)
+    parser.add_argument('--task-id', type=int, default=1)
+    parser.add_argument('--serve', metavar='MODE', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.database)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in args.modes:
+            if mode != 'threading' and importlib.util.find_spec(mode) is None:
+                print(f'\n== {mode}\n   skipped: {mode} is not installed')
+                continue
+            bench_mode(mode, args, workdir)
+
+
+if __name__ == '__main__':
+    main()
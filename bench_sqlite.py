@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reader/writer concurrency benchmark for the SQLite engine profile.
+
+Runs the same mixed workload (writers inserting activity rows one commit at a
+time, readers running the dashboard-style queries) against a fresh database
+twice: once with a bare engine, as before the profile existed, and once with
+the configured pragmas and pool sizing.
+
+    python bench_sqlite.py --readers 8 --writers 4 --seconds 10
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import install_sqlite_profile, sqlite_pragmas, effective_pragmas
+
+DEFAULT_PROFILE = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_CACHE_SIZE': -65536,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_TEMP_STORE': 'MEMORY',
+}
+
+
+def setup_schema(engine, rows):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            'CREATE TABLE activity_log (id INTEGER PRIMARY KEY, entity_id INTEGER, '
+            'description TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)'
+        )
+        conn.exec_driver_sql('CREATE INDEX ix_activity_log_created_at ON activity_log (created_at)')
+        conn.exec_driver_sql(
+            'INSERT INTO activity_log (entity_id, description) '
+            f'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {int(rows)}) '
+            "SELECT i, printf('row %d', i) FROM n"
+        )
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_workload(engine, readers, writers, seconds):
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {'reads': [], 'writes': [], 'locked': 0, 'errors': 0}
+
+    def record(kind, elapsed):
+        with lock:
+            stats[kind].append(elapsed)
+
+    def writer(worker_id):
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(
+                        text('INSERT INTO activity_log (entity_id, description) VALUES (:e, :d)'),
+                        {'e': worker_id, 'd': f'writer {worker_id} row {i}'}
+                    )
+                record('writes', time.perf_counter() - started)
+            except OperationalError as e:
+                with lock:
+                    stats['locked' if 'locked' in str(e) else 'errors'] += 1
+            i += 1
+
+    def reader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text('SELECT count(*) FROM activity_log')).scalar()
+                    conn.execute(text(
+                        'SELECT id, description FROM activity_log ORDER BY created_at DESC LIMIT 50'
+                    )).fetchall()
+                record('reads', time.perf_counter() - started)
+            except OperationalError as e:
+                with lock:
+                    stats['locked' if 'locked' in str(e) else 'errors'] += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return stats
+
+
+def report(label, stats, seconds):
+    reads, writes = stats['reads'], stats['writes']
+    print(f'\n== {label}')
+    print(f'   reads : {len(reads) / seconds:9.1f}/s  p50={percentile(reads, 50) * 1000:7.2f}ms  '
+          f'p99={percentile(reads, 99) * 1000:7.2f}ms')
+    print(f'   writes: {len(writes) / seconds:9.1f}/s  p50={percentile(writes, 50) * 1000:7.2f}ms  '
+          f'p99={percentile(writes, 99) * 1000:7.2f}ms')
+    print(f'   "database is locked": {stats["locked"]}   other errors: {stats["errors"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rows', type=int, default=50000, help='rows preloaded into the table')
+    args = parser.parse_args()
+
+    pool_size = args.readers + args.writers
+    workdir = tempfile.mkdtemp(prefix='bench_sqlite_')
+
+    # Before: bare engine, rollback journal, SQLAlchemy default pool
+    before_url = 'sqlite:///' + os.path.join(workdir, 'before.db')
+    before = create_engine(before_url)
+    setup_schema(before, args.rows)
+    report('before (default engine)', run_workload(before, args.readers, args.writers, args.seconds), args.seconds)
+    before.dispose()
+
+    # After: configured profile applied through the connect event
+    after_url = 'sqlite:///' + os.path.join(workdir, 'after.db')
+    after = create_engine(after_url, pool_size=pool_size, max_overflow=0, pool_timeout=30)
+    install_sqlite_profile(after, sqlite_pragmas(DEFAULT_PROFILE))
+    setup_schema(after, args.rows)
+    print('\n   pragmas: ' + ', '.join(f'{k}={v}' for k, v in effective_pragmas(after).items()))
+    report('after (SQLite profile)', run_workload(after, args.readers, args.writers, args.seconds), args.seconds)
+    after.dispose()
+
+
+if __name__ == '__main__':
+    main()